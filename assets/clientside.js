@@ -0,0 +1,93 @@
+/*
+ * Clientside callbacks for SpecMod Dash.
+ *
+ * update_bandwidth_lines is a port of src.utils.update_bandwidth_lines, it
+ * moves the "new bandwidth start/end" lines as the slider is dragged without
+ * a round trip to the server. Keep the two in step.
+ *
+ * unpack_figure decodes the typed array specs made by src.transport into
+ * Float32Arrays, which plotly.js draws directly.
+ */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    specmod: {
+        unpack_figure: function(packed) {
+
+            if (packed == null) {
+                return window.dash_clientside.no_update;
+            }
+
+            var types = {f4: Float32Array, f8: Float64Array, i4: Int32Array};
+
+            var unpack = function(value) {
+                if (value == null || value.bdata === undefined) {
+                    return value;
+                }
+                var bytes = atob(value.bdata);
+                var buffer = new Uint8Array(bytes.length);
+                for (var i = 0; i < bytes.length; i++) {
+                    buffer[i] = bytes.charCodeAt(i);
+                }
+                return new types[value.dtype](buffer.buffer);
+            };
+
+            var data = packed.data.map(function(trace) {
+                return Object.assign({}, trace, {
+                    x: unpack(trace.x), 
+                    y: unpack(trace.y)
+                });
+            });
+
+            return Object.assign({}, packed, {data: data});
+        },
+
+        update_bandwidth_lines: function(npos, fig, store) {
+
+            if (npos == null || fig == null || store == null) {
+                return window.dash_clientside.no_update;
+            }
+
+            var data = fig.data.slice();
+
+            // the automatic bandwidth lines are drawn at 10 ** pos by the server
+            var isAuto = function(pos) {
+                var v = Math.pow(10, pos);
+                return data.some(function(trace) {
+                    return Math.abs(trace.x[0] - v) <= 1e-12 * Math.abs(v);
+                });
+            };
+
+            if (store.snr) {
+                ['start', 'end'].forEach(function(nm, j) {
+
+                    var name = 'new bandwidth ' + nm;
+                    var x = [Math.pow(10, npos[j]), Math.pow(10, npos[j])];
+
+                    if (isAuto(npos[j])) {
+                        return;
+                    }
+
+                    var i = data.findIndex(function(trace) {
+                        return trace.name === name;
+                    });
+
+                    if (i >= 0) {
+                        data[i] = Object.assign({}, data[i], {x: x});
+                    } else {
+                        data.push({
+                            type: 'scatter',
+                            x: x,
+                            y: fig.layout.yaxis.range.map(function(r) {
+                                return Math.pow(10, r);
+                            }),
+                            mode: 'lines',
+                            line: {width: 3, dash: 'dash', color: 'green'},
+                            name: name
+                        });
+                    }
+                });
+            }
+
+            return Object.assign({}, fig, {data: data});
+        }
+    }
+});
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+batch_review.py
+    Applies review decisions from a CSV or JSONL file to many events
+    without the app, using the same logic as saving in SpecMod Dash.
+    Each event is handled by one worker of a process pool.
+
+    python batch_review.py decisions.csv --dry-run --diff
+    python batch_review.py decisions.jsonl --units linear --workers 8
+
+    Each record needs "event", "station" and "snr" and, for stations that
+    can be modeled, "min_bf" and "max_bf" (see src.utils.read_decisions).
+"""
+
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.utils import get_config, read_decisions
+from src.specroutines import write_event_specs
+
+
+def format_change(change: dict) -> str:
+    """
+    Formats a station change from write_event_specs as a diff line.
+    """
+    old, new = change["old"], change["new"]
+    return (f"  {change['station']}: snr {old['snr']} -> {new['snr']}, "
+            f"ubfreqs {old['ubfreqs']} -> {new['ubfreqs']}")
+
+
+def main(argv=None):
+
+    config = get_config()
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("decisions",
+        help="The decisions file (.csv or .jsonl).")
+    parser.add_argument("--pdir",
+        default=config["event-path"]["parent-directory"],
+        help="The parent directory of the events.")
+    parser.add_argument("--units", choices=("log10", "linear"),
+        default="log10", help="The units of min_bf and max_bf (Hz).")
+    parser.add_argument("--workers", type=int, default=None,
+        help="The number of worker processes. Default is the CPU count.")
+    parser.add_argument("--dry-run", action="store_true",
+        help="Work out the changes without writing them.")
+    parser.add_argument("--diff", action="store_true",
+        help="Print the changes made to each station.")
+    args = parser.parse_args(argv)
+
+    backend = config.get("storage", {}).get("backend", "pickle")
+
+    data = read_decisions(args.decisions, args.units)
+
+    t0 = time.perf_counter()
+    failed = 0
+    nsta = 0
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(write_event_specs, args.pdir, ev, stas, backend,
+                        args.dry_run): ev
+            for ev, stas in data.items()
+            }
+        for fut in as_completed(futures):
+            ev, report = futures[fut], fut.result()
+            if report["error"] is not None:
+                failed += 1
+                print(f"{ev}: failed, {report['error']}")
+                continue
+            nsta += report["stations"]
+            verb = "would change" if args.dry_run else "changed"
+            print(f"{ev}: {verb} {report['stations']} station(s) "
+                  f"in {report['seconds']:.2f} s")
+            if args.diff:
+                for change in report["changes"]:
+                    print(format_change(change))
+
+    secs = time.perf_counter() - t0
+    print(f"{len(data)} events ({nsta} stations, {failed} failed) in "
+          f"{secs:.2f} s, {len(data) / secs:.1f} events/s")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
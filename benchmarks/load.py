@@ -0,0 +1,524 @@
+"""
+load.py
+
+    Load tests SpecMod Dash with concurrent simulated reviewers. Each
+    reviewer opens the app, picks an event, steps through its stations,
+    drags the bandwidth, stages changes and saves, through the same
+    /_dash-update-component requests the browser makes. The latency of
+    every callback, the throughput and the memory of the server over time
+    are written as JSON.
+
+    python -m benchmarks.load --users 8 --events 20 --stations 50
+    python -m benchmarks.load --users 16 --server-bandwidth --out load.json
+    python -m benchmarks.load --url http://host:8050 --pid 1234 --users 4
+
+    By default a server is started on synthetic events. With --url an
+    already running server is tested instead, its memory is followed if
+    its --pid is given.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.synthetic import make_events
+from benchmarks.run import REPO, git_revision
+
+# starts the app on the given port, run in a fresh interpreter
+SERVER = """
+import sys
+import main
+main.app.run_server(host="127.0.0.1", port=int(sys.argv[1]), debug=False,
+                    threaded=True)
+"""
+
+
+def percentiles(times: List[float]) -> dict:
+    """
+    Returns:
+        stats (dict): The number of calls and the p50, p95, p99, mean and
+            max latency in milliseconds.
+    """
+    if not times:
+        return {"n": 0}
+    ms = np.asarray(times) * 1e3
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"n": len(times), "p50": p50, "p95": p95, "p99": p99,
+            "mean": ms.mean(), "max": ms.max()}
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    """
+    Returns:
+        rss (float): The resident memory of a process in MB, None where
+            /proc is not available.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class MemorySampler(threading.Thread):
+    """
+    Samples the resident memory of the server every interval seconds.
+    """
+
+    def __init__(self, pid: Optional[int], interval: float = 1.0):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._done = threading.Event()
+        self._t0 = time.perf_counter()
+
+    def sample(self) -> None:
+        rss = rss_mb(self.pid) if self.pid is not None else None
+        if rss is not None:
+            self.samples.append((time.perf_counter() - self._t0, rss))
+
+    def run(self) -> None:
+        while not self._done.wait(self.interval):
+            self.sample()
+
+    def stop(self) -> dict:
+        self._done.set()
+        self.join()
+        self.sample()
+        if not self.samples:
+            return {}
+        rss = [m for _, m in self.samples]
+        return {"start_mb": rss[0], "end_mb": rss[-1], "peak_mb": max(rss),
+                "growth_mb": rss[-1] - rss[0], "samples": self.samples}
+
+
+class Stats:
+    """
+    The latencies and errors of the callbacks of every simulated reviewer.
+    """
+
+    def __init__(self):
+        self.times: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        # the first error of each callback
+        self.messages: Dict[str, str] = {}
+        self.sessions = 0
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float,
+            error: Optional[str] = None) -> None:
+        with self._lock:
+            self.times.setdefault(name, []).append(seconds)
+            if error is not None:
+                self.errors[name] = self.errors.get(name, 0) + 1
+                self.messages.setdefault(name, error)
+
+    def session(self) -> None:
+        with self._lock:
+            self.sessions += 1
+
+
+class Reviewer:
+    """
+    A simulated browser session. Like the Dash renderer, it keeps the
+    value of every component property, sends the server callbacks whose
+    inputs change and applies their outputs, which may in turn fire more
+    callbacks. Clientside callbacks run in the browser and are skipped.
+
+    Args:
+        url (str): The address of the app.
+        stats (Stats): Where the latencies are recorded.
+        think (float): The mean seconds between the actions of the
+            reviewer. Default is 0.
+        seed (int): The seed of the reviewer's choices.
+    """
+
+    def __init__(self, url: str, stats: Stats, think: float = 0.0,
+                 seed: int = 0):
+        self.url = url.rstrip("/")
+        self.stats = stats
+        self.think = think
+        self.rng = random.Random(seed)
+        self.props = {}
+        self.callbacks = []
+
+    def request(self, path: str, body: Optional[dict] = None):
+        data = None if body is None else json.dumps(body).encode()
+        req = urllib.request.Request(
+            self.url + path, data=data,
+            headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=120) as r:
+            raw = r.read()
+            return json.loads(raw) if raw else None
+
+    def pause(self) -> None:
+        if self.think:
+            time.sleep(self.rng.expovariate(1 / self.think))
+
+    def open(self) -> None:
+        """
+        Loads the app, as a new browser tab does, and runs the callbacks
+        fired on page load.
+        """
+        t0 = time.perf_counter()
+        layout = self.request("/_dash-layout")
+        self.callbacks = [
+            c for c in self.request("/_dash-dependencies")
+            if not c.get("clientside_function")]
+        self.stats.add("page load", time.perf_counter() - t0)
+
+        self.props = {}
+        stack = [layout]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(node)
+            elif isinstance(node, dict) and "props" in node:
+                props = node["props"]
+                if isinstance(props.get("id"), str):
+                    for k, v in props.items():
+                        self.props[f"{props['id']}.{k}"] = v
+                stack.append(props.get("children"))
+
+        # each callback runs once, after the callbacks that give its inputs
+        keys = lambda deps: {f"{d['id']}.{d['property']}" for d in deps}
+        pending = [c for c in self.callbacks
+                   if not c.get("prevent_initial_call")]
+        while pending:
+            outputs = set().union(*(self.outputs(c) for c in pending))
+            ready = [c for c in pending
+                     if not keys(c["inputs"]) & outputs] or pending[:1]
+            for c in ready:
+                self.call(c, [])
+                pending.remove(c)
+
+    @staticmethod
+    def outputs(callback: dict) -> set:
+        return {o for o in callback["output"].strip(".").split("...")}
+
+    def call(self, callback: dict, changed: List[str]) -> List[str]:
+        """
+        Sends a callback to the server and applies its outputs.
+
+        Args:
+            callback (dict): The callback, as listed by the server.
+            changed (list): The inputs that changed, as "id.prop".
+
+        Returns:
+            changed (list): The properties changed by the callback.
+        """
+        value = lambda d: {**d, "value": self.props.get(
+            f"{d['id']}.{d['property']}")}
+        output = callback["output"]
+        outputs = [dict(zip(("id", "property"), o.rsplit(".", 1)))
+                   for o in output.strip(".").split("...")]
+        body = {
+            "output": output,
+            "outputs": outputs if output.startswith("..") else outputs[0],
+            "inputs": [value(d) for d in callback["inputs"]],
+            "state": [value(d) for d in callback["state"]],
+            "changedPropIds": changed,
+        }
+
+        name = "{} -> {}".format(
+            changed[0] if changed else "page load",
+            "/".join(dict.fromkeys(o["id"] for o in outputs)))
+        t0 = time.perf_counter()
+        try:
+            res, error = self.request("/_dash-update-component", body), None
+        except OSError as e:
+            res, error = None, f"{type(e).__name__}: {e}"
+        self.stats.add(name, time.perf_counter() - t0, error)
+
+        out = []
+        for cid, props in ((res or {}).get("response") or {}).items():
+            for k, v in props.items():
+                self.props[f"{cid}.{k}"] = v
+                out.append(f"{cid}.{k}")
+        return out
+
+    def set(self, **props) -> None:
+        """
+        Sets properties as the reviewer would (e.g., set(**{"event-dropdown.
+        value": ev})) and runs the callbacks they fire, in turn.
+        """
+        self.props.update(props)
+        changed = list(props)
+        while changed:
+            fired = [c for c in self.callbacks if any(
+                f"{d['id']}.{d['property']}" in changed
+                for d in c["inputs"])]
+            changed = []
+            for c in fired:
+                keys = [f"{d['id']}.{d['property']}" for d in c["inputs"]]
+                changed += self.call(c, [k for k in props if k in keys]
+                                     or keys[:1])
+            props = dict.fromkeys(changed)
+
+    def click(self, button: str) -> None:
+        key = f"{button}.n_clicks"
+        self.set(**{key: (self.props.get(key) or 0) + 1})
+
+    def save(self, timeout: float = 300.0) -> None:
+        """
+        Saves the session and follows the progress of the save until it
+        is done, as the save-poll interval does in the browser.
+        """
+        t0 = time.perf_counter()
+        self.click("commit-change")
+        if self.props.get("save-poll.disabled", True):
+            # nothing was staged
+            return
+        interval = (self.props.get("save-poll.interval") or 500) / 1e3
+        while (not self.props.get("save-poll.disabled", True)
+               and time.perf_counter() - t0 < timeout):
+            time.sleep(interval)
+            key = "save-poll.n_intervals"
+            self.set(**{key: (self.props.get(key) or 0) + 1})
+        self.stats.add("save (until done)", time.perf_counter() - t0)
+
+    def review(self, stations: int = 10, stage: float = 0.5) -> None:
+        """
+        Reviews an event: picks one at random, steps through its first
+        stations, drags the bandwidth of the ones that can be modeled,
+        stages a change for a share of them and saves.
+
+        Args:
+            stations (int): The number of stations reviewed.
+            stage (float): The share of stations whose change is staged.
+        """
+        evs = [o["value"] for o in self.props.get("event-dropdown.options")
+               or []]
+        if not evs:
+            raise RuntimeError("the app lists no events")
+        self.set(**{"event-dropdown.value": self.rng.choice(evs)})
+        self.pause()
+
+        stas = [o["value"] for o in
+                self.props.get("station-dropdown.options") or []]
+        for sta in stas[:stations]:
+            if self.props.get("station-dropdown.value") != sta:
+                self.set(**{"station-dropdown.value": sta})
+            self.pause()
+
+            # the bandwidth of stations that cannot be modeled is fixed
+            if self.props.get("slider-position.disabled"):
+                continue
+
+            lo = self.props.get("slider-position.min")
+            hi = self.props.get("slider-position.max")
+            for _ in range(3 if lo is not None and hi is not None else 0):
+                a, b = sorted(self.rng.uniform(lo, hi) for _ in range(2))
+                self.set(**{"slider-position.value": [a, b]})
+
+            # stage the new bandwidth, or mark the station unsuitable
+            if self.rng.random() < stage:
+                if self.rng.random() < 0.2:
+                    self.props["snr-pass.value"] = 0
+                self.click("stage-change")
+            self.pause()
+
+        self.save()
+        self.stats.session()
+
+
+def start_server(workdir: str, port: int) -> subprocess.Popen:
+    """
+    Starts the app in workdir and waits until it serves the layout.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (REPO, env.get("PYTHONPATH")) if p)
+    log = open(os.path.join(workdir, "server.log"), "w")
+    server = subprocess.Popen(
+        [sys.executable, "-c", SERVER, str(port)], cwd=workdir, env=env,
+        stdout=log, stderr=subprocess.STDOUT)
+
+    url = f"http://127.0.0.1:{port}/_dash-layout"
+    for _ in range(600):
+        if server.poll() is not None:
+            raise RuntimeError(
+                f"the server exited, see {workdir}/server.log")
+        try:
+            urllib.request.urlopen(url, timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("the server did not start within 60 s")
+
+
+def run(args: argparse.Namespace) -> dict:
+    """
+    Runs the load test.
+
+    Returns:
+        results (dict): The run metadata, the latency of every callback,
+            the throughput and the memory of the server.
+    """
+    workdir, server = None, None
+    url, pid = args.url, args.pid
+    if url is None:
+        workdir = tempfile.mkdtemp(prefix="specmod-load-")
+        pdir = os.path.join(workdir, "Events")
+        make_events(pdir, args.events, args.stations, args.length, args.seed)
+        config = {"event-path": {"parent-directory": pdir}}
+        if args.server_bandwidth:
+            config["display"] = {"clientside-bandwidth": False}
+        with open(os.path.join(workdir, "config.yaml"), "w") as f:
+            json.dump(config, f)
+        server = start_server(workdir, args.port)
+        url, pid = f"http://127.0.0.1:{args.port}", server.pid
+
+    stats = Stats()
+    errors = []
+    memory = MemorySampler(pid, args.sample)
+    memory.sample()
+    memory.start()
+
+    def user(i):
+        rng = random.Random(args.seed + i)
+        # the reviewers do not all arrive at once
+        time.sleep(rng.uniform(0, args.ramp))
+        for s in range(args.sessions):
+            try:
+                reviewer = Reviewer(url, stats, args.think,
+                                    seed=args.seed * 7919 + i * 101 + s)
+                reviewer.open()
+                reviewer.review(args.review_stations, args.stage)
+            except Exception as e:
+                errors.append(f"reviewer {i}: {type(e).__name__}: {e}")
+
+    t0 = time.perf_counter()
+    users = [threading.Thread(target=user, args=(i,))
+             for i in range(args.users)]
+    for u in users:
+        u.start()
+    for u in users:
+        u.join()
+    seconds = time.perf_counter() - t0
+    mem = memory.stop()
+
+    if server is not None:
+        server.terminate()
+        server.wait()
+    if workdir is not None:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {}
+    print(f"\n{'callback':<52} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'errors':>6}")
+    for name in sorted(stats.times):
+        results[name] = {**percentiles(stats.times[name]),
+                         "errors": stats.errors.get(name, 0),
+                         "error": stats.messages.get(name)}
+        r = results[name]
+        print(f"{name[:52]:<52} {r['n']:6d} {r['p50']:9.1f} {r['p95']:9.1f} "
+              f"{r['p99']:9.1f} {r['errors']:6d}")
+
+    requests = sum(len(t) for n, t in stats.times.items()
+                   if n not in ("page load", "save (until done)"))
+    throughput = {
+        "seconds": seconds,
+        "requests": requests,
+        "requests_per_second": requests / seconds,
+        "sessions": stats.sessions,
+        "sessions_per_minute": stats.sessions / seconds * 60,
+    }
+    print(f"\n{requests} callback requests in {seconds:.1f} s "
+          f"({throughput['requests_per_second']:.1f}/s), "
+          f"{stats.sessions} session(s) reviewed")
+    if mem:
+        print(f"server memory {mem['start_mb']:.0f} MB -> "
+              f"{mem['end_mb']:.0f} MB (peak {mem['peak_mb']:.0f} MB)")
+    for name, msg in stats.messages.items():
+        print(f"{name}: {msg}")
+    for e in errors:
+        print(e)
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "time": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "url": args.url,
+            "users": args.users,
+            "sessions": args.sessions,
+            "events": args.events,
+            "stations": args.stations,
+            "length": args.length,
+            "review_stations": args.review_stations,
+            "think": args.think,
+            "server_bandwidth": args.server_bandwidth,
+        },
+        "results": results,
+        "throughput": throughput,
+        "memory": mem,
+        "errors": errors,
+    }
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=8,
+        help="The number of concurrent reviewers.")
+    parser.add_argument("--sessions", type=int, default=1,
+        help="The number of events each reviewer reviews and saves.")
+    parser.add_argument("--review-stations", type=int, default=10,
+        help="The number of stations reviewed per event.")
+    parser.add_argument("--stage", type=float, default=0.5,
+        help="The share of reviewed stations with a staged change.")
+    parser.add_argument("--think", type=float, default=0.0,
+        help="The mean seconds between the actions of a reviewer.")
+    parser.add_argument("--ramp", type=float, default=2.0,
+        help="The seconds over which the reviewers arrive.")
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--stations", type=int, default=50)
+    parser.add_argument("--length", type=int, default=2048,
+        help="The number of frequency bins per spectrum.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server-bandwidth", action="store_true",
+        help="Move the bandwidth lines on the server rather than in the "
+             "browser, so dragging the slider makes requests.")
+    parser.add_argument("--port", type=int, default=8071,
+        help="The port of the server started for the test.")
+    parser.add_argument("--url", default=None,
+        help="Test a running server instead of starting one.")
+    parser.add_argument("--pid", type=int, default=None,
+        help="The process id of the server given by --url.")
+    parser.add_argument("--sample", type=float, default=1.0,
+        help="The seconds between samples of the server memory.")
+    parser.add_argument("--out", default="load.json",
+        help="The JSON file to write the results to.")
+    args = parser.parse_args(argv)
+
+    out = os.path.abspath(args.out)
+    results = run(args)
+
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nwrote {out}")
+
+    return 1 if results["errors"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""
+run.py
+
+    Times the hot paths of SpecMod Dash on synthetic events and records the
+    JSON payload size of the callbacks. The results are written as JSON so
+    runs of different versions can be compared.
+
+    python -m benchmarks.run --events 5 --stations 200 --length 4096
+    python -m benchmarks.run --out new.json --compare old.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from typing import Callable, List
+
+from benchmarks.synthetic import make_events
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed(fn: Callable, repeat: int, setup: Callable = None) -> List[float]:
+    """
+    Times repeated calls of fn.
+
+    Args:
+        fn (Callable): The function to time, called with no arguments.
+        repeat (int): The number of calls.
+        setup (Callable): Called (untimed) before each call. Default is None.
+
+    Returns:
+        times (list): The wall time of each call in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def summarise(times: List[float]) -> dict:
+    """
+    Returns:
+        stats (dict): The number of calls and timing statistics (seconds).
+    """
+    return {
+        "n": len(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "min": min(times),
+        "max": max(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+    }
+
+
+def to_json(obj) -> str:
+    """
+    Returns:
+        js (str): obj encoded as JSON the way Dash does.
+    """
+    import plotly
+    return json.dumps(obj, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def payload_bytes(obj) -> int:
+    """
+    Returns:
+        nbytes (int): The size of obj encoded as JSON.
+    """
+    return len(to_json(obj).encode())
+
+
+def load_app(workdir: str, pdir: str):
+    """
+    Imports main.py with a config pointing at the synthetic events.
+
+    Args:
+        workdir (str): The working directory to write config.yaml to.
+        pdir (str): The parent directory of the synthetic events.
+
+    Returns:
+        main (module): The imported app module.
+    """
+    with open(os.path.join(workdir, "config.yaml"), "w") as f:
+        json.dump({"event-path": {"parent-directory": pdir}}, f)
+    os.chdir(workdir)
+    if REPO not in sys.path:
+        sys.path.insert(0, REPO)
+    import main
+    return main
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args: argparse.Namespace) -> dict:
+    """
+    Runs the benchmarks.
+
+    Returns:
+        results (dict): The run metadata and the results of each benchmark.
+    """
+    workdir = tempfile.mkdtemp(prefix="specmod-bench-")
+    pdir = os.path.join(workdir, "Events")
+    evs = make_events(pdir, args.events, args.stations, args.length, args.seed)
+
+    main = load_app(workdir, pdir)
+    from src.transport import unpack_figure
+    from src.specroutines import write_specs
+    from src.numerics import smooth_rows
+    from src.cache import smoothing_cache
+    # the functions behind the dash callback decorators
+    cb = lambda name: getattr(main, name).__wrapped__
+
+    ev = evs[0]
+    stas = [s["id"] for s in main.catalog.stations(ev)]
+    sta = stas[0]
+    results = {}
+
+    def record(name, times, **extra):
+        results[name] = {**summarise(times), **extra}
+        print(f"{name:<36} {results[name]['median'] * 1e3:10.2f} ms"
+              + "".join(f"  {k}={v}" for k, v in extra.items()))
+
+    # spectra loading -----------------------------------------------------
+    path = main.source_path(pdir, ev, main.backend)
+    record("get_event_spectra (cold)", timed(
+        lambda: main.get_event_spectra(pdir, ev, backend=main.backend),
+        args.repeat, setup=lambda: main.spectra_cache.invalidate(path)))
+    record("get_event_spectra (cached)", timed(
+        lambda: main.get_event_spectra(pdir, ev, backend=main.backend),
+        args.repeat))
+
+    # callbacks -----------------------------------------------------------
+    # callbacks that read dash.callback_context need a request
+    context = main.app.server.test_request_context()
+    context.push()
+
+    out = cb("update_station_dropdown")(ev, None, None)
+    record("update_station_dropdown", timed(
+        lambda: cb("update_station_dropdown")(ev, None, None), args.repeat),
+        response_bytes=payload_bytes(out))
+
+    sids = iter(range(10**9))
+    store = cb("update_store")(sta, ev, "bench")
+    record("update_store", timed(
+        lambda: cb("update_store")(sta, ev, f"bench-{next(sids)}"),
+        args.repeat), response_bytes=payload_bytes(store))
+
+    snp = main.get_station_spectra(pdir, ev, sta, main.backend)
+    fig_args = (snp.signal.freq, snp.signal.amp, snp.noise.freq,
+                snp.noise.amp, store["snr"],
+                (store["min bf"], store["max bf"]))
+    for label, n in (("decimated", main.max_points), ("full", None)):
+        fig = main.make_fig(*fig_args, max_points=n)
+        record(f"make_fig ({label})", timed(
+            lambda: main.make_fig(*fig_args, max_points=n), args.repeat),
+            response_bytes=payload_bytes(fig))
+
+    # log-frequency smoothing of every station of the event at once, with
+    # the weight matrix built then cached
+    sp = main.get_event_spectra(pdir, ev, backend=main.backend)
+    amps = [sp.get_spectra(s).signal.amp for s in stas]
+    smooth = lambda: smooth_rows(snp.signal.freq, amps, "konno-ohmachi")
+    record("smooth_rows (event, cold)", timed(
+        smooth, args.repeat, setup=smoothing_cache.invalidate))
+    record("smooth_rows (event, cached)", timed(smooth, args.repeat))
+
+    # step through the stations as a reviewer would
+    stores = [cb("update_store")(s, ev, "bench") for s in stas]
+    steps = iter(stores * (args.repeat // len(stores) + 1))
+    out = cb("display_graph_initial")(store, [])
+    record("display_graph_initial", timed(
+        lambda: cb("display_graph_initial")(next(steps), []),
+        args.repeat), response_bytes=payload_bytes(out))
+
+    # staging a change only redraws the decision over the cached base
+    flips = iter(range(10**9))
+    record("display_graph_initial (staged)", timed(
+        lambda: cb("display_graph_initial")(
+            dict(store, snr=next(flips) % 2), []), args.repeat),
+        figure_cache_hits=main.figure_cache.hits)
+
+    # the figure as the browser sends it back, once decoded
+    fig = unpack_figure(json.loads(to_json(out[0])))
+    npos = [store["min bf"] + 0.1, store["max bf"] - 0.1]
+    new = main.display_graph_update(npos, fig, store)
+    record("display_graph_update", timed(
+        lambda: main.display_graph_update(npos, fig, store), args.repeat),
+        request_bytes=payload_bytes([npos, fig, store]),
+        response_bytes=payload_bytes(new))
+
+    # one station across every event, cold then from the figure cache
+    view = lambda: cb("display_station_view")(sta, "overlay", "all", True)
+    record("display_station_view (cold)", timed(
+        view, args.repeat, setup=main.figure_cache.invalidate),
+        response_bytes=payload_bytes(view()))
+    record("display_station_view (cached)", timed(view, args.repeat))
+
+    # saving --------------------------------------------------------------
+    flip = iter(range(10**9))
+    def save():
+        snr = next(flip) % 2
+        data = {e: {sta: {"snr": snr, "min bf": 0.0, "max bf": 1.0}}
+                for e in evs}
+        report = write_specs(pdir, data, backend=main.backend)
+        assert all(r["error"] is None for r in report.values()), report
+    record("write_specs (all events)", timed(save, args.repeat))
+
+    context.pop()
+    os.chdir(REPO)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "time": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "events": args.events,
+            "stations": args.stations,
+            "length": args.length,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(new: dict, old: dict, threshold: float) -> List[str]:
+    """
+    Compares two benchmark runs.
+
+    Args:
+        new (dict): The results of the new run.
+        old (dict): The results of the old run.
+        threshold (float): The relative slow down of the median (e.g., 0.2
+            for 20 %) above which a benchmark counts as a regression.
+
+    Returns:
+        regressions (list): The names of the benchmarks that regressed.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<36} {'old ms':>10} {'new ms':>10} {'ratio':>7}")
+    for name, res in new["results"].items():
+        if name not in old["results"]:
+            continue
+        a, b = old["results"][name]["median"], res["median"]
+        ratio = b / a if a else float("inf")
+        flag = " *" if ratio > 1 + threshold else ""
+        print(f"{name:<36} {a * 1e3:10.2f} {b * 1e3:10.2f} {ratio:7.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--events", type=int, default=5)
+    parser.add_argument("--stations", type=int, default=100)
+    parser.add_argument("--length", type=int, default=2048,
+        help="The number of frequency bins per spectrum.")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark.json",
+        help="The JSON file to write the results to.")
+    parser.add_argument("--compare", default=None,
+        help="A previous results file to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+        help="The relative slow down counted as a regression.")
+    args = parser.parse_args(argv)
+
+    out = os.path.abspath(args.out)
+    results = run(args)
+
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nwrote {out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\nregressions: {regressions}")
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
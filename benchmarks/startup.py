@@ -0,0 +1,178 @@
+"""
+startup.py
+
+    Measures the cold start of SpecMod Dash: the time to import main.py
+    and to serve the first page, each in a fresh interpreter, and the
+    per-module import costs reported by `python -X importtime`.
+
+    python -m benchmarks.startup --repeat 5 --modules 20
+    python -m benchmarks.startup --out new.json --compare old.json
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from benchmarks.synthetic import make_events
+from benchmarks.run import REPO, summarise, compare, git_revision
+from src.catalog import EventCatalog
+
+# imports main and serves the first page, run in a fresh interpreter
+PROBE = """
+import sys, json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+client = main.app.server.test_client()
+for url in ("/", "/_dash-layout", "/_dash-dependencies"):
+    assert client.get(url).status_code == 200, url
+t2 = time.perf_counter()
+print(json.dumps({
+    "import": t1 - t0,
+    "first page": t2 - t0,
+    "specmod imported": any(m.startswith("SpecMod") for m in sys.modules),
+}))
+"""
+
+
+def parse_importtime(stderr: str) -> Dict[str, dict]:
+    """
+    Parses the report written by `python -X importtime`.
+
+    Args:
+        stderr (str): The standard error of the interpreter.
+
+    Returns:
+        modules (dict): The "self" and "cumulative" import time of every
+            module in seconds, as {module: {"self": s, "cumulative": s}}.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = {
+            "self": int(own) / 1e6, "cumulative": int(cumulative) / 1e6}
+    return modules
+
+
+def probe(workdir: str, importtime: bool = False) -> subprocess.CompletedProcess:
+    """
+    Runs the probe in a fresh interpreter in workdir.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (REPO, env.get("PYTHONPATH")) if p)
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else [])
+    return subprocess.run(cmd + ["-c", PROBE], cwd=workdir, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def run(args: argparse.Namespace) -> dict:
+    """
+    Runs the startup benchmarks.
+
+    Returns:
+        results (dict): The run metadata, the timings and the modules with
+            the largest import times.
+    """
+    workdir = tempfile.mkdtemp(prefix="specmod-startup-")
+    pdir = os.path.join(workdir, "Events")
+    make_events(pdir, args.events, args.stations, 64, seed=0)
+    with open(os.path.join(workdir, "config.yaml"), "w") as f:
+        json.dump({"event-path": {"parent-directory": pdir}}, f)
+
+    # the catalog is built once, as a deployment would keep it
+    EventCatalog(pdir).refresh()
+
+    times = {"import main": [], "first page": []}
+    modules: Dict[str, List[dict]] = {}
+    specmod = False
+    for _ in range(args.repeat):
+        out = probe(workdir, importtime=True)
+        res = json.loads(out.stdout.strip().splitlines()[-1])
+        times["import main"].append(res["import"])
+        times["first page"].append(res["first page"])
+        specmod |= res["specmod imported"]
+        for name, t in parse_importtime(out.stderr).items():
+            modules.setdefault(name, []).append(t)
+
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {}
+    for name, t in times.items():
+        results[name] = summarise(t)
+        print(f"{name:<36} {results[name]['median'] * 1e3:10.2f} ms")
+    print(f"SpecMod imported at startup: {specmod}")
+
+    costs = {
+        name: {k: statistics.median(t[k] for t in ts)
+               for k in ("self", "cumulative")}
+        for name, ts in modules.items()
+        }
+    top = sorted(costs.items(), key=lambda kv: -kv[1]["self"])[:args.modules]
+
+    print(f"\n{'module':<48} {'self ms':>10} {'cumul. ms':>10}")
+    for name, c in top:
+        print(f"{name:<48} {c['self'] * 1e3:10.2f} "
+              f"{c['cumulative'] * 1e3:10.2f}")
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "time": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "events": args.events,
+            "stations": args.stations,
+            "repeat": args.repeat,
+            "specmod imported": specmod,
+        },
+        "results": results,
+        "modules": dict(top),
+    }
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--events", type=int, default=1000,
+        help="The number of synthetic events in the parent directory.")
+    parser.add_argument("--stations", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--modules", type=int, default=25,
+        help="The number of most expensive modules to report.")
+    parser.add_argument("--out", default="startup.json",
+        help="The JSON file to write the results to.")
+    parser.add_argument("--compare", default=None,
+        help="A previous results file to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+        help="The relative slow down counted as a regression.")
+    args = parser.parse_args(argv)
+
+    out = os.path.abspath(args.out)
+    results = run(args)
+
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nwrote {out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\nregressions: {regressions}")
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""
+convert.py
+    Converts event spectra pickles to the memory-mapped columnar store
+    (set storage.backend to "columnar" in config.yaml to use it), or folds
+    the review decisions of the columnar store back into the pickles.
+
+    python convert.py                   # convert every event
+    python convert.py EV1 EV2           # convert the given events
+    python convert.py --to-pickle       # write decisions back to pickles
+
+    Events whose columnar store holds decisions that are not in the pickle
+    are not converted again (which would lose them) unless --discard is
+    given: fold them with --to-pickle first.
+"""
+
+import os
+import sys
+import time
+import argparse
+from src.utils import get_config
+from src.catalog import list_event_dirs
+from src.columnar import ColumnStore, format_columns_path
+from src.specroutines import (convert_event, fold_columns, unfolded_stations,
+    use_columns)
+
+
+def main(argv=None):
+
+    config = get_config()
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("events", nargs="*",
+        help="The events to convert. Default is every event.")
+    parser.add_argument("--pdir",
+        default=config["event-path"]["parent-directory"],
+        help="The parent directory of the events.")
+    parser.add_argument("--to-pickle", action="store_true",
+        help="Write the decisions in the columnar store back to the pickles.")
+    parser.add_argument("--force", action="store_true",
+        help="Convert events that already have an up to date columnar store, "
+             "or fold columns into pickles rewritten since they were "
+             "converted.")
+    parser.add_argument("--discard", action="store_true",
+        help="Convert events even if the decisions in their columnar store "
+             "are not in the pickle, losing those decisions.")
+    args = parser.parse_args(argv)
+
+    evs = args.events or list_event_dirs(args.pdir)
+
+    t0 = time.perf_counter()
+    nbytes = 0
+    for ev in evs:
+        has_columns = ColumnStore.exists(format_columns_path(args.pdir, ev))
+        current = use_columns(args.pdir, ev, "columnar")
+        if args.to_pickle:
+            if not has_columns:
+                continue
+            if not current and not args.force:
+                print(f"skipped {ev}, the pickle is newer than its columns "
+                      "(use --force to write their decisions over it)")
+                continue
+            nbytes += fold_columns(args.pdir, ev)
+        elif current and not args.force:
+            print(f"skipped {ev}, already converted (use --force)")
+            continue
+        else:
+            unfolded = (unfolded_stations(args.pdir, ev)
+                        if has_columns and not args.discard else [])
+            if unfolded:
+                print(f"warning: skipped {ev}, the decisions of "
+                      f"{len(unfolded)} station(s) in its columnar store are "
+                      "not in the pickle (fold them with --to-pickle, or use "
+                      "--discard to drop them)")
+                continue
+            nbytes += convert_event(args.pdir, ev)
+        print(f"{'folded' if args.to_pickle else 'converted'} {ev}")
+
+    print(f"wrote {nbytes / 2**20:.1f} MB in {time.perf_counter() - t0:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
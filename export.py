@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+export.py
+    Exports the review decisions, distances and (optionally) spectra of
+    every station to a CSV or Parquet file (see src.export), one event at
+    a time.
+
+    python export.py decisions.csv
+    python export.py spectra.parquet --spectra --workers 8
+    python export.py changed.parquet --incremental
+
+    With --incremental only the events changed since the last export are
+    written, the versions of the exported events are kept in --state.
+"""
+
+import sys
+import time
+import argparse
+from src.utils import get_config
+from src.catalog import list_event_dirs
+from src.export import export, changed_events, read_state, FORMATS
+
+
+def main(argv=None):
+
+    config = get_config()
+    pdir = config["event-path"]["parent-directory"]
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("out",
+        help="The output file (.parquet for Parquet, otherwise CSV).")
+    parser.add_argument("events", nargs="*",
+        help="The events to export. Default is every event.")
+    parser.add_argument("--pdir", default=pdir,
+        help="The parent directory of the events.")
+    parser.add_argument("--format", choices=FORMATS, default=None,
+        help="The output format. Default is from the file name.")
+    parser.add_argument("--spectra", action="store_true",
+        help="Add the signal and noise spectra of every station.")
+    parser.add_argument("--workers", type=int, default=1,
+        help="The number of processes reading events.")
+    parser.add_argument("--incremental", action="store_true",
+        help="Only export the events changed since the last export.")
+    parser.add_argument("--state", default=None,
+        help="The export state file. Default is "
+             "<pdir>/.specmod-export.json.")
+    args = parser.parse_args(argv)
+
+    backend = config.get("storage", {}).get("backend", "pickle")
+    state = args.state or f"{args.pdir}/.specmod-export.json"
+
+    evs = args.events or list_event_dirs(args.pdir)
+    if args.incremental:
+        evs = changed_events(args.pdir, evs, read_state(state), backend)
+
+    t0 = time.perf_counter()
+    report = export(args.pdir, args.out, evs, args.format, backend,
+                    args.spectra, args.workers, state)
+
+    for ev, error in report["failed"].items():
+        print(f"failed {ev}: {error}")
+    print(f"exported {len(report['events'])} event(s), {report['rows']} "
+          f"station(s) to {args.out} in {time.perf_counter() - t0:.1f} s")
+
+    return 1 if report["failed"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+"""
+fold_journals.py
+    Writes the unsaved review decisions kept in the event journals (see
+    src.journal) to the spectra files and compacts the journals, e.g.,
+    after reviewers left without pressing "Save spectra".
+
+    python fold_journals.py             # fold every journal
+    python fold_journals.py EV1 EV2     # fold the given events
+"""
+
+import sys
+import time
+import argparse
+from src.utils import get_config
+from src.journal import ReviewJournal, fold_journal
+
+
+def main(argv=None):
+
+    config = get_config()
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("events", nargs="*",
+        help="The events to fold. Default is every event with a journal.")
+    parser.add_argument("--pdir",
+        default=config["event-path"]["parent-directory"],
+        help="The parent directory of the events.")
+    args = parser.parse_args(argv)
+
+    backend = config.get("storage", {}).get("backend", "pickle")
+    journal = ReviewJournal(args.pdir)
+
+    t0 = time.perf_counter()
+    failed = 0
+    for ev in args.events or journal.events():
+        reports = fold_journal(journal, ev, backend)
+        for sid, r in reports.items():
+            if r["error"] is not None:
+                failed += 1
+                print(f"failed {ev} (session {sid}): {r['error']}")
+            else:
+                print(f"folded {ev} (session {sid}): {r['stations']} "
+                      "station(s) changed")
+
+    print(f"done in {time.perf_counter() - t0:.1f} s, {failed} failed")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,16 +11,35 @@ main.py
 # dependencies 
 import os
 import sys
+import time
+import logging
+import threading
+import functools
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 import dash
 import numpy as np
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 # local imports
 from src.utils import *
 from src.specplot import *
-from src.specroutines import get_event_spectra, write_specs
+from src.specroutines import (get_event_spectra, get_station_spectra, 
+    write_event_specs, source_path, station_state, get_event_suggestions)
+from src.cache import spectra_cache, figure_cache, content_key, file_version
+from src.session import (MemorySessionStore, SQLiteSessionStore, 
+    new_session_id)
+from src.catalog import EventCatalog
+from src.prefetch import Prefetcher
+from src.metrics import Metrics, instrument, add_metrics_route
+from src.profiling import Profiler, profile_callbacks, add_profiles_route
+from src.transport import pack_figure
+from src.numerics import decimate_log, smooth_rows
+from src.journal import ReviewJournal, set_record
+from src.jobs import JobQueue
+from src.export import add_export_route
 
 # globals ---------------------------------------------------------------------
 
@@ -28,7 +47,156 @@ config = get_config()
 
 evdir = config["event-path"]["parent-directory"]
 
-SS = {}
+spectra_cache.resize(
+    config.get("cache", {}).get("spectra-memory-mb", 512) * 2**20)
+figure_cache.resize(
+    config.get("cache", {}).get("figure-memory-mb", 64) * 2**20)
+
+# number of points per spectrum drawn unless full resolution is requested
+max_points = config.get("display", {}).get("max-points", 1000)
+
+# number of events written to file in parallel when saving
+save_workers = config.get("save", {}).get("workers", 4)
+
+# milliseconds between updates of the progress of a save
+save_poll_interval = config.get("save", {}).get("poll-interval-ms", 500)
+
+# move the new bandwidth lines in the browser rather than on the server
+clientside_bandwidth = config.get("display", {}).get(
+    "clientside-bandwidth", True)
+
+# send the figure arrays as base64 float32 ("binary") rather than JSON
+# text ("json"), the browser decodes them so the bandwidth lines must be
+# drawn clientside too
+binary_transport = clientside_bandwidth and config.get("display", {}).get(
+    "transport", "binary") == "binary"
+
+# where the spectra are read from, "pickle" or "columnar" (see convert.py)
+backend = config.get("storage", {}).get("backend", "pickle")
+
+# the Parquet exports need pyarrow, which may not be installed
+has_parquet = importlib.util.find_spec("pyarrow") is not None
+
+# station metadata of every event, so stations can be listed without
+# unpickling the event spectra
+catalog = EventCatalog(
+    evdir, 
+    config.get("catalog", {}).get("path"),
+    # a partial rather than a lambda, so refresh workers can unpickle it
+    loader = functools.partial(get_event_spectra, backend = backend),
+    spectra_path = lambda pdir, ev: source_path(pdir, ev, backend),
+    rescan_interval = config.get("catalog", {}).get("rescan-interval", 2.0),
+    )
+
+
+# processes the new and changed events are summarised in
+catalog_workers = config.get("catalog", {}).get("workers", 4)
+
+# number of events sent to the browser per page of the event dropdown
+event_page_size = config.get("catalog", {}).get("page-size", 100)
+
+# points per spectrum in the event overview panels and panels per row
+overview_points = config.get("display", {}).get("overview-points", 60)
+overview_columns = config.get("display", {}).get("overview-columns", 6)
+
+# one station across many events, read in parallel
+station_view_config = config.get("station-view", {})
+station_view_events = station_view_config.get("max-events", 50)
+station_view_points = station_view_config.get("points", 200)
+station_view_pool = ThreadPoolExecutor(
+    max_workers = station_view_config.get("workers", 4), 
+    thread_name_prefix = "station-view")
+
+# log-frequency smoothing of the signal and noise, for display and for the
+# suggestions
+smoothing_config = config.get("smoothing", {})
+smoothing_params = dict(
+    method = smoothing_config.get("method"),
+    b = smoothing_config.get("b", 40.0),
+    decades = smoothing_config.get("decades", 0.1),
+    )
+smooth_display = smoothing_config.get("display", True)
+
+# automatic suggestion of the pass flag and bandwidth of each station
+suggest_config = config.get("suggest", {})
+suggest_params = dict(
+    threshold = suggest_config.get("snr-threshold", 3.0),
+    nbins = suggest_config.get("bins", 100),
+    min_decades = suggest_config.get("min-decades", 0.3),
+    )
+if smoothing_config.get("suggest", True):
+    suggest_params.update(
+        smoothing = smoothing_params["method"],
+        smoothing_b = smoothing_params["b"],
+        smoothing_decades = smoothing_params["decades"],
+        )
+show_suggestions = suggest_config.get("overlay", True)
+
+# warms the figures of the next stations in the background
+prefetch_config = config.get("prefetch", {})
+prefetch_depth = prefetch_config.get("depth", 3)
+# the tasks build into the figure cache and leave its key as a marker, which
+# is only a hit (and keeps the task from rerunning) while the figure is cached
+prefetcher = Prefetcher(
+    max_workers = prefetch_config.get("workers", 2),
+    alive = lambda key: key in figure_cache,
+    )
+
+# review decisions per browser session, kept server side and shared by
+# every worker process unless kept in memory
+session_config = config.get("session", {})
+if session_config.get("backend", "sqlite") == "memory":
+    sessions = MemorySessionStore()
+else:
+    sessions = SQLiteSessionStore(session_config.get("path") 
+        or os.path.join(evdir, ".specmod-sessions.sqlite"))
+session_idle_hours = session_config.get("idle-hours", 24)
+
+# saves run in the background, one task per event, and their progress is
+# shared with the other worker processes through the session database
+save_jobs = JobQueue(max_workers = save_workers, 
+    path = getattr(sessions, "path", None))
+
+# every staged decision is appended to a journal in the event directory,
+# replayed on restart and compacted on save
+journal = ReviewJournal(evdir, 
+    fsync = config.get("journal", {}).get("fsync", False))
+
+# timings and payload sizes of the callbacks, served on /metrics
+metrics_config = config.get("metrics", {})
+metrics = Metrics(
+    window = metrics_config.get("window", 1000),
+    log = metrics_config.get("log", False),
+    )
+metrics.add_gauges("spectra_cache", spectra_cache.stats)
+metrics.add_gauges("figure_cache", figure_cache.stats)
+metrics.add_gauges("prefetch", prefetcher.stats)
+
+# profiles of chosen callbacks or of the slowest calls, switched on in the
+# config or with the SPECMOD_PROFILE (callback names, comma separated) and
+# SPECMOD_PROFILE_SLOWEST (percent) environment variables
+profiling_config = config.get("profiling", {})
+profiled = os.environ.get("SPECMOD_PROFILE")
+slowest = os.environ.get("SPECMOD_PROFILE_SLOWEST")
+profiler = None
+if profiling_config.get("enabled", False) or profiled or slowest:
+    profiler = Profiler(
+        profiling_config.get("directory", "profiles"),
+        callbacks = (profiled.split(",") if profiled 
+                     else profiling_config.get("callbacks") or []),
+        slowest = (float(slowest) if slowest 
+                   else profiling_config.get("slowest-percent")),
+        mode = profiling_config.get("mode", "sample"),
+        interval = profiling_config.get("interval-ms", 5) / 1e3,
+        max_mb = profiling_config.get("max-mb", 100),
+        )
+
+# time spent reading spectra and building figures within the callbacks
+get_station_spectra = metrics.timed("io", get_station_spectra)
+get_event_spectra = metrics.timed("io", get_event_spectra)
+make_base_fig = metrics.timed("figure", make_base_fig)
+make_overview = metrics.timed("figure", make_overview)
+make_station_events = metrics.timed("figure", make_station_events)
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.SPACELAB],
                 meta_tags=[{'name': 'viewport',
@@ -48,17 +216,46 @@ controls = dbc.Card(
                     dbc.Label("Select event"),
                     dcc.Dropdown(
                         id='event-dropdown',
-                        options = [
-                            {
-                                'label': k[:-4], 
-                                'value': k
-                            } for k in sorted(
-                                os.listdir(evdir))
-                                ],
-                        value = sorted(os.listdir(evdir))[0],
+                        # a page of events is served by update_event_options
+                        options = [],
                         clearable = False,
+                        placeholder = "Search events...",
                         # disabled=True
                     ),
+                    dbc.ButtonGroup(
+                        [
+                            dbc.Button("<", id = 'event-prev', n_clicks = 0,
+                                size = "sm", outline = True),
+                            dbc.Button(">", id = 'event-next', n_clicks = 0,
+                                size = "sm", outline = True),
+                        ], className = 'my-1',
+                    ),
+                    html.Small("", id = 'event-page-label', 
+                        className = 'mx-2 text-muted'),
+
+                    dbc.Label("Filter events"),
+                    dcc.DatePickerRange(
+                        id = 'event-dates',
+                        clearable = True,
+                        display_format = "YYYY-MM-DD",
+                    ),
+                    dbc.RadioItems(
+                        id = 'event-status',
+                        options = [
+                            {'label': 'All', 'value': 'all'},
+                            {'label': 'Unreviewed', 'value': 'unreviewed'},
+                            {'label': 'Reviewed', 'value': 'reviewed'},
+                            ],
+                        value = 'all',
+                        inline = True,
+                    ),
+                    dbc.Input(
+                        id = 'event-min-stations',
+                        type = "number",
+                        min = 0,
+                        placeholder = "Min. stations",
+                        size = "sm",
+                    ),
 
                     dbc.Label("Select station"),
                     dcc.Dropdown(
@@ -74,6 +271,15 @@ controls = dbc.Card(
                             {'label': 'No', 'value': 0},
                             ],
                     ),
+
+                    dbc.Checklist(
+                        id = 'full-res',
+                        options = [
+                            {'label': 'Full resolution', 'value': 1},
+                            ],
+                        value = [],
+                        switch = True,
+                    ),
                 ]
             ),
             dbc.Label("Commit changes"),
@@ -101,6 +307,52 @@ controls = dbc.Card(
                         target = 'commit-change',
                         placement = "bottom"
                         ),
+                    dbc.Button(
+                        'Cancel save',
+                        id = 'save-cancel',
+                        className = 'mx-2',
+                        n_clicks = 0,
+                        disabled = True,
+                        ),
+                    dbc.Button(
+                        'Retry failed',
+                        id = 'save-retry',
+                        className = 'mx-2',
+                        n_clicks = 0,
+                        disabled = True,
+                        ),
+                    dbc.Button(
+                        'Apply suggestions',
+                        id = 'apply-suggestions',
+                        className = 'mx-2',
+                        n_clicks = 0,
+                        ),
+                    dbc.Tooltip(
+                        "Click to stage the suggested decisions for every "
+                        "station of the event you have not changed.",
+                        target = 'apply-suggestions',
+                        placement = "bottom"
+                        ),
+                    dbc.DropdownMenu(
+                        [
+                            dbc.DropdownMenuItem(label, href = href, 
+                                external_link = True)
+                            for label, href in (
+                                ("Decisions (CSV)", 
+                                 "/export/decisions.csv"),
+                                ("Decisions (Parquet)", 
+                                 "/export/decisions.parquet"),
+                                ("Decisions and spectra (Parquet)", 
+                                 "/export/spectra.parquet?spectra=1"),
+                                )
+                            # Parquet is only offered with pyarrow installed
+                            if has_parquet or not href.endswith(
+                                ("parquet", "spectra=1"))
+                        ],
+                        label = 'Export',
+                        className = 'mx-2',
+                        group = True,
+                        ),
                     ]
                 ),
             ],
@@ -133,155 +385,628 @@ infocard = dbc.Card(
     ]
 )
 
-app.layout = dbc.Container(
-    [
-        dcc.Store(id = "store"),
-
-        dbc.Row(
-            [
-                dbc.Col(html.H3("SpecMod Dash"), md = 3),
-                dbc.Col(
-                    [
-                        html.H1("Spectra Review Panel", 
-                            className = 'text-right text-primary mk-4'), 
-                    ]
-                ),
-            ], no_gutters = True
-        ),
-        html.Hr(),
-        dbc.Row(
-            [   
-                dbc.Col(controls, md = 4),
-
-                dbc.Col(
-                    [   
-                        dcc.Graph(
-                            id = 'graph',
+def serve_layout():
+    """
+    Builds the app layout for every page load, so that each browser
+    session gets its own session id.
+    """
+    return dbc.Container(
+        [
+            dcc.Store(id = "session-id", storage_type = "session", 
+                data = new_session_id()),
+            dcc.Store(id = "store"),
+            dcc.Store(id = "event-page", data = 0),
+            # the background save of the session and its progress updates
+            dcc.Store(id = "save-job"),
+            dcc.Interval(id = "save-poll", interval = save_poll_interval,
+                disabled = True),
+            # the packed figures, decoded into the graphs in the browser
+            dcc.Store(id = "figure-packed"),
+            dcc.Store(id = "overview-packed"),
+            dcc.Store(id = "station-view-packed"),
+
+            dbc.Row(
+                [
+                    dbc.Col(html.H3("SpecMod Dash"), md = 3),
+                    dbc.Col(
+                        [
+                            html.H1("Spectra Review Panel", 
+                                className = 'text-right text-primary mk-4'), 
+                        ]
+                    ),
+                ], no_gutters = True
+            ),
+            html.Hr(),
+            dbc.Row(
+                [   
+                    dbc.Col(controls, md = 4),
+
+                    dbc.Col(
+                        [   
+                            dcc.Graph(
+                                id = 'graph',
+                                ),
+
+                            dbc.FormGroup(
+                                [
+                                    dbc.Label("Bandwidth (Hz)"),
+                                    dcc.RangeSlider(
+                                        id = 'slider-position', 
+                                        min = np.log10(1),
+                                        max = np.log10(100), 
+                                        value = np.log10([1, 100]), 
+                                        step = 0.01,
+                                        marks = {
+                                        i: '{}Hz'.format(
+                                            np.round(10 ** i, 1)
+                                            ) for i in np.log10([1, 10, 100])
+                                        },
+                                        className = "slider",
+                                        allowCross = False,
+                                    )
+                                ]
                             ),
-
-                        dbc.FormGroup(
-                            [
-                                dbc.Label("Bandwidth (Hz)"),
-                                dcc.RangeSlider(
-                                    id = 'slider-position', 
-                                    min = np.log10(1),
-                                    max = np.log10(100), 
-                                    value = np.log10([1, 100]), 
-                                    step = 0.01,
-                                    marks = {
-                                    i: '{}Hz'.format(
-                                        np.round(10 ** i, 1)
-                                        ) for i in np.log10([1, 10, 100])
-                                    },
-                                    className = "slider",
-                                    allowCross = False,
-                                )
-                            ]
-                        ),
-                        html.Hr(),
-                    ], md = 8  
-                ), 
-            ], align = 'center'
-        ),
-        dbc.Row(
-            [
-                dbc.Col([infocard, ]),
+                            html.Hr(),
+                        ], md = 8  
+                    ), 
+                ], align = 'center'
+            ),
+            dbc.Row(
+                [
+                    dbc.Col([infocard, ]),
                 
-                dbc.Col(
-                    [
-                        dbc.Alert(
-                            children = [],
-                            id = "alert-auto",
-                            dismissable = True,
-                            is_open = False,
-                            duration = 6000,
-                        ),
-                    ], width = 12
-                ),
-            ], align = 'center'
-        ),
-    ], fluid = True, style = {'font-family' : '"Times New Roman"'},
-)
+                    dbc.Col(
+                        [
+                            dbc.Alert(
+                                children = [],
+                                id = "alert-auto",
+                                dismissable = True,
+                                is_open = False,
+                                duration = 6000,
+                            ),
+                        ], width = 12
+                    ),
+                ], align = 'center'
+            ),
+            dbc.Row(
+                [
+                    dbc.Col(
+                        [
+                            dbc.Button(
+                                "Event overview", 
+                                id = 'overview-toggle',
+                                className = 'mb-2',
+                                n_clicks = 0,
+                                ),
+                            dbc.Tooltip(
+                                "Click a station's spectra to select it.",
+                                target = 'overview-toggle',
+                                placement = "right"
+                                ),
+                            dbc.Collapse(
+                                dcc.Graph(
+                                    id = 'overview',
+                                    config = {'displayModeBar': False},
+                                    ),
+                                id = 'overview-collapse',
+                                is_open = False,
+                                ),
+                            dcc.Store(id = "overview-stations"),
+                        ], width = 12
+                    ),
+                ]
+            ),
+            dbc.Row(
+                [
+                    dbc.Col(
+                        [
+                            dbc.Button(
+                                "Station across events", 
+                                id = 'station-view-toggle',
+                                className = 'mb-2',
+                                n_clicks = 0,
+                                ),
+                            dbc.Tooltip(
+                                "Compare one station's spectra across "
+                                "every event it recorded.",
+                                target = 'station-view-toggle',
+                                placement = "right"
+                                ),
+                            dbc.Collapse(
+                                [
+                                    dcc.Dropdown(
+                                        id = 'station-view-station',
+                                        placeholder = "Select station",
+                                        ),
+                                    dcc.RadioItems(
+                                        id = 'station-view-mode',
+                                        options = [
+                                            {'label': 'Overlay', 
+                                             'value': 'overlay'},
+                                            {'label': 'Stack', 
+                                             'value': 'stack'},
+                                            ],
+                                        value = 'overlay',
+                                        labelStyle = {
+                                            'display': 'inline-block', 
+                                            'margin-right': '1em'},
+                                        ),
+                                    dcc.RadioItems(
+                                        id = 'station-view-passed',
+                                        options = [
+                                            {'label': 'All events', 
+                                             'value': 'all'},
+                                            {'label': 'Suitable only', 
+                                             'value': 'passed'},
+                                            ],
+                                        value = 'all',
+                                        labelStyle = {
+                                            'display': 'inline-block', 
+                                            'margin-right': '1em'},
+                                        ),
+                                    html.Small(id = 'station-view-label'),
+                                    dcc.Graph(
+                                        id = 'station-view',
+                                        config = {'displayModeBar': False},
+                                        ),
+                                ],
+                                id = 'station-view-collapse',
+                                is_open = False,
+                                ),
+                        ], width = 12
+                    ),
+                ]
+            ),
+        ], fluid = True, style = {'font-family' : '"Times New Roman"'},
+    )
+
+app.layout = serve_layout
+
+# helpers ---------------------------------------------------------------------
+
+
+def file_decision(snp) -> dict:
+    """
+    Gets the review decision held on file for a station.
+    """
+    # min max frequencies of best modeling bandwidth
+    mnb, mxb = get_band_vals(snp)
+
+    return {
+            "snr": 1 if snp.signal.get_pass_snr() else 0,
+            "min bf": float(mnb),
+            "max bf": float(mxb),
+           }
+
+
+def base_key(ev, sta, full_res) -> str:
+    """
+    The content key of a station's base figure, which changes with the
+    file version and the resolution but not with the review decision.
+    """
+    return content_key(
+        ev, sta, file_version(source_path(evdir, ev, backend)), 
+        None if full_res else max_points, binary_transport,
+        )
+
+
+def station_base(ev, sta, full_res) -> dict:
+    """
+    Gets the base figure (spectra and axes) and frequency range of a 
+    station from the figure cache, building it on a miss.
+    """
+    key = base_key(ev, sta, full_res)
+    base = figure_cache.get(key)
+    if base is not None:
+        return base
+
+    # the arrays are read on the server from the spectra cache
+    snp = get_station_spectra(evdir, ev, sta, backend)
+
+    mn, mx = get_min_max_freqs(snp)
+
+    samp, namp = snp.signal.amp, snp.noise.amp
+    if smooth_display:
+        samp = smooth_rows(snp.signal.freq, samp, **smoothing_params)
+        namp = smooth_rows(snp.noise.freq, namp, **smoothing_params)
+
+    fig = make_base_fig(
+        snp.signal.freq, 
+        samp,
+        snp.noise.freq, 
+        namp,
+        max_points = None if full_res else max_points,
+        )
+
+    nbytes = sum(np.asarray(t[k]).nbytes for t in fig["data"] for k in "xy")
+
+    if binary_transport:
+        # packed once here rather than on every change of decision
+        fig = pack_figure(fig)
+
+    base = {"fig": fig, "min f": mn, "max f": mx}
+    figure_cache.put(key, base, nbytes=nbytes)
+
+    return base
+
+
+def station_fig(ev, sta, decision, full_res) -> dict:
+    """
+    Draws the review decision (and suggestion) over the base figure of a
+    station.
+    """
+    base = station_base(ev, sta, full_res)
+
+    suggested = None
+    if show_suggestions:
+        suggested = get_event_suggestions(
+            evdir, ev, backend, **suggest_params).get(sta)
+
+    overlays = make_overlays(
+        base["fig"], 
+        decision["snr"], 
+        (decision["min bf"], decision["max bf"]),
+        suggested,
+        )
+
+    return dict(base, fig=layer_fig(base["fig"], overlays))
+
+
+def prefetch_station(ev, sta, full_res):
+    """
+    Makes a prefetch task that builds the base figure of a station into
+    the figure cache.
+    """
+    def task():
+        station_base(ev, sta, full_res)
+        if show_suggestions:
+            get_event_suggestions(evdir, ev, backend, **suggest_params)
+        # marks the task as done while the figure stays in the cache
+        return [(prefetch_id(ev, sta, full_res), base_key(ev, sta, full_res), 
+                 0)]
+    return task
+
+
+def prefetch_id(ev, sta, full_res) -> tuple:
+    """
+    The id of the prefetch task of a station, which changes with the file
+    version so stale work is redone.
+    """
+    return (
+        "station", ev, sta, file_version(source_path(evdir, ev, backend)), 
+        bool(full_res),
+        )
+
+
+def prefetch_next(ev, sta, full_res):
+    """
+    Schedules the prefetch of the stations after sta (in rhyp order) and
+    of the first station of the next event when near the end of the list.
+    """
+    stas = [s["id"] for s in catalog.stations(ev)]
+    i = stas.index(sta) if sta in stas else -1
+    tasks = {
+        prefetch_id(ev, s, full_res): prefetch_station(ev, s, full_res) 
+        for s in stas[i + 1: i + 1 + prefetch_depth]
+        }
+
+    if i + prefetch_depth >= len(stas):
+        evs = catalog.event_dirs()
+        if ev in evs and evs.index(ev) + 1 < len(evs):
+            nev = evs[evs.index(ev) + 1]
+            def task():
+                # loads the next event's catalog entry and spectra
+                first = catalog.stations(nev)[0]["id"]
+                done = prefetch_station(nev, first, full_res)()
+                return done + [(("event", nev, full_res), done[0][1], 0)]
+            tasks[("event", nev, full_res)] = task
+
+    prefetcher.schedule(tasks)
+
 
 # callbacks -------------------------------------------------------------------
 
 
+@app.callback(
+    [
+     Output("event-dropdown", "options"),
+     Output("event-dropdown", "value"),
+     Output("event-page", "data"),
+     Output("event-page-label", "children"),
+    ],
+    [
+     Input("event-dropdown", "search_value"),
+     Input("event-dates", "start_date"),
+     Input("event-dates", "end_date"),
+     Input("event-status", "value"),
+     Input("event-min-stations", "value"),
+     Input("event-prev", "n_clicks"),
+     Input("event-next", "n_clicks"),
+    ],
+    [
+     State("event-page", "data"),
+     State("event-dropdown", "value"),
+    ]
+    )
+def update_event_options(search, start, end, status, min_sta, prev, nxt, 
+                         page, value):
+    """
+    Serves one page of the events matching the search and filters, so the
+    browser never holds the whole event list.
+    """
+    trigger = dash.callback_context.triggered[0]["prop_id"].split(".")[0]
+
+    page = page or 0
+    if trigger == "event-prev":
+        page = max(page - 1, 0)
+    elif trigger == "event-next":
+        page += 1
+    else:
+        # a new search or filter starts from the first page
+        page = 0
+
+    def find(page):
+        return catalog.search(
+            query = search or "", 
+            start = start, 
+            end = end,
+            status = None if status == "all" else status,
+            min_stations = min_sta,
+            offset = page * event_page_size, 
+            limit = event_page_size,
+            )
+
+    events, total = find(page)
+    npages = max(-(-total // event_page_size), 1)
+    if page >= npages:
+        page = npages - 1
+        events, total = find(page)
+
+    options = [
+        {
+            'label': e["ev"][:-4] + (" \u2713" if e["reviewed"] else ""), 
+            'value': e["ev"]
+        } for e in events
+        ]
+
+    if value is None and options:
+        value = options[0]["value"]
+
+    # the selected event must stay among the options to stay selected
+    if value is not None and value not in {o["value"] for o in options}:
+        options.insert(0, {'label': value[:-4], 'value': value})
+
+    label = f"page {page + 1} of {npages} ({total} events)"
+
+    return options, value, page, label
+
+
 @app.callback(
     [
      Output("station-dropdown", "value"),
      Output("station-dropdown", "options"),
     ],
-    Input("event-dropdown", "value")
+    Input("event-dropdown", "value"),
+    Input("overview", "clickData"),
+    State("overview-stations", "data"),
     )
-def update_station_dropdown(ev):
+def update_station_dropdown(ev, click, shown):
+
+    if ev is None:
+        raise dash.exceptions.PreventUpdate
+
+    trigger = dash.callback_context.triggered[0]["prop_id"].split(".")[0]
+
+    if trigger == "overview":
+        # a click on a panel of the event overview selects its station
+        if not click or not shown or shown["ev"] != ev:
+            raise dash.exceptions.PreventUpdate
+        curve = click["points"][0]["curveNumber"]
+        return shown["stations"][curve // 2], dash.no_update
     
-    sp = get_event_spectra(evdir, ev)
+    # the catalog entries are already sorted by hypocentral distance
+    stations = catalog.stations(ev)
 
-    value = sorted(sp.group.values(), 
-        key=lambda x: x.signal.meta['rhyp'])[0].id
+    # e.g., an event without a spectra file the catalog could read
+    value = stations[0]["id"] if stations else None
 
     options = [
         {
-        'label': k.id, 
-        'value': k.id
-        } for k in sorted(
-            sp.group.values(), 
-            key = lambda x: x.signal.meta['rhyp']
-            )
+        'label': k["id"], 
+        'value': k["id"]
+        } for k in stations
         ]
 
     return value, options
 
 
 
+@app.callback(
+    Output("overview-collapse", "is_open"),
+    Input("overview-toggle", "n_clicks"),
+    State("overview-collapse", "is_open"),
+    )
+def toggle_overview(n, is_open):
+
+    if n:
+        return not is_open
+
+    return is_open
+
+
+@app.callback(
+    [
+     Output("overview-packed" if binary_transport else "overview", 
+            "data" if binary_transport else "figure"),
+     Output("overview-stations", "data"),
+    ],
+    Input("event-dropdown", "value"),
+    Input("overview-collapse", "is_open"),
+    State("session-id", "data"),
+    )
+def display_overview(ev, is_open, sid):
+    """
+    Draws the spectra of every station of the event in a grid, ordered by
+    hypocentral distance. It is only built while the overview is shown.
+    """
+    if ev is None or not is_open:
+        raise dash.exceptions.PreventUpdate
+
+    stations = catalog.stations(ev)
+    ids = [s["id"] for s in stations]
+
+    # the decisions staged in this session override the ones on file
+    staged = sessions.decisions(sid).get(ev, {}) if sid is not None else {}
+    passed = [staged.get(s["id"], s)["snr"] for s in stations]
+
+    sp = get_event_spectra(evdir, ev, backend = backend)
+    snps = [sp.get_spectra(sta) for sta in ids]
+
+    fig = make_overview(
+        ids,
+        [(snp.signal.freq, snp.signal.amp) for snp in snps],
+        [(snp.noise.freq, snp.noise.amp) for snp in snps],
+        passed,
+        max_points = overview_points,
+        ncols = overview_columns,
+        )
+
+    if binary_transport:
+        fig = pack_figure(fig)
+
+    return fig, {"ev": ev, "stations": ids}
+
+
+@app.callback(
+    Output("station-view-collapse", "is_open"),
+    Input("station-view-toggle", "n_clicks"),
+    State("station-view-collapse", "is_open"),
+    )
+def toggle_station_view(n, is_open):
+
+    if n:
+        return not is_open
+
+    return is_open
+
+
+@app.callback(
+    [
+     Output("station-view-station", "options"),
+     Output("station-view-station", "value"),
+    ],
+    Input("station-view-collapse", "is_open"),
+    State("station-dropdown", "value"),
+    State("station-view-station", "value"),
+    )
+def update_station_view_options(is_open, sta, current):
+    """
+    Lists every station in the catalog with its number of events, starting
+    from the station on display.
+    """
+    if not is_open:
+        raise dash.exceptions.PreventUpdate
+
+    options = [{"label": f"{s} ({n} events)", "value": s} 
+               for s, n in catalog.station_ids()]
+
+    return options, current or sta
+
+
+def station_arrays(ev, sta) -> tuple:
+    """
+    Gets the decimated signal and noise spectra of a station for the
+    station view, cached so only the arrays of that station are kept. The
+    events are read without the spectra cache so a long list of events
+    does not evict the ones being reviewed.
+    """
+    key = content_key("station view", ev, sta, 
+        file_version(source_path(evdir, ev, backend)), station_view_points)
+    arrays = figure_cache.get(key)
+    if arrays is None:
+        snp = get_station_spectra(evdir, ev, sta, backend, cached = False)
+        arrays = tuple(
+            decimate_log(spec.freq, spec.amp, station_view_points) 
+            for spec in (snp.signal, snp.noise)
+            )
+        figure_cache.put(key, arrays, 
+            nbytes = sum(a.nbytes for pair in arrays for a in pair))
+    return arrays
+
+
+@app.callback(
+    [
+     Output("station-view-packed" if binary_transport else "station-view", 
+            "data" if binary_transport else "figure"),
+     Output("station-view-label", "children"),
+    ],
+    Input("station-view-station", "value"),
+    Input("station-view-mode", "value"),
+    Input("station-view-passed", "value"),
+    State("station-view-collapse", "is_open"),
+    )
+def display_station_view(sta, mode, which, is_open):
+    """
+    Draws one station's spectra across the events that recorded it, found
+    through the catalog's station index. Only that station's arrays are
+    read, for up to station-view.max-events events in parallel.
+    """
+    if sta is None or not is_open:
+        raise dash.exceptions.PreventUpdate
+
+    passed = True if which == "passed" else None
+    entries = catalog.station_events(sta, passed = passed)
+    shown = entries[:station_view_events]
+    evs = [e["ev"] for e in shown]
+
+    arrays = list(station_view_pool.map(
+        lambda ev: station_arrays(ev, sta), evs))
+
+    fig = make_station_events(
+        evs,
+        [a[0] for a in arrays],
+        [a[1] for a in arrays],
+        [e["snr"] for e in shown],
+        mode = mode,
+        max_points = station_view_points,
+        )
+
+    if binary_transport:
+        fig = pack_figure(fig)
+
+    label = f"{sta}: {len(shown)} of {len(entries)} event(s) shown."
+
+    return fig, label
+
+
 @app.callback(
     Output("store", "data"),
     Input("station-dropdown", "value"),
     [
      State("event-dropdown", "value"),
-     State("store", "data"),
+     State("session-id", "data"),
     ]
 )
-def update_store(sta, ev, data):
+def update_store(sta, ev, sid):
 
-    if any_none(sta, ev):
+    if any_none(sta, ev, sid):
         raise dash.exceptions.PreventUpdate
 
-    if data is None:
-        data = SS
-
-    if ev not in data.keys():
-        data[ev] = {}
+    decision = sessions.get(sid, ev, sta)
 
-    if sta not in data[ev].keys():
+    if decision is None:
         
-        sp = get_event_spectra(evdir, ev)
+        snp = get_station_spectra(evdir, ev, sta, backend)
 
-        snp = sp.get_spectra(sta)
-        # min max frequencies possible
-        mn, mx = get_min_max_freqs(snp)
-        # min max frequencies of best modeling bandwidth
-        mnb, mxb = get_band_vals(snp)
-        
-        metdat = {
-                    sta:
-                        {
-                         "snr": 1 if snp.signal.get_pass_snr() else 0,
-                         "min f": mn,
-                         "max f": mx,
-                         "min bf": mnb,
-                         "max bf": mxb,
-                         "sf": snp.signal.freq,
-                         "sa": snp.signal.amp,
-                         "nf": snp.noise.freq,
-                         "na": snp.noise.amp,
-                         "meta": snp.signal.meta
-                        }
-                    }
-
-        data[str(ev)].update(metdat)
-
-    return data
+        decision = file_decision(snp)
+
+        # the state on file is kept to detect conflicting saves, it is
+        # only journaled once a decision is staged
+        state = station_state(snp)
+        sessions.seed(sid, ev, sta, decision, state)
+
+    # the browser only holds the decision for the station on display
+    return {"ev": ev, "sta": sta, **decision}
 
 @app.callback(
     [
@@ -289,7 +1014,10 @@ def update_store(sta, ev, data):
         Output('alert-auto', 'is_open'),
         Output('store', 'data'),
     ],
-    [Input('stage-change', 'n_clicks')],
+    [
+        Input('stage-change', 'n_clicks'),
+        Input('apply-suggestions', 'n_clicks'),
+    ],
     [
         State('alert-auto', 'is_open'), 
         State('snr-pass', 'value'),
@@ -297,41 +1025,42 @@ def update_store(sta, ev, data):
         State('store', 'data'),
         State('slider-position', 'value'),
         State('event-dropdown', 'value'),
+        State('session-id', 'data'),
     ]
 )
+def stage_decisions(n_stage, n_apply, is_open, snr, sta, data, bwd, ev, sid):
+    """
+    Stages the change of the station on display or the suggested decisions
+    of the event, whichever button was pressed. Dash dispatches callbacks 
+    by their outputs, so the two share one callback.
+    """
+    triggered = [t["prop_id"] for t in dash.callback_context.triggered]
+
+    if "apply-suggestions.n_clicks" in triggered:
+        return apply_suggestions(n_apply, is_open, ev, sta, sid)
+
+    return stage_change(n_stage, is_open, snr, sta, data, bwd, ev, sid)
+
+
 def stage_change(*args):
 
-    n, is_open, snr, sta, data, bwd, ev = args
+    n, is_open, snr, sta, data, bwd, ev, sid = args
     
-    if not any_none(args) and n:
+    if not any_none(*args) and n:
 
-        # print(snr, 
-        #     data["stations"][sta]["snr"], 
-        #     np.power(10, bwd), 
-        #     data["stations"][sta]["min bf"], 
-        #     data["stations"][sta]["max bf"])
         action = ""
 
-        if snr != data[ev][sta]["snr"]:
-
-            # if not data["stations"][sta]["snr"]:
-            #     data["stations"][sta]["min bf"] = data["stations"][sta]["min f"]
-            #     data["stations"][sta]["max bf"] = data["stations"][sta]["max f"]
-            
-            data[ev][sta]["snr"] = snr
+        if snr != data["snr"]:
             
-            # print(snr, data["stations"][sta]["snr"])
+            data["snr"] = snr
 
             yn = {'1':'suitable', '0':'unsuitable'}
 
             action += f"Marked {sta} as {yn[str(snr)]} for modeling."
 
-        if not np.array_equal(bwd, 
-            (data[ev][sta]["min bf"], 
-                data[ev][sta]["max bf"])
-            ):
-            data[ev][sta]["min bf"] = bwd[0]
-            data[ev][sta]["max bf"] = bwd[1]
+        if not np.array_equal(bwd, (data["min bf"], data["max bf"])):
+            data["min bf"] = bwd[0]
+            data["max bf"] = bwd[1]
 
             if action:
                 action += "and "
@@ -341,15 +1070,66 @@ def stage_change(*args):
             
         if action:
 
-            return action, (not is_open), data
+            decision = {k: data[k] for k in ("snr", "min bf", "max bf")}
+            entry = sessions.entry(sid, ev, sta) or {}
+            sessions.set(sid, ev, sta, decision)
+            journal.set(sid, ev, sta, decision, 
+                        entry.get("saved"), entry.get("base"))
 
-        # if bwd
+            return action, (not is_open), data
 
     raise dash.exceptions.PreventUpdate
 
 
+def apply_suggestions(n, is_open, ev, sta, sid):
+    """
+    Stages the suggested decision of every station of the event, except
+    the stations whose decision was already changed in the session.
+    """
+    if any_none(n, is_open, ev, sta, sid) or not n:
+        raise dash.exceptions.PreventUpdate
+
+    suggestions = get_event_suggestions(evdir, ev, backend, **suggest_params)
+    changed = sessions.dirty(sid).get(ev, {})
+    sp = get_event_spectra(evdir, ev, backend = backend)
+
+    applied, records = 0, []
+    for s, suggested in suggestions.items():
+        if s in changed:
+            continue
+
+        entry = sessions.entry(sid, ev, s)
+        if entry is None:
+            snp = sp.get_spectra(s)
+            decision, state = file_decision(snp), station_state(snp)
+            sessions.seed(sid, ev, s, decision, state)
+            entry = {"decision": decision, "saved": decision, "base": state}
+
+        decision = dict(entry["decision"])
+        decision["snr"] = suggested["snr"]
+        if suggested["snr"]:
+            decision["min bf"] = suggested["min bf"]
+            decision["max bf"] = suggested["max bf"]
+
+        sessions.set(sid, ev, s, decision)
+        records.append(
+            set_record(sid, s, decision, entry["saved"], entry["base"]))
+        applied += 1
+
+    # one append for the whole event
+    journal.append(ev, records)
+
+    msg = (f"Staged the suggested decisions of {applied} station(s) of "
+           f"{ev[:-4]}, skipping {len(changed)} changed by you. "
+           "Save to write them to file.")
+
+    return msg, (not is_open), {"ev": ev, "sta": sta, 
+                                **sessions.get(sid, ev, sta)}
+
+
 @app.callback([
-     Output("graph", "figure"), 
+     Output("figure-packed" if binary_transport else "graph", 
+            "data" if binary_transport else "figure"),
      Output("slider-position", "value"),
      Output("slider-position", "disabled"),
      Output("slider-position", "min"),
@@ -359,122 +1139,258 @@ def stage_change(*args):
      Output('epi-dist', 'children'), 
      Output('hypo-dist', 'children'),
     ],
-    # Input("station-dropdown", "value")
     Input("store", "data"),
-    State("station-dropdown", "value"),
-    State("event-dropdown", "value"),
+    Input("full-res", "value"),
     )   
-def display_graph_initial(data, sta, ev):
+def display_graph_initial(data, full_res):
 
-    # if data is None:
-    #     raise dash.exceptions.PreventUpdate
-    if any_none(data[ev], sta, ev):
+    if data is None:
         return dash.no_update
 
-    tf = data[ev][sta]["snr"]
+    ev, sta, tf = data["ev"], data["sta"], data["snr"]
 
-    marks = get_marks(
-        data[ev][sta]["min f"], 
-        data[ev][sta]["max f"]
-        )
+    # waits for the station's prefetch if it is running
+    tid = prefetch_id(ev, sta, full_res)
+    prefetcher.get(tid, tid)
 
-    fig = make_fig(
-        np.array(data[ev][sta]["sf"]), 
-        np.array(data[ev][sta]["sa"]),
-        np.array(data[ev][sta]["nf"]), 
-        np.array(data[ev][sta]["na"]),
-        tf,
-        (data[ev][sta]["min bf"], 
-         data[ev][sta]["max bf"]),
-        )
+    payload = station_fig(ev, sta, data, full_res)
+
+    prefetch_next(ev, sta, full_res)
+
+    mn, mx = payload["min f"], payload["max f"]
+
+    meta = catalog.station(ev, sta)
+
+    marks = get_marks(mn, mx)
 
     return (
-        fig, 
-        (data[ev][sta]["min bf"], data[ev][sta]["max bf"]),
+        payload["fig"],
+        (data["min bf"], data["max bf"]),
         not tf, # turns off the range slider if it can't be modeled
-        data[ev][sta]["min f"], 
-        data[ev][sta]["max f"], 
+        mn, 
+        mx, 
         marks, 
         tf,
-        f"{data[ev][sta]['meta']['repi']:.2f}", 
-        f"{data[ev][sta]['meta']['rhyp']:.2f}"
+        f"{meta['repi']:.2f}", 
+        f"{meta['rhyp']:.2f}"
         )
 
 
-@app.callback(
+def display_graph_update(npos, fig, data):
+    """
+    Server-side fallback of the clientside callback that draws the new
+    bandwidth lines as the slider moves (see assets/clientside.js).
+    """
+    if not any_none(npos, fig, data):
+        return update_bandwidth_lines(fig, npos, data["snr"])
+
+    return dash.no_update
+
+bandwidth_deps = (
     Output("graph", "figure"),
     Input("slider-position", "value"),
     [State("graph", "figure"),
      State("store", "data"),
-     State("station-dropdown", "value"),
-     State("event-dropdown", "value"),   
     ])
-def display_graph_update(npos, fig, data, sta, ev):
 
-    if not any_none(npos, fig, data, sta, ev):
+if binary_transport:
+    for graph, packed in (("graph", "figure-packed"), 
+                          ("overview", "overview-packed"),
+                          ("station-view", "station-view-packed")):
+        app.clientside_callback(
+            ClientsideFunction(
+                namespace = "specmod", 
+                function_name = "unpack_figure"
+                ),
+            Output(graph, "figure"),
+            Input(packed, "data"),
+            )
 
-        fig = go.Figure(fig)
+if clientside_bandwidth:
+    app.clientside_callback(
+        ClientsideFunction(
+            namespace = "specmod", 
+            function_name = "update_bandwidth_lines"
+            ),
+        *bandwidth_deps
+        )
+else:
+    app.callback(*bandwidth_deps)(display_graph_update)
 
-        if data[ev][sta]["snr"]:
-           
-            for pos, nm in zip(npos, ['start', 'end']):
-                
-                name = f"new bandwidth {nm}"
-
-                if not is_auto_bandwidth(fig, pos):
-                    if not trace_in_fig(fig, name):
-                        fig.add_trace(
-                            go.Scatter(
-                                x = [10**pos, 10**pos], 
-                                y = np.power(
-                                    10, 
-                                    fig['layout']['yaxis']['range']
-                                    ),
-                                mode = 'lines',
-                                line_width = 3,
-                                line_dash = 'dash',
-                                line_color = 'green', 
-                                name = f"new bandwidth {nm}",
-                                )
-                            )
-                    else:
-                        fig.for_each_trace(
-                            lambda trace: trace.update(
-                                x=[10**pos, 10**pos],
-                                ) if trace.name == name else (),
-                            )
-            return fig
+def save_event(sid, ev):
+    """
+    Makes the background task that saves the session's changed decisions
+    of an event. The decisions are read when the task runs, so a retry 
+    saves the latest ones (overwriting stations changed on file by someone
+    else, once the conflict has been reported).
+    """
+    def task():
+        upto = len(journal.read(ev))
+        stas = sessions.dirty(sid).get(ev, {})
+
+        report = write_event_specs(evdir, ev, stas, backend, 
+            base = sessions.bases(sid).get(ev))
+
+        if report["error"] is None:
+            sessions.mark_saved(sid, {ev: stas})
+            catalog.mark_reviewed([ev])
+
+        # stations saved by someone else since they were loaded are
+        # overwritten if saved again
+        sessions.rebase(sid, {ev: {**report["states"], **report["conflicts"]}})
+
+        if ev not in sessions.dirty(sid):
+            journal.compact(ev, [sid], upto)
+
+        return report
+
+    # saves run in the background, outside the commit callback
+    if profiler is not None:
+        return profiler.wrap(task, "save_event")
+    return task
 
-    return dash.no_update
 
 @app.callback(
     [
      Output('alert-auto', 'children'), 
      Output('alert-auto', 'is_open'),
+     Output('alert-auto', 'duration'),
+     Output('save-job', 'data'),
+     Output('save-poll', 'disabled'),
+     Output('save-cancel', 'disabled'),
+     Output('save-retry', 'disabled'),
+    ],
+    [
+     Input('commit-change', "n_clicks"),
+     Input('save-poll', "n_intervals"),
+     Input('save-cancel', "n_clicks"),
+     Input('save-retry', "n_clicks"),
     ],
-    Input('commit-change', "n_clicks"),
     [
      State("alert-auto", "is_open"),
-     State("event-dropdown", "value"),
-     State("store", "data")
+     State("session-id", "data"),
+     State("save-job", "data"),
     ]
     )
-def commit_updates_and_save(n, is_open, ev, data):
+def commit_updates_and_save(n, n_poll, n_cancel, n_retry, is_open, sid, 
+                            job_id):
 
-    if not any_none(n, is_open, data):
+    if any_none(is_open, sid):
+        raise dash.exceptions.PreventUpdate
 
-        if n and data is not None:
-        
-            write_specs(evdir, data)
+    triggered = [t["prop_id"] for t in dash.callback_context.triggered]
+    status = save_jobs.status(job_id) if job_id is not None else None
+    running = status is not None and not status["done"]
 
-            msg = f"Saved spectra for {[ev for ev in data.keys()]}."
-            
-            if is_open:
-                is_open = False
+    if "commit-change.n_clicks" in triggered and n and not running:
 
-            return msg, (not is_open)
-    
-    return dash.no_update
+        # only the decisions that differ from what is on file are saved
+        data = sessions.dirty(sid)
+
+        # the session's journal records of events with nothing left to 
+        # save are no longer needed
+        for ev in sessions.decisions(sid):
+            if ev not in data:
+                journal.compact(ev, [sid])
+
+        if not data:
+            return ("No changes to save.", True, 6000, dash.no_update, 
+                    True, True, True)
+
+        job_id = save_jobs.submit({ev: save_event(sid, ev) for ev in data})
+
+    elif "save-cancel.n_clicks" in triggered and n_cancel and running:
+        save_jobs.cancel(job_id)
+
+    elif "save-retry.n_clicks" in triggered and n_retry and status:
+        if not save_jobs.retry(job_id):
+            # the job ran in another server process, so its events are
+            # saved again in a new job here
+            evs = [ev for ev, e in status["events"].items() 
+                   if e["state"] in ("failed", "cancelled")]
+            if evs:
+                job_id = save_jobs.submit(
+                    {ev: save_event(sid, ev) for ev in evs})
+
+    elif not {"save-poll.n_intervals", "commit-change.n_clicks"} & set(
+            triggered):
+        raise dash.exceptions.PreventUpdate
+
+    status = save_jobs.status(job_id) if job_id is not None else None
+
+    if status is None:
+        # e.g., the job was forgotten or its server process restarted
+        return dash.no_update, dash.no_update, 6000, None, True, True, True
+
+    msg = save_progress(status)
+    retry = any(e["state"] in ("failed", "cancelled") 
+                for e in status["events"].values())
+
+    if status["done"]:
+        return msg, True, 6000, job_id, True, True, not retry
+
+    done = sum(e["state"] not in ("queued", "running") 
+               for e in status["events"].values())
+    progress = dbc.Progress(value = 100 * done / len(status["events"]), 
+        className = "mt-2")
+
+    # the alert stays open while the save runs
+    return [msg, progress], True, None, job_id, False, False, True
+
+# summarise new and changed events in the background so they can be
+# filtered by station count, once the server is up so it does not delay
+# the first page
+if config.get("catalog", {}).get("refresh-on-start", True):
+    @app.server.before_first_request
+    def refresh_catalog():
+        threading.Thread(target = catalog.refresh, 
+            kwargs = {"workers": catalog_workers}, daemon = True).start()
+
+# restores the decisions staged before a restart or crash
+@app.server.before_first_request
+def replay_journal():
+    journal.replay(sessions)
+
+# forgets the sessions whose browser is gone once they have nothing unsaved,
+# along with their journal records
+if session_idle_hours:
+    @app.server.before_first_request
+    def prune_sessions():
+        def run():
+            while True:
+                time.sleep(min(600, session_idle_hours * 900))
+                try:
+                    sids = sessions.prune(session_idle_hours * 3600)
+                    for ev in journal.events() if sids else []:
+                        journal.compact(ev, sids)
+                except Exception:
+                    logging.getLogger("specmod").exception(
+                        "pruning the idle sessions failed")
+        threading.Thread(target = run, daemon = True).start()
+
+# the chosen callbacks are profiled, inside their timings
+if profiler is not None:
+    profile_callbacks(app, profiler)
+    add_profiles_route(app, profiler, 
+        allow_remote = metrics_config.get("allow-remote", False))
+
+# every callback above records its timings
+instrument(app, metrics)
+
+# saved decisions of every event, streamed as CSV or Parquet
+add_export_route(app, evdir, catalog.event_dirs, backend, 
+    workers = config.get("export", {}).get("workers", 1))
+
+if metrics_config.get("enabled", True):
+    add_metrics_route(app, metrics, 
+        allow_remote = metrics_config.get("allow-remote", False))
+
+if metrics_config.get("log", False):
+    logging.basicConfig(
+        filename = metrics_config.get("log-path"), 
+        format = "%(message)s",
+        )
+    logging.getLogger("specmod.metrics").setLevel(logging.INFO)
 
 if __name__ == '__main__':
     app.run_server(debug=True)
\ No newline at end of file
@@ -0,0 +1,263 @@
+"""
+cache.py
+
+    The file with the process-wide caches used to keep deserialised
+    SpecMod objects in memory between callbacks.
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class LRUCache:
+    """
+    A bounded, thread-safe least recently used cache. Every entry carries a
+    version (checked on lookup) and a cost in bytes; the least recently used
+    entries are evicted once the total cost exceeds the memory budget.
+
+    Args:
+        max_bytes (int): The memory budget of the cache in bytes. A budget
+            of zero disables caching.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 2**20):
+        self.max_bytes = int(max_bytes)
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, version: Any = None, default: Any = None) -> Any:
+        """
+        Returns the value stored under key if it exists and was stored with
+        the same version, otherwise default. A stale entry is dropped.
+
+        Args:
+            key (Hashable): The cache key.
+            version (Any): The version the entry must match.
+            default (Any): The value returned on a miss.
+
+        Returns:
+            The cached value or default.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] == version:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._drop(key)
+                self.invalidations += 1
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any, version: Any = None,
+            nbytes: int = 0) -> None:
+        """
+        Stores value under key, evicting the least recently used entries
+        until the cache fits within its memory budget. Values bigger than the
+        whole budget are not stored.
+
+        Args:
+            key (Hashable): The cache key.
+            value (Any): The object to cache.
+            version (Any): The version of the object (e.g., a file stamp).
+            nbytes (int): The estimated size of the object in bytes.
+        """
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            if nbytes > self.max_bytes:
+                return
+            self._data[key] = (version, value, int(nbytes))
+            self._nbytes += int(nbytes)
+            self._evict()
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """
+        Drops a single entry, or every entry if no key is given.
+
+        Args:
+            key (Hashable): The key to drop. Default is None (drop all).
+        """
+        with self._lock:
+            if key is None:
+                self.invalidations += len(self._data)
+                self._data.clear()
+                self._nbytes = 0
+            elif key in self._data:
+                self._drop(key)
+                self.invalidations += 1
+
+    def prune(self, keep: Callable[[Hashable, Any], bool]) -> int:
+        """
+        Drops the entries for which keep(key, value) is False.
+
+        Args:
+            keep (Callable): The check of an entry.
+
+        Returns:
+            n (int): The number of entries dropped.
+        """
+        with self._lock:
+            dead = [k for k, e in self._data.items() if not keep(k, e[1])]
+            for key in dead:
+                self._drop(key)
+            self.invalidations += len(dead)
+            return len(dead)
+
+    def resize(self, max_bytes: int) -> None:
+        """
+        Changes the memory budget, evicting entries if needed.
+
+        Args:
+            max_bytes (int): The new memory budget in bytes.
+        """
+        with self._lock:
+            self.max_bytes = int(max_bytes)
+            self._evict()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            stats (dict): The hit/miss counters and current memory use.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._data),
+                "bytes": self._nbytes,
+                "max bytes": self.max_bytes,
+            }
+
+    def _drop(self, key: Hashable) -> None:
+        self._nbytes -= self._data.pop(key)[2]
+
+    def _evict(self) -> None:
+        while self._data and self._nbytes > self.max_bytes:
+            key = next(iter(self._data))
+            self._drop(key)
+            self.evictions += 1
+
+
+def file_version(path: str) -> Tuple[int, int, int]:
+    """
+    Gets a cheap version stamp for a file. The stamp changes whenever the
+    file is rewritten in place or replaced by a rename.
+
+    Args:
+        path (str): The path to the file.
+
+    Returns:
+        version (tuple): The (mtime in ns, size in bytes, inode) of the file.
+    """
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def content_key(*parts: Any) -> str:
+    """
+    Hashes the parts that determine a cached object (e.g., an event, a
+    station and a file version) into a short key, so equal content maps to
+    the same entry whichever code path built it.
+
+    Args:
+        *parts: The parts of the key, hashed through their repr.
+
+    Returns:
+        key (str): The hex digest of the parts.
+    """
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+class FileCache(LRUCache):
+    """
+    An LRU cache of objects deserialised from files. Entries are keyed on
+    the file path and versioned by the file's mtime, size and inode, so a
+    file rewritten by another process is reloaded on the next lookup. The
+    size on disk is used as the memory cost of an entry.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 2**20):
+        super().__init__(max_bytes)
+        self._loading = {}
+
+    def load(self, path: str, loader: Callable[[str], Any]) -> Any:
+        """
+        Returns the object for path from the cache, calling loader(path) on
+        a miss. Concurrent misses on the same path only load the file once.
+
+        Args:
+            path (str): The path to the file.
+            loader (Callable): The function that deserialises the file.
+
+        Returns:
+            The (possibly cached) deserialised object.
+        """
+        key = os.path.abspath(path)
+        version = file_version(key)
+        value = self.get(key, version)
+        if value is not None:
+            return value
+
+        # the lock of a path is shared by every thread waiting on it and
+        # only dropped after the last one, so a later miss cannot get a
+        # fresh lock and load the file alongside a waiter
+        with self._lock:
+            loading = self._loading.setdefault(key, [threading.Lock(), 0])
+            loading[1] += 1
+
+        try:
+            with loading[0]:
+                # another thread may have loaded it while we waited
+                with self._lock:
+                    entry = self._data.get(key)
+                    if entry is not None and entry[0] == version:
+                        self._data.move_to_end(key)
+                        # the miss counted above turned out a hit
+                        self.misses -= 1
+                        self.hits += 1
+                        return entry[1]
+                value = loader(path)
+                self.put(key, value, version, version[1])
+        finally:
+            with self._lock:
+                loading[1] -= 1
+                if not loading[1]:
+                    self._loading.pop(key, None)
+
+        return value
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        super().invalidate(None if path is None else os.path.abspath(path))
+
+
+# the process-wide cache of deserialised SpecMod Spectra objects
+spectra_cache = FileCache()
+
+# the suggested review decisions of each event (see src.specroutines)
+suggestion_cache = LRUCache(32 * 2**20)
+
+# the base figures of each station, drawn under the review decision
+figure_cache = LRUCache(64 * 2**20)
+
+# the log-frequency smoothing matrices of each frequency grid (see
+# src.numerics.smoothing_matrix)
+smoothing_cache = LRUCache(64 * 2**20)
@@ -0,0 +1,503 @@
+"""
+catalog.py
+
+    The file with the on-disk catalog index of the events under the
+    parent directory. The catalog holds the station metadata of every
+    event so the app can list stations without unpickling spectra.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from src.cache import file_version
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    ev TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER,
+    ino INTEGER,
+    nsta INTEGER,
+    npass INTEGER
+);
+CREATE TABLE IF NOT EXISTS stations (
+    ev TEXT,
+    sta TEXT,
+    rank INTEGER,
+    rhyp REAL,
+    repi REAL,
+    snr INTEGER,
+    ubfreqs TEXT,
+    PRIMARY KEY (ev, sta)
+);
+CREATE INDEX IF NOT EXISTS stations_by_sta ON stations (sta);
+CREATE TABLE IF NOT EXISTS reviews (
+    ev TEXT PRIMARY KEY,
+    saved REAL
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    ev TEXT PRIMARY KEY,
+    date TEXT
+);
+CREATE INDEX IF NOT EXISTS dirs_by_date ON dirs (date);
+"""
+
+# the origin time that event directory names start with
+EVENT_TIME = re.compile(r"\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}:\d{2})?")
+
+
+def summarise_spectra(sp) -> List[dict]:
+    """
+    Summarises the stations of an event for the catalog.
+
+    Args:
+        sp (specmod.Spectra): The event spectra.
+
+    Returns:
+        stations (list): One dict per station with the keys "id", "rhyp",
+            "repi", "snr" and "ubfreqs", sorted by hypocentral distance.
+    """
+    stations = [
+        {
+         "id": snp.id,
+         "rhyp": float(snp.signal.meta["rhyp"]),
+         "repi": float(snp.signal.meta["repi"]),
+         "snr": 1 if snp.signal.get_pass_snr() else 0,
+         "ubfreqs": [float(f) for f in np.asarray(snp.ubfreqs).ravel()],
+        } for snp in sp.group.values()
+    ]
+    return sorted(stations, key=lambda x: x["rhyp"])
+
+
+def list_event_dirs(pdir: str) -> List[str]:
+    """
+    Lists the event directories under a parent directory, skipping hidden
+    entries and plain files (such as the catalog itself).
+
+    Args:
+        pdir (str): The parent directory of the events.
+
+    Returns:
+        evs (list): The sorted names of the event directories.
+    """
+    return sorted(
+        e.name for e in os.scandir(pdir)
+        if e.is_dir() and not e.name.startswith(".")
+        )
+
+
+def event_time(ev: str) -> Optional[str]:
+    """
+    Gets the origin time an event directory name starts with.
+
+    Args:
+        ev (str): The event name (e.g., "2012-10-08T12:12:12.760000Z.abc").
+
+    Returns:
+        time (str): The ISO time (e.g., "2012-10-08T12:12:12") or None.
+    """
+    m = EVENT_TIME.match(ev)
+    return m.group(0) if m else None
+
+
+def _load_event(pdir: str, ev: str):
+    from src.specroutines import get_event_spectra
+    return get_event_spectra(pdir, ev)
+
+
+def _spectra_path(pdir: str, ev: str) -> str:
+    from src.specroutines import format_spectra_path
+    return format_spectra_path(pdir, ev)
+
+
+def _init_worker() -> None:
+    # the summarised events are not used again in a refresh worker
+    from src.cache import spectra_cache
+    spectra_cache.resize(0)
+
+
+def _summarise_event(loader: Callable, pdir: str, ev: str) -> List[dict]:
+    return summarise_spectra(loader(pdir, ev))
+
+
+class EventCatalog:
+    """
+    A catalog index of the events under a parent directory, kept in a
+    SQLite file. An event's entry is rebuilt only when the mtime, size or
+    inode of its spectra file changes, so refreshing costs a stat per event
+    plus one load per changed event. The stations table is indexed by
+    station too, so every event that recorded a station can be found
+    without loading any spectra (see station_events).
+
+    Args:
+        pdir (str): The parent directory of the events.
+        path (str): The catalog file. Default is None, which puts it in
+            pdir as ".specmod-catalog.sqlite".
+        loader (Callable): Loads the spectra of an event as loader(pdir, ev).
+            Default is None (src.specroutines.get_event_spectra).
+        spectra_path (Callable): Gives the spectra file of an event as
+            spectra_path(pdir, ev). Default is None
+            (src.specroutines.format_spectra_path).
+        rescan_interval (float): The minimum seconds between listings of
+            the parent directory, which is only listed again when its mtime
+            changed. Default is 2.
+    """
+
+    def __init__(self, pdir: str, path: Optional[str] = None,
+                 loader: Optional[Callable] = None,
+                 spectra_path: Optional[Callable] = None,
+                 rescan_interval: float = 2.0):
+        self.pdir = pdir
+        self.path = path or os.path.join(pdir, ".specmod-catalog.sqlite")
+        self.loader = loader or _load_event
+        self.spectra_path = spectra_path or _spectra_path
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        self._dirs = []
+        self._dirs_mtime = None
+        self._dirs_checked = -float("inf")
+
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(SCHEMA)
+
+        # held open so the WAL files of a catalog in pdir are not removed
+        # when the last connection closes, which would change the mtime of
+        # pdir and have every call list the event directories again
+        self._keep = sqlite3.connect(self.path, check_same_thread=False)
+        self._keep.execute("SELECT COUNT(*) FROM reviews").fetchone()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        con = sqlite3.connect(self.path, timeout=30)
+        con.row_factory = sqlite3.Row
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def event_dirs(self) -> List[str]:
+        """
+        Lists the event directories. The listing is kept and redone only
+        when the mtime of the parent directory changed (checked at most
+        every rescan_interval seconds), so new events show up without a
+        restart at the cost of a stat per call.
+
+        Returns:
+            evs (list): The sorted names of the event directories.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._dirs_checked >= self.rescan_interval:
+                self._dirs_checked = now
+                mtime = os.stat(self.pdir).st_mtime_ns
+                if mtime != self._dirs_mtime:
+                    self._dirs = list_event_dirs(self.pdir)
+                    self._dirs_mtime = mtime
+                    self._sync_dirs(self._dirs)
+            return list(self._dirs)
+
+    def _sync_dirs(self, evs: List[str]) -> None:
+        # the listing is mirrored in the dirs table for search, with the 
+        # origin date of each event
+        with self._connect() as con:
+            known = {r[0] for r in con.execute("SELECT ev FROM dirs")}
+            con.executemany("DELETE FROM dirs WHERE ev = ?",
+                            [(ev,) for ev in known.difference(evs)])
+            con.executemany(
+                "INSERT INTO dirs VALUES (?, ?)",
+                [(ev, (event_time(ev) or "")[:10] or None)
+                 for ev in evs if ev not in known])
+
+    def search(self, query: str = "", start: Optional[str] = None,
+               end: Optional[str] = None, status: Optional[str] = None,
+               min_stations: Optional[int] = None,
+               max_stations: Optional[int] = None, offset: int = 0,
+               limit: Optional[int] = None) -> Tuple[List[dict], int]:
+        """
+        Searches the events. The filters, ordering and paging run in
+        SQLite, on a table that mirrors the listing of the event
+        directories with their origin dates (indexed). Events not yet
+        summarised in the catalog have no station count and are left out
+        by the station count filters.
+
+        Args:
+            query (str): Case-insensitive text the name must contain.
+            start, end (str): The first and last origin date (e.g.,
+                "2012-10-08"), inclusive. Default is None (open).
+            status (str): "reviewed" or "unreviewed" (see mark_reviewed).
+                Default is None (either).
+            min_stations, max_stations (int): The station count range.
+                Default is None (open).
+            offset (int): The number of matches to skip, for paging.
+            limit (int): The number of matches to return. Default is None
+                (all).
+
+        Returns:
+            events (list): One dict per event on the page with the keys
+                "ev", "nsta" (None if not summarised) and "reviewed".
+            total (int): The total number of matches.
+        """
+        # brings the dirs table up to date with the parent directory
+        self.event_dirs()
+
+        where, args = [], []
+        if query:
+            esc = re.sub(r"([\\%_])", r"\\\1", query)
+            where.append("d.ev LIKE ? ESCAPE '\\'")
+            args.append(f"%{esc}%")
+        if start:
+            where.append("d.date >= ?")
+            args.append(start[:10])
+        if end:
+            where.append("d.date <= ?")
+            args.append(end[:10])
+        if status == "reviewed":
+            where.append("r.ev IS NOT NULL")
+        elif status == "unreviewed":
+            where.append("r.ev IS NULL")
+        if min_stations is not None:
+            where.append("e.nsta >= ?")
+            args.append(min_stations)
+        if max_stations is not None:
+            where.append("e.nsta <= ?")
+            args.append(max_stations)
+
+        tables = ("dirs d LEFT JOIN events e ON e.ev = d.ev "
+                  "LEFT JOIN reviews r ON r.ev = d.ev")
+        cond = f" WHERE {' AND '.join(where)}" if where else ""
+
+        with self._connect() as con:
+            total = con.execute(
+                f"SELECT COUNT(*) FROM {tables}{cond}", args).fetchone()[0]
+            rows = con.execute(
+                f"SELECT d.ev, e.nsta, r.ev IS NOT NULL AS reviewed "
+                f"FROM {tables}{cond} ORDER BY d.ev LIMIT ? OFFSET ?",
+                args + [-1 if limit is None else limit, offset]).fetchall()
+
+        return [
+            {"ev": r["ev"], "nsta": r["nsta"], "reviewed": bool(r["reviewed"])}
+            for r in rows
+            ], total
+
+    def mark_reviewed(self, evs: List[str]) -> None:
+        """
+        Records that the review decisions of events were saved.
+
+        Args:
+            evs (list): The event names.
+        """
+        with self._lock, self._connect() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO reviews VALUES (?, ?)",
+                [(ev, time.time()) for ev in evs])
+
+    def refresh(self, evs: Optional[List[str]] = None, 
+                workers: int = 1) -> int:
+        """
+        Brings the catalog entries up to date with the spectra files. With
+        no events given every event directory is checked and the entries of
+        removed events are dropped.
+
+        Args:
+            evs (list): The events to check. Default is None (all events).
+            workers (int): The number of processes the changed events are
+                loaded and summarised in, at most one per CPU. Default is 1
+                (in this process). The loader must be picklable to use more.
+
+        Returns:
+            n (int): The number of entries that were rebuilt.
+        """
+        full = evs is None
+        if full:
+            evs = self.event_dirs()
+
+        with self._connect() as con:
+            if full:
+                rows = con.execute("SELECT * FROM events").fetchall()
+            else:
+                rows = [r for ev in evs for r in con.execute(
+                    "SELECT * FROM events WHERE ev = ?", (ev,))]
+            stamps = {
+                r["ev"]: (r["mtime_ns"], r["size"], r["ino"]) for r in rows
+                }
+
+        changed = {}
+        for ev in evs:
+            try:
+                version = file_version(self.spectra_path(self.pdir, ev))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            if stamps.get(ev) != version:
+                changed[ev] = version
+
+        args = ([self.loader] * len(changed), [self.pdir] * len(changed), 
+                changed)
+        workers = min(workers, len(changed), os.cpu_count() or 1)
+        if workers > 1:
+            with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+                self._update_many(changed, pool.map(
+                    _summarise_event, *args, chunksize=8))
+        else:
+            self._update_many(changed, map(_summarise_event, *args))
+
+        n = len(changed)
+
+        if full:
+            gone = set(stamps) - set(evs)
+            with self._lock, self._connect() as con:
+                for ev in gone:
+                    con.execute("DELETE FROM events WHERE ev = ?", (ev,))
+                    con.execute("DELETE FROM stations WHERE ev = ?", (ev,))
+
+        return n
+
+    def _update_many(self, versions: dict, summaries: Iterator[List[dict]],
+                     batch: int = 100) -> None:
+        # the entries are written in batches, a transaction per event 
+        # would cost more than summarising it
+        items = zip(versions.items(), summaries)
+        while True:
+            chunk = [item for _, item in zip(range(batch), items)]
+            if not chunk:
+                return
+            with self._lock, self._connect() as con:
+                for (ev, version), stations in chunk:
+                    self._update(con, ev, version, stations)
+
+    @staticmethod
+    def _update(con: sqlite3.Connection, ev: str, version: tuple, 
+                stations: List[dict]) -> None:
+        con.execute("DELETE FROM stations WHERE ev = ?", (ev,))
+        con.executemany(
+            "INSERT INTO stations VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(ev, s["id"], i, s["rhyp"], s["repi"], s["snr"],
+              json.dumps(s["ubfreqs"])) for i, s in enumerate(stations)]
+            )
+        con.execute(
+            "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)",
+            (ev, *version, len(stations),
+             sum(s["snr"] for s in stations))
+            )
+
+    def stations(self, ev: str) -> List[dict]:
+        """
+        Gets the catalog entry of every station of an event, refreshing the
+        event's entry first if its spectra file changed.
+
+        Args:
+            ev (str): The event name.
+
+        Returns:
+            stations (list): One dict per station (see summarise_spectra),
+                sorted by hypocentral distance.
+        """
+        self.refresh([ev])
+
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT * FROM stations WHERE ev = ? ORDER BY rank", (ev,)
+                ).fetchall()
+
+        return [self._station(r) for r in rows]
+
+    def station(self, ev: str, sta: str) -> Optional[dict]:
+        """
+        Gets the catalog entry of a single station.
+
+        Args:
+            ev (str): The event name.
+            sta (str): The station id.
+
+        Returns:
+            station (dict): The station entry or None if it is not found.
+        """
+        self.refresh([ev])
+
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT * FROM stations WHERE ev = ? AND sta = ?", (ev, sta)
+                ).fetchone()
+
+        return self._station(row) if row is not None else None
+
+    def station_ids(self) -> List[Tuple[str, int]]:
+        """
+        Lists every station in the catalog with the number of events it
+        recorded.
+
+        Returns:
+            stations (list): The (station id, number of events) pairs,
+                sorted by station id.
+        """
+        with self._connect() as con:
+            return [tuple(r) for r in con.execute(
+                "SELECT sta, COUNT(*) FROM stations GROUP BY sta ORDER BY sta")]
+
+    def station_events(self, sta: str, limit: Optional[int] = None,
+                       passed: Optional[bool] = None) -> List[dict]:
+        """
+        Gets the catalog entries of a station across every event that 
+        recorded it, from the station index rather than the spectra.
+
+        Args:
+            sta (str): The station id.
+            limit (int): The number of events to return. Default is None
+                (all).
+            passed (bool): Only the events where the station can (True) or
+                cannot (False) be modeled. Default is None (either).
+
+        Returns:
+            stations (list): One dict per event with the keys "ev" and 
+                those of summarise_spectra, sorted by event name (i.e., 
+                origin time).
+        """
+        sql = "SELECT * FROM stations WHERE sta = ?"
+        args = [sta]
+        if passed is not None:
+            sql += " AND snr = ?"
+            args.append(int(passed))
+        sql += " ORDER BY ev"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+
+        with self._connect() as con:
+            rows = con.execute(sql, args).fetchall()
+
+        return [{"ev": r["ev"], **self._station(r)} for r in rows]
+
+    @staticmethod
+    def _station(row: sqlite3.Row) -> dict:
+        return {
+            "id": row["sta"],
+            "rhyp": row["rhyp"],
+            "repi": row["repi"],
+            "snr": row["snr"],
+            "ubfreqs": json.loads(row["ubfreqs"]),
+        }
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Build or refresh the SpecMod Dash event catalog.")
+    parser.add_argument("pdir", help="The parent directory of the events.")
+    parser.add_argument("--path", default=None, help="The catalog file.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+        help="The number of processes events are summarised in.")
+    args = parser.parse_args()
+
+    n = EventCatalog(args.pdir, args.path).refresh(workers=args.workers)
+    print(f"rebuilt {n} catalog entries")
@@ -0,0 +1,290 @@
+"""
+columnar.py
+
+    The file with the memory-mapped columnar storage backend for event
+    spectra. The signal and noise arrays of every station of an event are
+    stored back to back in one .npy file per column, with an offset table
+    per station, so a single station can be read without loading the
+    rest of the event. Review decisions are kept in a separate small file
+    and can be rewritten without touching the amplitude data.
+
+    The layout of an event converted from {ev}.spec is:
+
+        {ev}.cols/
+            signal_freq.npy, signal_amp.npy, noise_freq.npy, noise_amp.npy
+            index.pkl       (station ids, offsets and metadata)
+            decisions.json  (snr pass flag and ubfreqs per station)
+"""
+import os
+import json
+import pickle
+import shutil
+import tempfile
+import numpy as np
+from functools import lru_cache
+from typing import List, Optional
+
+COLUMNS = ("signal_freq", "signal_amp", "noise_freq", "noise_amp")
+
+
+def format_columns_path(pdir: str, ev: str) -> str:
+    return f"{pdir}/{ev}/Spectra/{ev}.cols"
+
+
+class ColumnSpectrum:
+    """
+    The signal or noise spectrum of a station in a ColumnStore. It mirrors
+    the parts of the SpecMod spectrum interface used by specmod-dash.
+    """
+
+    def __init__(self, freq: np.ndarray, amp: np.ndarray, meta: dict,
+                 pass_snr: bool = True):
+        self.freq = freq
+        self.amp = amp
+        self.meta = meta
+        self._pass_snr = bool(pass_snr)
+
+    def get_pass_snr(self) -> bool:
+        return self._pass_snr
+
+    def set_pass_snr(self, tf: bool) -> None:
+        self._pass_snr = bool(tf)
+
+
+class ColumnSNP:
+    """
+    The signal and noise spectra of a station in a ColumnStore. It mirrors
+    the parts of the SpecMod SNP interface used by specmod-dash.
+    """
+
+    def __init__(self, sta: str, signal: ColumnSpectrum,
+                 noise: ColumnSpectrum, ubfreqs: np.ndarray):
+        self.id = sta
+        self.signal = signal
+        self.noise = noise
+        self.ubfreqs = ubfreqs
+
+
+class ColumnStore:
+    """
+    Reads an event from the columnar layout. The arrays are memory-mapped,
+    so get_spectra returns views onto the files without copying the data.
+
+    Args:
+        path (str): The columnar directory of the event.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(os.path.join(path, "index.pkl"), "rb") as f:
+            index = pickle.load(f)
+
+        self.source_version = index["source version"]
+        self._stations = {s["id"]: s for s in index["stations"]}
+        self._cols = {
+            c: np.load(os.path.join(path, f"{c}.npy"), mmap_mode="r")
+            for c in COLUMNS
+            }
+
+        with open(os.path.join(path, "decisions.json"), "r") as f:
+            self._decisions = json.load(f)
+
+        self._snps = {}
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.isfile(os.path.join(path, "decisions.json"))
+
+    @staticmethod
+    def read_source_version(path: str) -> Optional[tuple]:
+        """
+        Gets the version stamp of the pickle a columnar directory was
+        converted from, without opening the columns. The index is only
+        read again when it changes.
+
+        Args:
+            path (str): The columnar directory of the event.
+
+        Returns:
+            version (tuple): The version stamp, or None if not recorded.
+        """
+        index = os.path.join(path, "index.pkl")
+        st = os.stat(index)
+        return _read_source_version(index, st.st_mtime_ns, st.st_ino)
+
+    def stations(self) -> List[str]:
+        """
+        Returns:
+            stas (list): The station ids of the event.
+        """
+        return list(self._stations)
+
+    def get_spectra(self, sta: str) -> ColumnSNP:
+        """
+        Gets the spectra of a single station as views onto the columns.
+        The same instance is returned on every call, so changes made to it
+        can be saved with save_decisions.
+
+        Args:
+            sta (str): The station id.
+
+        Returns:
+            snp (ColumnSNP): The signal and noise spectra of the station.
+        """
+        if sta in self._snps:
+            return self._snps[sta]
+
+        rec = self._stations[sta]
+        dec = self._decisions[sta]
+        s0, s1 = rec["signal"]
+        n0, n1 = rec["noise"]
+
+        snp = self._snps[sta] = ColumnSNP(
+            sta,
+            ColumnSpectrum(self._cols["signal_freq"][s0:s1],
+                           self._cols["signal_amp"][s0:s1],
+                           rec["signal meta"], dec["snr"]),
+            ColumnSpectrum(self._cols["noise_freq"][n0:n1],
+                           self._cols["noise_amp"][n0:n1],
+                           rec["noise meta"]),
+            np.array(dec["ubfreqs"], dtype=float),
+            )
+
+        return snp
+
+    @property
+    def group(self) -> dict:
+        """
+        The spectra of every station as {station: ColumnSNP}, like the
+        group of a SpecMod Spectra.
+        """
+        return {sta: self.get_spectra(sta) for sta in self._stations}
+
+    def save_decisions(self) -> int:
+        """
+        Writes the pass flag and ubfreqs of the stations returned by
+        get_spectra back to the decisions file (atomically). The arrays are
+        not rewritten.
+
+        Returns:
+            nbytes (int): The size of the written decisions file in bytes.
+        """
+        for sta, snp in self._snps.items():
+            self._decisions[sta] = {
+                "snr": 1 if snp.signal.get_pass_snr() else 0,
+                "ubfreqs": [float(f) for f in np.asarray(snp.ubfreqs).ravel()],
+                }
+
+        path = os.path.join(self.path, "decisions.json")
+        fd, tmp = tempfile.mkstemp(prefix=".decisions.", suffix=".tmp",
+                                   dir=self.path)
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._decisions, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+        return os.path.getsize(path)
+
+
+@lru_cache(maxsize=1024)
+def _read_source_version(index: str, mtime_ns: int, ino: int):
+    with open(index, "rb") as f:
+        version = pickle.load(f)["source version"]
+    return tuple(version) if version is not None else None
+
+
+def stamp_columns(path: str, source_version: tuple) -> None:
+    """
+    Records a new version stamp of the source pickle in a columnar
+    directory (atomically), e.g. after its decisions were folded back
+    into the pickle, which leaves the columns up to date.
+
+    Args:
+        path (str): The columnar directory of the event.
+        source_version (tuple): The version stamp of the source pickle.
+    """
+    index = os.path.join(path, "index.pkl")
+    with open(index, "rb") as f:
+        data = pickle.load(f)
+    data["source version"] = source_version
+
+    fd, tmp = tempfile.mkstemp(prefix=".index.", suffix=".tmp", dir=path)
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(data, f)
+    os.replace(tmp, index)
+
+
+def write_columns(sp, path: str, source_version: Optional[tuple] = None) -> int:
+    """
+    Writes the spectra of an event in the columnar layout. The layout is
+    built in a temporary directory which then replaces path. An existing
+    directory is renamed aside first and only removed once the new one is
+    in place (or restored if that fails), so readers never see a partly
+    removed layout; for the moment in between path is missing and they
+    fall back to the pickle.
+
+    Args:
+        sp (specmod.Spectra): The event spectra.
+        path (str): The columnar directory to write.
+        source_version (tuple): The version stamp of the file sp was read
+            from. Default is None.
+
+    Returns:
+        nbytes (int): The total size of the written files in bytes.
+    """
+    stations, cols, offsets = [], {c: [] for c in COLUMNS}, dict.fromkeys(
+        ("signal", "noise"), 0)
+    decisions = {}
+
+    for sta, snp in sp.group.items():
+        rec = {"id": sta}
+        for part in ("signal", "noise"):
+            spec = getattr(snp, part)
+            freq = np.asarray(spec.freq, dtype=float)
+            amp = np.asarray(spec.amp, dtype=float)
+            cols[f"{part}_freq"].append(freq)
+            cols[f"{part}_amp"].append(amp)
+            rec[part] = (offsets[part], offsets[part] + freq.size)
+            rec[f"{part} meta"] = spec.meta
+            offsets[part] += freq.size
+        stations.append(rec)
+        decisions[sta] = {
+            "snr": 1 if snp.signal.get_pass_snr() else 0,
+            "ubfreqs": [float(f) for f in np.asarray(snp.ubfreqs).ravel()],
+            }
+
+    parent = os.path.dirname(os.path.abspath(path))
+    tmp = tempfile.mkdtemp(prefix=".cols.", dir=parent)
+
+    try:
+        for c, arrs in cols.items():
+            np.save(os.path.join(tmp, f"{c}.npy"),
+                    np.concatenate(arrs) if arrs else np.empty(0))
+        with open(os.path.join(tmp, "index.pkl"), "wb") as f:
+            pickle.dump({"source version": source_version,
+                         "stations": stations}, f)
+        with open(os.path.join(tmp, "decisions.json"), "w") as f:
+            json.dump(decisions, f)
+
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    old = None
+    if os.path.isdir(path):
+        old = tempfile.mkdtemp(prefix=".cols.old.", dir=parent)
+        os.rmdir(old)
+        os.replace(path, old)
+    try:
+        os.replace(tmp, path)
+    except BaseException:
+        if old is not None:
+            os.replace(old, path)
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+    return sum(e.stat().st_size for e in os.scandir(path))
@@ -0,0 +1,423 @@
+"""
+export.py
+
+    The file with the streaming export of the review decisions (and
+    optionally the spectra) of every station to CSV or Parquet, for the
+    codes downstream of the review. Events are read one at a time, in
+    worker processes if asked, and written out as soon as they are read,
+    so memory use does not grow with the number of events. The Parquet
+    files have one row group per event and need pyarrow.
+"""
+import io
+import csv
+import json
+import math
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from src.cache import file_version
+from src.catalog import summarise_spectra
+from src.specroutines import get_event_spectra, source_path
+
+# the columns of an export, the spectra columns are only written on request
+COLUMNS = ["event", "station", "snr", "min_bf", "max_bf", "ubfreq_min",
+           "ubfreq_max", "rhyp", "repi"]
+SPECTRA_COLUMNS = ["signal_freq", "signal_amp", "noise_freq", "noise_amp"]
+
+FORMATS = ("csv", "parquet")
+
+
+def export_format(path: str) -> str:
+    """
+    Gets the export format from a file name, "parquet" for .parquet (or
+    .pq) files and "csv" otherwise.
+    """
+    return "parquet" if path.endswith((".parquet", ".pq")) else "csv"
+
+
+def event_rows(pdir: str, ev: str, backend: str = "pickle",
+               spectra: bool = False) -> List[dict]:
+    """
+    Gets the export rows of the stations of an event. The bandwidth is
+    given both in log10 Hz (min_bf, max_bf, as read by batch_review.py) and
+    in Hz (ubfreq_min, ubfreq_max), and is empty for stations that cannot
+    be modeled.
+
+    Args:
+        pdir (str): The parent directory of the events.
+        ev (str): The event name.
+        backend (str): The storage backend, "pickle" or "columnar".
+        spectra (bool): Add the signal and noise spectra. Default is False.
+
+    Returns:
+        rows (list): One dict per station, sorted by hypocentral distance.
+    """
+    # read past the spectra cache, each event is only read once
+    sp = get_event_spectra(pdir, ev, cached=False, backend=backend)
+
+    rows = []
+    for s in summarise_spectra(sp):
+        band = s["ubfreqs"][:2] if s["snr"] and len(s["ubfreqs"]) >= 2 else []
+        row = {
+            "event": ev,
+            "station": s["id"],
+            "snr": s["snr"],
+            "min_bf": math.log10(band[0]) if band else None,
+            "max_bf": math.log10(band[1]) if band else None,
+            "ubfreq_min": band[0] if band else None,
+            "ubfreq_max": band[1] if band else None,
+            "rhyp": s["rhyp"],
+            "repi": s["repi"],
+        }
+        if spectra:
+            snp = sp.get_spectra(s["id"])
+            for name, spec in (("signal", snp.signal), ("noise", snp.noise)):
+                row[f"{name}_freq"] = np.asarray(spec.freq, dtype="f4")
+                row[f"{name}_amp"] = np.asarray(spec.amp, dtype="f4")
+        rows.append(row)
+
+    return rows
+
+
+def _read_event(pdir: str, ev: str, backend: str,
+                spectra: bool) -> Tuple[Optional[List[dict]], Optional[str]]:
+    try:
+        return event_rows(pdir, ev, backend, spectra), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def iter_events(pdir: str, evs: Iterable[str], backend: str = "pickle",
+                spectra: bool = False, workers: int = 1
+                ) -> Iterator[Tuple[str, Optional[List[dict]], Optional[str]]]:
+    """
+    Reads the export rows of events, in order. With several workers the
+    events are read in a process pool, at most two per worker ahead of the
+    one being written, so memory stays bounded however many events there
+    are.
+
+    Args:
+        pdir (str): The parent directory of the events.
+        evs (Iterable): The event names.
+        backend (str): The storage backend, "pickle" or "columnar".
+        spectra (bool): Add the signal and noise spectra. Default is False.
+        workers (int): The number of processes. Default is 1 (in this
+            process).
+
+    Yields:
+        (ev, rows, error): The event, its rows (see event_rows) or None
+            and the error message if it could not be read.
+    """
+    if workers <= 1:
+        for ev in evs:
+            yield (ev, *_read_event(pdir, ev, backend, spectra))
+        return
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for ev in evs:
+            pending.append((ev, pool.submit(
+                _read_event, pdir, ev, backend, spectra)))
+            if len(pending) >= 2 * workers:
+                ev, fut = pending.popleft()
+                yield (ev, *fut.result())
+        while pending:
+            ev, fut = pending.popleft()
+            yield (ev, *fut.result())
+
+
+class _Sink:
+    """
+    A write-only file that hands over what was written since it was last
+    drained, so an export can be streamed without a file on disk.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+class CSVWriter:
+    """
+    Writes export rows as CSV. The spectra are written as JSON arrays.
+    """
+
+    def __init__(self, sink, spectra: bool = False):
+        self._sink = sink
+        self._columns = COLUMNS + (SPECTRA_COLUMNS if spectra else [])
+        self._text = io.StringIO()
+        self._csv = csv.DictWriter(self._text, self._columns,
+                                   lineterminator="\n")
+        self._csv.writeheader()
+
+    def write(self, rows: List[dict]) -> None:
+        for row in rows:
+            self._csv.writerow({
+                k: (json.dumps(np.round(v.astype(float), 6).tolist())
+                    if isinstance(v, np.ndarray) else v)
+                for k, v in row.items() if k in self._columns})
+        self._sink.write(self._text.getvalue().encode())
+        self._text.seek(0)
+        self._text.truncate()
+
+    def close(self) -> None:
+        self.write([])
+
+
+class ParquetWriter:
+    """
+    Writes export rows as Parquet, one row group per call to write (i.e.,
+    per event). The spectra are float32 list columns.
+    """
+
+    def __init__(self, sink, spectra: bool = False):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError(
+                "exporting to Parquet needs pyarrow (pip install pyarrow)"
+                ) from e
+
+        fields = [
+            ("event", pa.string()), ("station", pa.string()),
+            ("snr", pa.int8()),
+            ] + [(c, pa.float64()) for c in COLUMNS[3:]]
+        if spectra:
+            fields += [(c, pa.list_(pa.float32())) for c in SPECTRA_COLUMNS]
+
+        self._pa = pa
+        self._schema = pa.schema(fields)
+        self._writer = pq.ParquetWriter(sink, self._schema)
+
+    def write(self, rows: List[dict]) -> None:
+        if rows:
+            # from_pydict, as from_pylist needs pyarrow 7
+            self._writer.write_table(self._pa.Table.from_pydict(
+                {c: [r[c] for r in rows] for c in self._schema.names},
+                schema=self._schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+def make_writer(fmt: str, sink, spectra: bool = False):
+    """
+    Makes the writer of an export format ("csv" or "parquet").
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}, not {fmt}")
+    return (ParquetWriter if fmt == "parquet" else CSVWriter)(sink, spectra)
+
+
+def stream_export(pdir: str, evs: Iterable[str], fmt: str = "csv",
+                  backend: str = "pickle", spectra: bool = False,
+                  workers: int = 1, report: Optional[dict] = None
+                  ) -> Iterator[bytes]:
+    """
+    Streams an export, one chunk per event, e.g., as an HTTP response.
+
+    Args:
+        pdir (str): The parent directory of the events.
+        evs (Iterable): The event names.
+        fmt (str): "csv" or "parquet". Default is "csv".
+        backend (str): The storage backend, "pickle" or "columnar".
+        spectra (bool): Add the signal and noise spectra. Default is False.
+        workers (int): The number of processes reading events.
+        report (dict): If given, filled with the events exported (with the
+            version of their file before reading), the number of rows and
+            the events that failed as {event: error}.
+
+    Yields:
+        chunk (bytes): The bytes of the file written since the last chunk.
+    """
+    report = {} if report is None else report
+    report.update({"events": {}, "rows": 0, "failed": {}})
+
+    # made before the first chunk is asked for, so a missing pyarrow fails
+    # the call (e.g., the request) rather than cutting the file short
+    sink = _Sink()
+    writer = make_writer(fmt, sink, spectra)
+    return _stream(pdir, evs, backend, spectra, workers, report, sink, 
+                   writer)
+
+
+def _stream(pdir, evs, backend, spectra, workers, report, sink, writer):
+
+    def versioned(evs):
+        # the version is taken before reading, so a change made while
+        # exporting is picked up by the next incremental export
+        for ev in evs:
+            try:
+                report["events"][ev] = file_version(
+                    source_path(pdir, ev, backend))
+            except FileNotFoundError:
+                pass
+            yield ev
+
+    for ev, rows, error in iter_events(pdir, versioned(evs), backend,
+                                       spectra, workers):
+        if error is not None:
+            report["events"].pop(ev, None)
+            report["failed"][ev] = error
+            continue
+        writer.write(rows)
+        report["rows"] += len(rows)
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+def read_state(path: str) -> Dict[str, list]:
+    """
+    Reads the versions of the events written by previous exports.
+
+    Args:
+        path (str): The export state file.
+
+    Returns:
+        versions (dict): The file version of each event as {event: list},
+            empty if there is no state file.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)["events"]
+    except FileNotFoundError:
+        return {}
+
+
+def changed_events(pdir: str, evs: Iterable[str], state: Dict[str, list],
+                   backend: str = "pickle") -> List[str]:
+    """
+    Gets the events whose file changed since they were last exported.
+
+    Args:
+        pdir (str): The parent directory of the events.
+        evs (Iterable): The event names.
+        state (dict): The versions of the exported events (see
+            read_state).
+        backend (str): The storage backend, "pickle" or "columnar".
+
+    Returns:
+        evs (list): The new and changed events.
+    """
+    changed = []
+    for ev in evs:
+        try:
+            version = list(file_version(source_path(pdir, ev, backend)))
+        except FileNotFoundError:
+            continue
+        if state.get(ev) != version:
+            changed.append(ev)
+    return changed
+
+
+def export(pdir: str, out: str, evs: Iterable[str], fmt: Optional[str] = None,
+           backend: str = "pickle", spectra: bool = False, workers: int = 1,
+           state: Optional[str] = None) -> dict:
+    """
+    Exports events to a file. The file is written under a temporary name
+    and renamed once complete.
+
+    Args:
+        pdir (str): The parent directory of the events.
+        out (str): The output file.
+        evs (Iterable): The event names.
+        fmt (str): "csv" or "parquet". Default is None (from the name of
+            out, see export_format).
+        backend (str): The storage backend, "pickle" or "columnar".
+        spectra (bool): Add the signal and noise spectra. Default is False.
+        workers (int): The number of processes reading events.
+        state (str): If given, the versions of the exported events are
+            recorded in this file for incremental exports (see
+            changed_events).
+
+    Returns:
+        report (dict): The events exported, the number of rows and the
+            events that failed (see stream_export).
+    """
+    report = {}
+    tmp = f"{out}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in stream_export(pdir, evs, fmt or export_format(out),
+                                       backend, spectra, workers, report):
+                f.write(chunk)
+        os.replace(tmp, out)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    if state is not None:
+        versions = read_state(state)
+        versions.update({ev: list(v) for ev, v in report["events"].items()})
+        with open(f"{state}.tmp", "w") as f:
+            json.dump({"events": versions}, f)
+        os.replace(f"{state}.tmp", state)
+
+    return report
+
+
+def add_export_route(app, pdir: str, events, backend: str = "pickle",
+                     workers: int = 1, path: str = "/export") -> None:
+    """
+    Serves streamed exports on the app's server as {path}/{name}.csv or
+    {path}/{name}.parquet, with the spectra added by the query ?spectra=1.
+
+    Args:
+        app (dash.Dash): The app.
+        pdir (str): The parent directory of the events.
+        events (Callable): Gives the events to export (e.g.,
+            EventCatalog.event_dirs).
+        backend (str): The storage backend, "pickle" or "columnar".
+        workers (int): The number of processes reading events.
+        path (str): The route prefix. Default is "/export".
+    """
+    import flask
+
+    def serve_export(name: str, fmt: str):
+        if fmt not in FORMATS:
+            flask.abort(404)
+        spectra = flask.request.args.get("spectra", "0") in ("1", "true")
+        try:
+            chunks = stream_export(pdir, events(), fmt, backend, spectra, 
+                                   workers)
+        except ImportError as e:
+            # Parquet without pyarrow
+            flask.abort(404, str(e))
+        mimetype = ("application/vnd.apache.parquet" if fmt == "parquet"
+                    else "text/csv")
+        return flask.Response(
+            flask.stream_with_context(chunks), mimetype=mimetype,
+            headers={"Content-Disposition":
+                     f'attachment; filename="{name}.{fmt}"'})
+
+    app.server.add_url_rule(f"{path}/<name>.<fmt>", "export", serve_export)
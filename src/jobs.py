@@ -0,0 +1,267 @@
+"""
+jobs.py
+
+    The file with the background job queue that saves review decisions
+    without holding up a request, one task per event, and keeps the
+    progress of every job for the browser to poll.
+"""
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+# a job task saves one event and returns its report (see
+# src.specroutines.write_event_specs), which has an "error" key
+Task = Callable[[], dict]
+
+# the states of the events of a job
+QUEUED, RUNNING, SAVED, FAILED, CANCELLED = (
+    "queued", "running", "saved", "failed", "cancelled")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT,
+    ev TEXT,
+    state TEXT,
+    error TEXT,
+    report TEXT,
+    started REAL,
+    PRIMARY KEY (job_id, ev)
+);
+"""
+
+# seconds after which the shared state of a job is dropped, e.g. of a job
+# whose server process died before forgetting it
+JOB_TTL = 24 * 3600
+
+
+class JobQueue:
+    """
+    Runs jobs on a local thread pool. A job is a set of tasks, one per
+    event, whose states are tracked separately so the progress of a job
+    can be shown while it runs. Queued tasks can be cancelled and failed
+    or cancelled tasks run again.
+
+    The tasks run in the server process a job was submitted to. With a
+    database path the state of every event is also kept in a SQLite table
+    (e.g., in the session database), so the other worker processes of the
+    app can follow a job and cancel its queued events; retrying needs the
+    tasks, so it only works in the process that runs the job.
+
+    Args:
+        max_workers (int): The number of events saved at once.
+        keep (int): The number of finished jobs kept for polling.
+        path (str): The database the job states are shared in. Default is
+            None (kept in memory only, for a single server process).
+    """
+
+    def __init__(self, max_workers: int = 4, keep: int = 100,
+                 path: Optional[str] = None):
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="save")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.keep = keep
+        self.path = path
+        if path is not None:
+            with self._connect() as con:
+                con.execute("PRAGMA journal_mode=WAL")
+                con.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[Optional[sqlite3.Connection]]:
+        if self.path is None:
+            yield None
+            return
+        con = sqlite3.connect(self.path, timeout=30)
+        con.row_factory = sqlite3.Row
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def _share(self, job_id: str, ev: str, event: dict,
+               started: float) -> None:
+        with self._connect() as con:
+            if con is not None:
+                con.execute(
+                    "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, ev, event["state"], event["error"],
+                     json.dumps(event["report"], default=_jsonable),
+                     started))
+
+    def submit(self, tasks: Dict[str, Task]) -> str:
+        """
+        Queues a new job.
+
+        Args:
+            tasks (dict): The tasks as {event: task}.
+
+        Returns:
+            job_id (str): The id of the job.
+        """
+        job_id = uuid.uuid4().hex
+        job = {"id": job_id, "tasks": dict(tasks), "events": {},
+               "futures": {}, "started": time.time()}
+        with self._lock:
+            self._jobs[job_id] = job
+            forgotten = self._forget()
+        with self._connect() as con:
+            if con is not None:
+                con.executemany("DELETE FROM jobs WHERE job_id = ?",
+                                [(jid,) for jid in forgotten])
+                con.execute("DELETE FROM jobs WHERE started < ?",
+                            (time.time() - JOB_TTL,))
+        self._queue(job, tasks)
+        return job_id
+
+    def _queue(self, job: dict, evs: Iterable[str]) -> None:
+        evs = list(evs)
+        queued = {"state": QUEUED, "error": None, "report": None}
+        # shared before the tasks can start, so they find it
+        for ev in evs:
+            self._share(job["id"], ev, queued, job["started"])
+        with self._lock:
+            for ev in evs:
+                job["events"][ev] = dict(queued)
+                job["futures"][ev] = self._pool.submit(self._run, job, ev)
+
+    def _run(self, job: dict, ev: str) -> None:
+        with self._connect() as con:
+            # another process may have cancelled the event meanwhile
+            if con is not None and not con.execute(
+                    "UPDATE jobs SET state = ? WHERE job_id = ? AND ev = ? "
+                    "AND state = ?", (RUNNING, job["id"], ev, QUEUED)
+                    ).rowcount:
+                with self._lock:
+                    job["events"][ev]["state"] = CANCELLED
+                return
+        with self._lock:
+            job["events"][ev]["state"] = RUNNING
+        try:
+            report = job["tasks"][ev]()
+            error = report.get("error")
+        except Exception as e:
+            report, error = None, f"{type(e).__name__}: {e}"
+        event = {"state": FAILED if error else SAVED,
+                 "error": error, "report": report}
+        self._share(job["id"], ev, event, job["started"])
+        with self._lock:
+            job["events"][ev] = event
+
+    def _forget(self) -> list:
+        # drops the oldest finished jobs beyond the ones kept
+        finished = [jid for jid, job in self._jobs.items()
+                    if all(f.done() for f in job["futures"].values())]
+        forgotten = finished[:max(len(finished) - self.keep, 0)]
+        for jid in forgotten:
+            del self._jobs[jid]
+        return forgotten
+
+    def _shared_status(self, job_id: str) -> Optional[dict]:
+        with self._connect() as con:
+            if con is None:
+                return None
+            rows = con.execute("SELECT * FROM jobs WHERE job_id = ?",
+                               (job_id,)).fetchall()
+        if not rows:
+            return None
+        events = {r["ev"]: {"state": r["state"], "error": r["error"],
+                            "report": json.loads(r["report"])}
+                  for r in rows}
+        return {
+            "events": events,
+            "done": all(e["state"] not in (QUEUED, RUNNING)
+                        for e in events.values()),
+            "seconds": time.time() - rows[0]["started"],
+        }
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """
+        Gets the progress of a job.
+
+        Args:
+            job_id (str): The id of the job.
+
+        Returns:
+            status (dict): The state, error and report of each event as
+                {"events": {event: {...}}}, with "done" True once no task
+                is queued or running and the seconds since it started.
+                None if the job is unknown.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                # e.g., submitted to another server process
+                return self._shared_status(job_id)
+            events = {ev: dict(e) for ev, e in job["events"].items()}
+        return {
+            "events": events,
+            "done": all(e["state"] not in (QUEUED, RUNNING)
+                        for e in events.values()),
+            "seconds": time.time() - job["started"],
+        }
+
+    def cancel(self, job_id: str) -> int:
+        """
+        Cancels the queued tasks of a job. Events already being saved are
+        finished.
+
+        Args:
+            job_id (str): The id of the job.
+
+        Returns:
+            n (int): The number of tasks cancelled.
+        """
+        n, cancelled = 0, []
+        with self._lock:
+            job = self._jobs.get(job_id)
+            for ev, fut in (job or {}).get("futures", {}).items():
+                if fut.cancel():
+                    job["events"][ev]["state"] = CANCELLED
+                    cancelled.append((CANCELLED, job_id, ev, QUEUED))
+                    n += 1
+        with self._connect() as con:
+            if con is not None and job is None:
+                # the tasks see this when they are due to start
+                n = con.execute(
+                    "UPDATE jobs SET state = ? WHERE job_id = ? "
+                    "AND state = ?", (CANCELLED, job_id, QUEUED)).rowcount
+            elif con is not None:
+                con.executemany(
+                    "UPDATE jobs SET state = ? WHERE job_id = ? AND ev = ? "
+                    "AND state = ?", cancelled)
+        return n
+
+    def retry(self, job_id: str) -> int:
+        """
+        Queues the failed and cancelled tasks of a job again. Only jobs
+        submitted to this process can be retried.
+
+        Args:
+            job_id (str): The id of the job.
+
+        Returns:
+            n (int): The number of tasks queued.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            evs = [ev for ev, e in (job or {}).get("events", {}).items()
+                   if e["state"] in (FAILED, CANCELLED)]
+        if evs:
+            self._queue(job, evs)
+        return len(evs)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
+
+
+def _jsonable(obj):
+    # numpy scalars and arrays in the reports
+    return obj.tolist() if hasattr(obj, "tolist") else str(obj)
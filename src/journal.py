@@ -0,0 +1,260 @@
+"""
+journal.py
+
+    The file with the append-only journal of review decisions. Every
+    decision staged in the app is appended as one small JSON line to a
+    journal file in the event's directory, so a crash of the browser or the
+    server loses nothing. The journal is replayed into the session store on
+    restart and compacted once the decisions are written to the spectra
+    file (see fold_journal and the "Save spectra" button).
+
+    Stations are only journaled once a decision is staged for them: each
+    record carries the decision read from file and the station's state on
+    file too, which replay seeds the session with first, so merely viewing
+    stations does not grow the journal.
+"""
+import os
+import glob
+import json
+from typing import Iterable, List, Optional
+
+from src.locks import file_lock
+from src.session import MemorySessionStore
+from src.specroutines import write_specs
+
+
+def format_journal_path(pdir: str, ev: str) -> str:
+    return f"{pdir}/{ev}/.specmod.journal"
+
+
+def seed_record(sid: str, sta: str, decision: dict,
+                state: Optional[dict] = None) -> dict:
+    """
+    Makes the record of a decision read from file (see
+    MemorySessionStore.seed). Only found in journals written before set
+    records carried the decision read from file.
+    """
+    return {"op": "seed", "sid": sid, "sta": sta, "decision": decision,
+            "state": state}
+
+
+def set_record(sid: str, sta: str, decision: dict,
+               saved: Optional[dict] = None,
+               state: Optional[dict] = None) -> dict:
+    """
+    Makes the record of a staged decision (see MemorySessionStore.set),
+    with the station's saved decision and state on file (see
+    MemorySessionStore.entry) that a session which lost the station is
+    seeded with.
+    """
+    return {"op": "set", "sid": sid, "sta": sta, "decision": decision,
+            "saved": saved, "state": state}
+
+
+def apply_records(store, ev: str, records: Iterable[dict]) -> int:
+    """
+    Applies the records of an event's journal to a session store in order.
+
+    Args:
+        store (MemorySessionStore or SQLiteSessionStore): The store.
+        ev (str): The event name.
+        records (Iterable): The records.
+
+    Returns:
+        n (int): The number of records applied.
+    """
+    n = 0
+    for r in records:
+        if r.get("op") == "seed":
+            store.seed(r["sid"], ev, r["sta"], r["decision"], r.get("state"))
+        elif r.get("op") == "set":
+            if (r.get("saved") is not None
+                    and store.get(r["sid"], ev, r["sta"]) is None):
+                store.seed(r["sid"], ev, r["sta"], r["saved"], r.get("state"))
+            store.set(r["sid"], ev, r["sta"], r["decision"])
+        else:
+            continue
+        n += 1
+    return n
+
+
+class ReviewJournal:
+    """
+    The review journals of the events in a parent directory. Records are
+    appended with a single write to a file opened in append mode, so an
+    append costs the same however long the journal is, and a record torn
+    by a crash is skipped when the journal is read back.
+
+    Args:
+        pdir (str): The parent directory of the events.
+        fsync (bool): Flush every append to disk, so the journal also
+            survives a power cut rather than only a crash of the app.
+            Default is False.
+        lock_timeout (float): The seconds to wait for the journal lock.
+    """
+
+    def __init__(self, pdir: str, fsync: bool = False,
+                 lock_timeout: float = 5.0):
+        self.pdir = pdir
+        self.fsync = fsync
+        self.lock_timeout = lock_timeout
+
+    def _lock(self, ev: str):
+        # a lock of its own, so appends do not wait for the event's save
+        return file_lock(format_journal_path(self.pdir, ev) + ".lock",
+                         self.lock_timeout)
+
+    def append(self, ev: str, records: Iterable[dict]) -> None:
+        """
+        Appends records to the journal of an event.
+
+        Args:
+            ev (str): The event name.
+            records (Iterable): The records (see set_record).
+        """
+        lines = "".join(json.dumps(r) + "\n" for r in records)
+        if not lines:
+            return
+        with self._lock(ev):
+            fd = os.open(format_journal_path(self.pdir, ev),
+                         os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                # a record torn by a crash must not swallow the next one
+                size = os.lseek(fd, 0, os.SEEK_END)
+                if size:
+                    os.lseek(fd, size - 1, os.SEEK_SET)
+                    if os.read(fd, 1) != b"\n":
+                        lines = "\n" + lines
+                os.write(fd, lines.encode())
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def set(self, sid: str, ev: str, sta: str, decision: dict,
+            saved: Optional[dict] = None,
+            state: Optional[dict] = None) -> None:
+        self.append(ev, [set_record(sid, sta, decision, saved, state)])
+
+    def read(self, ev: str) -> List[dict]:
+        """
+        Reads the records of an event's journal in the order they were
+        appended. Lines that cannot be parsed (e.g., the last line of a
+        journal cut short by a crash) are skipped.
+
+        Args:
+            ev (str): The event name.
+
+        Returns:
+            records (list): The records, empty if there is no journal.
+        """
+        try:
+            with open(format_journal_path(self.pdir, ev)) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
+
+    def events(self) -> List[str]:
+        """
+        Returns:
+            evs (list): The events that have a journal, sorted.
+        """
+        paths = glob.glob(format_journal_path(glob.escape(self.pdir), "*"))
+        return sorted(os.path.basename(os.path.dirname(p)) for p in paths)
+
+    def replay(self, store, evs: Optional[Iterable[str]] = None) -> int:
+        """
+        Replays journals into a session store, e.g., after a restart.
+        Replaying a journal the store is already up to date with changes
+        nothing.
+
+        Args:
+            store (MemorySessionStore or SQLiteSessionStore): The store.
+            evs (Iterable): The events to replay. Default is None (every
+                event with a journal).
+
+        Returns:
+            n (int): The number of records replayed.
+        """
+        return sum(apply_records(store, ev, self.read(ev))
+                   for ev in (self.events() if evs is None else evs))
+
+    def compact(self, ev: str, sids: Iterable[str],
+                upto: Optional[int] = None) -> None:
+        """
+        Drops the records of sessions from an event's journal, once their
+        decisions are written to the spectra file, so the journal only
+        holds unsaved work. The journal is removed once it is empty.
+
+        Args:
+            ev (str): The event name.
+            sids (Iterable): The ids of the saved sessions.
+            upto (int): Only the session records among the first upto
+                records are dropped, so decisions staged while saving are
+                kept. Default is None (all of them).
+        """
+        sids = set(sids)
+        path = format_journal_path(self.pdir, ev)
+        if not os.path.exists(path):
+            return
+        with self._lock(ev):
+            records = self.read(ev)
+            upto = len(records) if upto is None else upto
+            records = [r for i, r in enumerate(records)
+                       if i >= upto or r.get("sid") not in sids]
+            if not records:
+                if os.path.exists(path):
+                    os.remove(path)
+                return
+            tmp = f"{path}.tmp"
+            with open(tmp, "w") as f:
+                f.writelines(json.dumps(r) + "\n" for r in records)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp, path)
+
+
+def fold_journal(journal: ReviewJournal, ev: str,
+                 backend: str = "pickle") -> dict:
+    """
+    Writes the unsaved decisions in an event's journal to the spectra file
+    (through write_specs, with conflict detection) and compacts the
+    journal, e.g., for sessions whose reviewer never came back to save.
+    The sessions are written one after another in the order they first
+    appear in the journal.
+
+    Args:
+        journal (ReviewJournal): The journals.
+        ev (str): The event name.
+        backend (str): The storage backend, "pickle" or "columnar".
+
+    Returns:
+        reports (dict): The write_specs report of the event for each
+            session with unsaved decisions.
+    """
+    store = MemorySessionStore()
+    records = journal.read(ev)
+    apply_records(store, ev, records)
+
+    reports, saved = {}, []
+    for sid in dict.fromkeys(r["sid"] for r in records):
+        data = store.dirty(sid)
+        if data:
+            reports[sid] = write_specs(journal.pdir, data, backend=backend,
+                                       bases=store.bases(sid))[ev]
+            if reports[sid]["error"] is not None:
+                continue
+        saved.append(sid)
+
+    journal.compact(ev, saved, len(records))
+
+    return reports
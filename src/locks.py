@@ -0,0 +1,80 @@
+"""
+locks.py
+
+    The file with the advisory file locks that stop two app workers (or a
+    worker and a command line tool) writing the same event at once.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class LockTimeout(TimeoutError):
+    """
+    Raised when a lock could not be acquired in time.
+    """
+
+
+def format_lock_path(pdir: str, ev: str) -> str:
+    return f"{pdir}/{ev}/.specmod.lock"
+
+
+@contextmanager
+def file_lock(path: str, timeout: float = 30.0,
+              poll: float = 0.05) -> Iterator[None]:
+    """
+    Holds an exclusive advisory lock (flock) on a lock file. The lock is
+    held per open file, so it also excludes other threads of the same
+    process. Where flock is not available this does nothing.
+
+    Args:
+        path (str): The lock file, created if missing.
+        timeout (float): The seconds to wait for the lock. Default is 30.
+        poll (float): The seconds between attempts. Default is 0.05.
+
+    Raises:
+        LockTimeout: If the lock is still held by someone else after the
+            timeout.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise LockTimeout(f"{path} is locked")
+                time.sleep(poll)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def event_lock(pdir: str, ev: str, timeout: float = 30.0):
+    """
+    Locks an event for writing, whatever its storage backend.
+
+    Args:
+        pdir (str): The parent directory of the events.
+        ev (str): The event name.
+        timeout (float): The seconds to wait for the lock. Default is 30.
+
+    Returns:
+        A context manager holding the lock.
+    """
+    return file_lock(format_lock_path(pdir, ev), timeout)
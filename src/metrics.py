@@ -0,0 +1,295 @@
+"""
+metrics.py
+
+    The file with the instrumentation of the Dash callbacks. Each callback
+    records its wall time, the time spent in spectra I/O and in building
+    figures, and its request/response JSON sizes. The metrics are rendered
+    in the Prometheus text format and can be logged as JSON lines.
+"""
+import json
+import time
+import bisect
+import logging
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import flask
+from dash.exceptions import PreventUpdate
+
+logger = logging.getLogger("specmod.metrics")
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+BYTES = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    """
+    A Prometheus style histogram (cumulative buckets, sum and count) that
+    also keeps the most recent observations for rolling quantiles.
+
+    Args:
+        buckets (Sequence): The upper bounds of the buckets.
+        window (int): The number of recent observations kept.
+    """
+
+    def __init__(self, buckets: Sequence[float], window: int = 1000):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns:
+            value (float): The q quantile of the recent observations.
+        """
+        if not self.recent:
+            return float("nan")
+        data = sorted(self.recent)
+        return data[min(int(q * len(data)), len(data) - 1)]
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...], **extra) -> str:
+    items = list(labels) + list(extra.items())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Metrics:
+    """
+    Collects the callback metrics.
+
+    Args:
+        window (int): The number of recent observations per histogram used
+            for the rolling quantiles. Default is 1000.
+        log (bool): Log a JSON line with the timings of every callback to
+            the "specmod.metrics" logger. Default is False.
+    """
+
+    def __init__(self, window: int = 1000, log: bool = False):
+        self.window = window
+        self.log = log
+        self._hists: Dict[Tuple[str, tuple], Histogram] = {}
+        self._totals = defaultdict(int)
+        self._gauges: Dict[str, Callable[[], dict]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # recording -------------------------------------------------------------
+
+    def observe(self, name: str, value: float, buckets: Sequence[float],
+                **labels) -> None:
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            if key not in self._hists:
+                self._hists[key] = Histogram(buckets, self.window)
+            self._hists[key].observe(value)
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Adds the time spent in the block to the named phase (e.g., "io" or
+        "figure") of the callback running in this thread, if any.
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            phases = getattr(self._local, "phases", None)
+            if phases is not None:
+                phases[name] += time.perf_counter() - t0
+
+    def timed(self, phase: str, func: Callable) -> Callable:
+        """
+        Wraps func so that its run time is added to a phase.
+
+        Args:
+            phase (str): The phase name.
+            func (Callable): The function to wrap.
+
+        Returns:
+            The wrapped function.
+        """
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.phase(phase):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def wrap_callback(self, func: Callable, name: Optional[str] = None
+                      ) -> Callable:
+        """
+        Wraps a Dash callback (as stored in app.callback_map) so every call
+        records its wall time, phase times and request/response sizes.
+
+        Args:
+            func (Callable): The callback.
+            name (str): The callback label. Default is the function name.
+
+        Returns:
+            The wrapped callback.
+        """
+        name = name or getattr(func, "__name__", "callback")
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            outer = getattr(self._local, "phases", None)
+            self._local.phases = defaultdict(float)
+            t0 = time.perf_counter()
+            status, out = "ok", None
+            try:
+                out = func(*args, **kwargs)
+                return out
+            except PreventUpdate:
+                status = "prevented"
+                raise
+            except Exception:
+                status = "error"
+                raise
+            finally:
+                wall = time.perf_counter() - t0
+                phases = self._local.phases
+                self._local.phases = outer
+                req = (flask.request.content_length
+                       if flask.has_request_context() else None)
+                resp = len(out) if isinstance(out, (str, bytes)) else None
+                self.record(name, wall, phases, req, resp, status)
+
+        return wrapper
+
+    def record(self, name: str, wall: float, phases: dict,
+               request_bytes: Optional[int], response_bytes: Optional[int],
+               status: str) -> None:
+        """
+        Records one callback call.
+        """
+        self.observe("specmod_callback_seconds", wall, SECONDS, callback=name)
+        for phase, secs in phases.items():
+            self.observe("specmod_callback_phase_seconds", secs, SECONDS,
+                         callback=name, phase=phase)
+        if request_bytes is not None:
+            self.observe("specmod_callback_request_bytes", request_bytes,
+                         BYTES, callback=name)
+        if response_bytes is not None:
+            self.observe("specmod_callback_response_bytes", response_bytes,
+                         BYTES, callback=name)
+        with self._lock:
+            self._totals[(name, status)] += 1
+
+        if self.log:
+            logger.info(json.dumps({
+                "callback": name,
+                "status": status,
+                "seconds": round(wall, 6),
+                **{f"{k} seconds": round(v, 6) for k, v in phases.items()},
+                "request bytes": request_bytes,
+                "response bytes": response_bytes,
+                }))
+
+    def add_gauges(self, name: str, stats: Callable[[], dict]) -> None:
+        """
+        Exports the numeric values of stats() as gauges named
+        specmod_{name}_{key} (e.g., the stats of a cache).
+
+        Args:
+            name (str): The gauge prefix.
+            stats (Callable): Returns a dict of values.
+        """
+        self._gauges[name] = stats
+
+    # rendering -------------------------------------------------------------
+
+    def render(self) -> str:
+        """
+        Returns:
+            text (str): The metrics in the Prometheus text format.
+        """
+        lines = []
+        with self._lock:
+            hists = sorted(self._hists.items(), key=lambda kv: kv[0])
+            totals = sorted(self._totals.items())
+
+            seen = set()
+            for (name, labels), h in hists:
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                cum = 0
+                for le, n in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    cum += n
+                    lines.append(f"{name}_bucket{_labels(labels, le=le)} {cum}")
+                lines.append(f"{name}_sum{_labels(labels)} {h.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {h.count}")
+
+            seen = set()
+            for (name, labels), h in hists:
+                rolling = f"{name}_recent"
+                if rolling not in seen:
+                    seen.add(rolling)
+                    lines.append(f"# TYPE {rolling} summary")
+                for q in QUANTILES:
+                    lines.append(
+                        f"{rolling}{_labels(labels, quantile=q)} {h.quantile(q)}")
+
+        lines.append("# TYPE specmod_callback_total counter")
+        for (name, status), n in totals:
+            lines.append(
+                f'specmod_callback_total{{callback="{name}",status="{status}"}} {n}')
+
+        for prefix, stats in self._gauges.items():
+            for key, value in stats().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metric = f"specmod_{prefix}_{key}".replace(" ", "_")
+                    lines.append(f"# TYPE {metric} gauge")
+                    lines.append(f"{metric} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def instrument(app, metrics: Metrics) -> None:
+    """
+    Wraps every server-side callback registered on a Dash app. Call it
+    after all the callbacks have been registered.
+
+    Args:
+        app (dash.Dash): The app.
+        metrics (Metrics): The metrics to record to.
+    """
+    for entry in app.callback_map.values():
+        if "callback" in entry:
+            func = entry["callback"]
+            name = getattr(getattr(func, "__wrapped__", func), "__name__", None)
+            entry["callback"] = metrics.wrap_callback(func, name)
+
+
+def add_metrics_route(app, metrics: Metrics, path: str = "/metrics",
+                      allow_remote: bool = False) -> None:
+    """
+    Serves the metrics in the Prometheus text format on the app's server.
+
+    Args:
+        app (dash.Dash): The app.
+        metrics (Metrics): The metrics to serve.
+        path (str): The route. Default is "/metrics".
+        allow_remote (bool): Serve requests from other hosts too. Default
+            is False (loopback only).
+    """
+    def serve_metrics():
+        if not allow_remote and flask.request.remote_addr not in (
+                "127.0.0.1", "::1"):
+            flask.abort(403)
+        return flask.Response(metrics.render(),
+                              mimetype="text/plain; version=0.0.4")
+
+    app.server.add_url_rule(path, "metrics", serve_metrics)
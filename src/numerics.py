@@ -0,0 +1,373 @@
+"""
+numerics.py
+
+    The file with vectorised NumPy routines applied to spectral arrays
+    before they are displayed.
+"""
+import numpy as np
+from typing import Optional, Tuple
+
+from src.cache import smoothing_cache, content_key
+
+# the log-frequency smoothing windows of smoothing_matrix
+SMOOTHING = ("konno-ohmachi", "log-boxcar")
+
+
+def decimate_log(freq: np.ndarray,
+                 amp: np.ndarray,
+                 n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decimates a spectrum onto log-spaced frequency bins for display. The
+    minimum and maximum amplitude of every bin are kept (in frequency
+    order) so peaks and troughs survive. Non-positive frequencies, which
+    cannot be drawn on a log axis, are dropped.
+
+    Args:
+        freq (np.ndarray): The frequencies of the spectrum (ascending).
+        amp (np.ndarray): The amplitudes of the spectrum.
+        n (int): The target number of points.
+
+    Returns:
+        freq, amp (np.ndarray, np.ndarray): The decimated spectrum, or the
+            input spectrum if it already has no more than n points.
+    """
+    freq, amp = np.asarray(freq), np.asarray(amp)
+
+    if n is None or freq.size <= n:
+        return freq, amp
+
+    pos = freq > 0
+    freq, amp = freq[pos], amp[pos]
+
+    nbins = max(n // 2, 1)
+    edges = np.geomspace(freq[0], freq[-1], nbins + 1)
+    # the bin of each sample, bins are contiguous as freq is sorted
+    idx = np.clip(np.searchsorted(edges, freq, side='right') - 1, 0, nbins - 1)
+
+    starts = np.flatnonzero(np.diff(idx, prepend=-1))
+    ends = np.append(starts[1:], idx.size)
+    # sort by amplitude within each bin: the first is the min, the last the max
+    order = np.lexsort((amp, idx))
+
+    keep = np.unique(np.concatenate(
+        [order[starts], order[ends - 1], [0, idx.size - 1]]))
+
+    return freq[keep], amp[keep]
+
+
+def decimate_log_rows(freq: np.ndarray,
+                      amps: np.ndarray,
+                      n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decimates many spectra on the same frequencies at once, the way
+    decimate_log does for one. Every row keeps the minimum and maximum
+    amplitude of each log-spaced bin (in frequency order) and its end
+    points, so all rows decimate to the same number of points.
+
+    Args:
+        freq (np.ndarray): The frequencies shared by the spectra (ascending).
+        amps (np.ndarray): The amplitudes, one spectrum per row.
+        n (int): The target number of points.
+
+    Returns:
+        freqs, amps (np.ndarray, np.ndarray): The decimated spectra, one per
+            row, or the input spectra if they have no more than n points.
+    """
+    freq, amps = np.asarray(freq), np.atleast_2d(amps)
+
+    if n is None or freq.size <= n:
+        return np.broadcast_to(freq, amps.shape), amps
+
+    pos = freq > 0
+    freq, amps = freq[pos], amps[:, pos]
+
+    nbins = max(n // 2, 1)
+    edges = np.geomspace(freq[0], freq[-1], nbins + 1)
+    idx = np.clip(np.searchsorted(edges, freq, side='right') - 1, 0, nbins - 1)
+
+    starts = np.flatnonzero(np.diff(idx, prepend=-1))
+    counts = np.diff(np.append(starts, idx.size))
+    cols = np.broadcast_to(np.arange(idx.size), amps.shape)
+
+    def first_index_of(ext):
+        # the first column of each bin where the row reaches ext
+        hit = amps == np.repeat(ext, counts, axis=1)
+        return np.minimum.reduceat(
+            np.where(hit, cols, idx.size), starts, axis=1)
+
+    imin = first_index_of(np.minimum.reduceat(amps, starts, axis=1))
+    imax = first_index_of(np.maximum.reduceat(amps, starts, axis=1))
+
+    keep = np.empty((amps.shape[0], 2 * starts.size + 2), dtype=np.intp)
+    keep[:, 0], keep[:, -1] = 0, idx.size - 1
+    keep[:, 1:-1:2] = np.minimum(imin, imax)
+    keep[:, 2:-1:2] = np.maximum(imin, imax)
+
+    return freq[keep], np.take_along_axis(amps, keep, axis=1)
+
+
+def group_by_freq(freqs: list) -> list:
+    """
+    Groups spectra that share the same frequencies, so each group can be
+    stacked into one 2D array.
+
+    Args:
+        freqs (list): The frequencies of each spectrum.
+
+    Returns:
+        groups (list): Lists of indices into freqs, one per distinct set of
+            frequencies, in order of first appearance.
+    """
+    groups = {}
+    for i, freq in enumerate(freqs):
+        freq = np.asarray(freq)
+        key = (freq.size, freq[0], freq[freq.size // 2], freq[-1]
+               ) if freq.size else (0,)
+        groups.setdefault(key, []).append(i)
+
+    out = []
+    for rows in groups.values():
+        # the key is only a cheap fingerprint, so check the group
+        first = np.asarray(freqs[rows[0]])
+        same = [i for i in rows if np.array_equal(freqs[i], first)]
+        out.append(same)
+        out.extend([i] for i in rows if i not in set(same))
+    return out
+
+
+def decimate_log_many(spectra: list, n: int) -> list:
+    """
+    Decimates a list of spectra, stacking those that share frequencies
+    (as the stations of an event usually do) to decimate them together
+    with decimate_log_rows.
+
+    Args:
+        spectra (list): The spectra as (freq, amp) pairs.
+        n (int): The target number of points.
+
+    Returns:
+        spectra (list): The decimated (freq, amp) pairs, in input order.
+    """
+    out = [None] * len(spectra)
+    for rows in group_by_freq([f for f, _ in spectra]):
+        fs, amps = decimate_log_rows(
+            spectra[rows[0]][0], np.vstack([spectra[i][1] for i in rows]), n)
+        for j, i in enumerate(rows):
+            out[i] = (fs[j], amps[j])
+
+    return out
+
+
+def log_bin_rows(freq: np.ndarray, amps: np.ndarray,
+                 edges: np.ndarray) -> np.ndarray:
+    """
+    Resamples spectra on the same frequencies onto log-spaced bins, as the
+    mean log10 amplitude of the samples in each bin. Bins with no samples
+    (at low frequency, where the linear sampling is sparse) are linearly
+    interpolated in log-log space, and bins outside the spectra are NaN.
+
+    Args:
+        freq (np.ndarray): The frequencies shared by the spectra (ascending).
+        amps (np.ndarray): The amplitudes, one spectrum per row.
+        edges (np.ndarray): The bin edges (ascending).
+
+    Returns:
+        logamp (np.ndarray): The log10 amplitudes, one row per spectrum and
+            one column per bin.
+    """
+    freq, amps = np.asarray(freq, dtype=float), np.atleast_2d(amps)
+    nbins = edges.size - 1
+
+    pos = (freq > 0) & np.all(amps > 0, axis=0)
+    freq = freq[pos]
+    with np.errstate(divide="ignore"):
+        logamp = np.log10(amps[:, pos])
+
+    out = np.full((amps.shape[0], nbins), np.nan)
+    if freq.size == 0:
+        return out
+
+    idx = np.searchsorted(edges, freq, side="right") - 1
+    inside = (idx >= 0) & (idx < nbins)
+    idx, la = idx[inside], logamp[:, inside]
+
+    if idx.size:
+        starts = np.flatnonzero(np.diff(idx, prepend=-1))
+        counts = np.diff(np.append(starts, idx.size))
+        out[:, idx[starts]] = np.add.reduceat(la, starts, axis=1) / counts
+
+    # empty bins within the spectra are interpolated at their centres
+    centres = np.log10(np.sqrt(edges[:-1] * edges[1:]))
+    logf = np.log10(freq)
+    empty = np.isnan(out[0]) & (centres >= logf[0]) & (centres <= logf[-1])
+    if np.any(empty) and logf.size > 1:
+        j = np.clip(np.searchsorted(logf, centres[empty]), 1, logf.size - 1)
+        w = (centres[empty] - logf[j - 1]) / (logf[j] - logf[j - 1])
+        out[:, empty] = logamp[:, j - 1] * (1 - w) + logamp[:, j] * w
+
+    return out
+
+
+def widest_runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the widest run of True values in each row of a boolean array
+    (the first one if there is a tie).
+
+    Args:
+        mask (np.ndarray): A 2D boolean array.
+
+    Returns:
+        start, stop (np.ndarray, np.ndarray): The column of the first value
+            of each row's widest run and the column after its last, both
+            -1 for rows with no True value.
+    """
+    mask = np.atleast_2d(mask)
+    nrows = mask.shape[0]
+
+    edges = np.diff(np.pad(mask.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+    # row-major order pairs every run start with its stop
+    rows, starts = np.nonzero(edges == 1)
+    _, stops = np.nonzero(edges == -1)
+
+    start, stop = np.full(nrows, -1), np.full(nrows, -1)
+    if rows.size:
+        # the widest run of a row sorts first among its runs
+        order = np.lexsort((starts, -(stops - starts), rows))
+        first = order[np.unique(rows[order], return_index=True)[1]]
+        start[rows[first]], stop[rows[first]] = starts[first], stops[first]
+
+    return start, stop
+
+
+def suggest_bands(edges: np.ndarray, signal: np.ndarray, noise: np.ndarray,
+                  threshold: float = 3.0, min_decades: float = 0.3
+                  ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Suggests the pass flag and usable bandwidth of many stations at once
+    from their log-binned signal and noise (see log_bin_rows). The usable
+    bandwidth is the widest contiguous band where the signal to noise
+    ratio is at least the threshold.
+
+    Args:
+        edges (np.ndarray): The bin edges (Hz).
+        signal, noise (np.ndarray): The log10 amplitudes of the signal and
+            noise, one row per station and one column per bin.
+        threshold (float): The minimum signal to noise ratio. Default is 3.
+        min_decades (float): The narrowest band (in decades of frequency)
+            for a station to pass. Default is 0.3.
+
+    Returns:
+        passed (np.ndarray): True for the stations that can be modeled.
+        lo, hi (np.ndarray, np.ndarray): The log10 limits of the band (Hz),
+            NaN where there is no band.
+    """
+    with np.errstate(invalid="ignore"):
+        above = (signal - noise) >= np.log10(threshold)
+
+    start, stop = widest_runs(above)
+    found = start >= 0
+
+    logedges = np.log10(edges)
+    lo = np.where(found, logedges[np.maximum(start, 0)], np.nan)
+    hi = np.where(found, logedges[np.maximum(stop, 0)], np.nan)
+
+    with np.errstate(invalid="ignore"):
+        passed = found & ((hi - lo) >= min_decades)
+
+    return passed, lo, hi
+
+
+def smoothing_matrix(freq: np.ndarray, method: str = "konno-ohmachi",
+                     b: float = 40.0, decades: float = 0.1):
+    """
+    Builds the sparse matrix that smooths spectra on the given frequencies
+    on log frequency, one row of normalised window weights per frequency.
+    The Konno-Ohmachi window, (sin(b log10(f/fc)) / (b log10(f/fc)))**4,
+    is cut at its first zeros (|log10(f/fc)| = pi/b), beyond which its
+    side lobes are below 0.3 % of the peak. The log boxcar weighs every
+    frequency within decades / 2 of fc equally. Windows are cut at the
+    ends of the spectrum and non-positive frequencies are left as they
+    are.
+
+    The matrices are cached per frequency grid and window, so smoothing a
+    spectrum costs one sparse matrix-vector product.
+
+    Args:
+        freq (np.ndarray): The frequencies (ascending).
+        method (str): "konno-ohmachi" or "log-boxcar". Default is
+            "konno-ohmachi".
+        b (float): The Konno-Ohmachi bandwidth coefficient, larger is
+            narrower. Default is 40.
+        decades (float): The width of the log boxcar. Default is 0.1.
+
+    Returns:
+        weights (scipy.sparse.csr_matrix): The (n, n) smoothing matrix.
+    """
+    if method not in SMOOTHING:
+        raise ValueError(f"method must be one of {SMOOTHING}, not {method}")
+
+    freq = np.ascontiguousarray(freq, dtype=float)
+    width = np.pi / b if method == "konno-ohmachi" else decades / 2
+    key = content_key(method, width, freq.tobytes())
+    weights = smoothing_cache.get(key)
+    if weights is not None:
+        return weights
+
+    # imported here, as only the smoothing needs scipy
+    from scipy import sparse
+
+    n = freq.size
+    pos = freq > 0
+    start = np.arange(n)
+    stop = start + 1
+    start[pos] = np.searchsorted(freq, freq[pos] * 10**-width, side="left")
+    stop[pos] = np.searchsorted(freq, freq[pos] * 10**width, side="right")
+
+    # the (row, column) of every weight, row by row
+    counts = stop - start
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    rows = np.repeat(np.arange(n), counts)
+    cols = np.arange(indptr[-1]) - np.repeat(indptr[:-1] - start, counts)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = np.log10(freq[cols] / freq[rows])
+        if method == "konno-ohmachi":
+            w = np.where(x == 0, 1.0, np.sin(b * x) / (b * x)) ** 4
+        else:
+            w = np.ones_like(x)
+    w[~pos[rows]] = 1.0
+    w /= np.repeat(np.add.reduceat(w, indptr[:-1]), counts)
+
+    weights = sparse.csr_matrix((w, cols, indptr), shape=(n, n))
+    smoothing_cache.put(key, weights, nbytes=w.nbytes + cols.nbytes
+                        + indptr.nbytes)
+    return weights
+
+
+def smooth_rows(freq: np.ndarray, amps: np.ndarray,
+                method: Optional[str] = "konno-ohmachi", b: float = 40.0,
+                decades: float = 0.1) -> np.ndarray:
+    """
+    Smooths spectra on the same frequencies on log frequency (see
+    smoothing_matrix), all rows with one sparse matrix product.
+
+    Args:
+        freq (np.ndarray): The frequencies shared by the spectra
+            (ascending).
+        amps (np.ndarray): The amplitudes, one spectrum or one spectrum
+            per row.
+        method (str): "konno-ohmachi", "log-boxcar" or None (no
+            smoothing). Default is "konno-ohmachi".
+        b (float): The Konno-Ohmachi bandwidth coefficient. Default is 40.
+        decades (float): The width of the log boxcar. Default is 0.1.
+
+    Returns:
+        amps (np.ndarray): The smoothed amplitudes, shaped as given (the
+            amplitudes as given if method is None).
+    """
+    if method is None:
+        return amps
+    amps = np.asarray(amps, dtype=float)
+    weights = smoothing_matrix(freq, method, b, decades)
+    # the product with the transposed rows smooths every row at once
+    return (weights @ amps.T).T
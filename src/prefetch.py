@@ -0,0 +1,135 @@
+"""
+prefetch.py
+
+    The file with the background prefetch scheduler used to warm the data
+    and figures of the stations a reviewer is likely to look at next.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+from src.cache import LRUCache
+
+logger = logging.getLogger("specmod")
+
+# a prefetch task returns the (key, value, nbytes) entries it built
+Task = Callable[[], Iterable[Tuple[Hashable, Any, int]]]
+
+
+class Prefetcher:
+    """
+    Runs prefetch tasks on a thread pool and keeps what they build in a
+    bounded LRU cache. Every call to schedule replaces the wanted set of
+    tasks: queued tasks that are no longer wanted are cancelled, so jumping
+    elsewhere does not leave the pool busy with stale work.
+
+    Tasks that build into another cache can store a small marker instead
+    of what they built, with an alive check that tells whether it is still
+    there; markers that fail the check are dropped, no longer count as
+    hits, and let their task be scheduled again.
+
+    Args:
+        max_bytes (int): The memory budget of the prefetched entries.
+        max_workers (int): The number of prefetch threads.
+        alive (Callable): Checks whether a cached value is still valid.
+            Default is None (always).
+    """
+
+    def __init__(self, max_bytes: int = 64 * 2**20, max_workers: int = 2,
+                 alive: Optional[Callable[[Any], bool]] = None):
+        self.cache = LRUCache(max_bytes)
+        self.alive = alive
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="prefetch")
+        self._pending: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0
+        self.scheduled = 0
+        self.cancelled = 0
+        self.failed = 0
+
+    def schedule(self, tasks: Dict[Hashable, Task]) -> None:
+        """
+        Replaces the wanted prefetch tasks.
+
+        Args:
+            tasks (dict): The tasks as {task id: task}. Tasks that are
+                running, or whose id is the key of a cached entry, are not
+                resubmitted (so a task should store an entry under its id).
+        """
+        if self.alive is not None:
+            self.cache.prune(lambda key, value: self.alive(value))
+
+        with self._lock:
+            for tid, fut in list(self._pending.items()):
+                if tid not in tasks and fut.cancel():
+                    self.cancelled += 1
+                if fut.done():
+                    del self._pending[tid]
+
+            for tid, task in tasks.items():
+                if tid in self._pending or tid in self.cache:
+                    continue
+                self._pending[tid] = self._pool.submit(self._run, task)
+                self.scheduled += 1
+
+    def _run(self, task: Task) -> None:
+        try:
+            for key, value, nbytes in task():
+                self.cache.put(key, value, nbytes=nbytes)
+        except Exception:
+            # the reviewer only waits longer, but a broken loader is logged
+            logger.exception("prefetch task failed")
+            with self._lock:
+                self.failed += 1
+
+    def get(self, key: Hashable, tid: Optional[Hashable] = None) -> Any:
+        """
+        Gets a prefetched entry. If the task that builds it is running,
+        this waits for it rather than building the entry a second time.
+
+        Args:
+            key (Hashable): The key of the entry.
+            tid (Hashable): The id of the task that builds the entry.
+                Default is None (do not wait).
+
+        Returns:
+            The prefetched value or None.
+        """
+        with self._lock:
+            self.requests += 1
+            fut = self._pending.get(tid) if tid is not None else None
+
+        if fut is not None and fut.running():
+            fut.result()
+
+        value = self.cache.get(key)
+        if value is not None and self.alive is not None and not self.alive(
+                value):
+            self.cache.invalidate(key)
+            value = None
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+        return value
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            stats (dict): The prefetch hit rate and task counters.
+        """
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hits": self.hits,
+                "hit rate": self.hits / self.requests if self.requests else 0.0,
+                "scheduled": self.scheduled,
+                "cancelled": self.cancelled,
+                "failed": self.failed,
+                "pending": sum(not f.done() for f in self._pending.values()),
+                "entries": len(self.cache),
+                "bytes": self.cache.stats()["bytes"],
+                "max bytes": self.cache.max_bytes,
+            }
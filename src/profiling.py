@@ -0,0 +1,318 @@
+"""
+profiling.py
+
+    The file with the opt-in profiling of the Dash callbacks (and of the
+    background saves). Chosen callbacks, or the slowest share of the calls,
+    are profiled with cProfile (.prof files, for pstats or snakeviz) or with
+    a sampling profiler (collapsed stacks, for flamegraph.pl or speedscope).
+    The profiles are written to a local directory, which is capped in size
+    by removing the oldest profiles, and listed on a small index page.
+"""
+import os
+import sys
+import html
+import time
+import pstats
+import cProfile
+import threading
+from io import StringIO
+from collections import Counter, defaultdict, deque
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Optional
+
+import flask
+
+MODES = ("cprofile", "sample")
+EXTENSIONS = {"cprofile": ".prof", "sample": ".collapsed"}
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the call stack of another thread every interval seconds and
+    counts the stacks in the collapsed format ("outer;...;inner count").
+
+    Args:
+        target (int): The identifier of the thread to sample.
+        interval (float): The seconds between samples. Default is 0.005.
+    """
+
+    def __init__(self, target: int, interval: float = 0.005):
+        super().__init__(daemon=True, name="profile-sampler")
+        self.target = target
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} "
+                             f"({os.path.basename(code.co_filename)}:"
+                             f"{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> Counter:
+        self._done.set()
+        self.join()
+        return self.stacks
+
+
+class Profiler:
+    """
+    Profiles the calls of chosen functions and keeps the profiles of the
+    calls that are chosen or among the slowest.
+
+    The slowest calls can only be told apart once they have finished, so
+    with slowest set every call is profiled and only those slower than the
+    (100 - slowest) percentile of the recent calls of the same function
+    are kept. The sampling profiler costs little enough for that; cProfile
+    slows every profiled call down.
+
+    cProfile profiles one call at a time, calls made while another is
+    being profiled run unprofiled.
+
+    Args:
+        directory (str): Where the profiles are written.
+        callbacks (Iterable): The names of the functions whose every call
+            is profiled. Default is () (none).
+        slowest (float): Also keep the profiles of the slowest percent of
+            the calls. Default is None (off).
+        mode (str): "sample" (collapsed stacks) or "cprofile" (.prof
+            files). Default is "sample".
+        interval (float): The seconds between stack samples. Default is
+            0.005.
+        max_mb (float): The size of the directory above which the oldest
+            profiles are removed. Default is 100.
+        window (int): The number of recent calls per function used for the
+            slowest percentile. Default is 200.
+        min_calls (int): The number of calls of a function seen before its
+            slowest calls are kept. Default is 20.
+    """
+
+    def __init__(self, directory: str, callbacks: Iterable[str] = (),
+                 slowest: Optional[float] = None, mode: str = "sample",
+                 interval: float = 0.005, max_mb: float = 100,
+                 window: int = 200, min_calls: int = 20):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, not {mode}")
+        self.directory = directory
+        self.callbacks = set(callbacks)
+        self.slowest = slowest
+        self.mode = mode
+        self.interval = interval
+        self.max_bytes = max_mb * 2**20
+        self.min_calls = min_calls
+        self._recent: Dict[str, deque] = defaultdict(
+            lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+        self._cprofile = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def selects(self, name: str) -> bool:
+        """
+        Returns:
+            tf (bool): True if calls of the named function are profiled.
+        """
+        return name in self.callbacks or self.slowest is not None
+
+    def _is_slow(self, name: str, wall: float) -> bool:
+        with self._lock:
+            recent = self._recent[name]
+            slow = False
+            if len(recent) >= self.min_calls:
+                data = sorted(recent)
+                i = int((1 - self.slowest / 100) * len(data))
+                slow = wall >= data[min(i, len(data) - 1)]
+            recent.append(wall)
+        return slow
+
+    def wrap(self, func: Callable, name: Optional[str] = None) -> Callable:
+        """
+        Wraps a function so its calls are profiled if chosen.
+
+        Args:
+            func (Callable): The function (e.g., a Dash callback).
+            name (str): The label of its profiles. Default is the function
+                name.
+
+        Returns:
+            The wrapped function, or func if its calls are not profiled.
+        """
+        name = name or getattr(func, "__name__", "callback")
+        if not self.selects(name):
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if self.mode == "cprofile":
+                if not self._cprofile.acquire(blocking=False):
+                    return func(*args, **kwargs)
+                profile = cProfile.Profile()
+            else:
+                profile = StackSampler(threading.get_ident(), self.interval)
+
+            t0 = time.perf_counter()
+            try:
+                if self.mode == "cprofile":
+                    profile.enable()
+                else:
+                    profile.start()
+                return func(*args, **kwargs)
+            finally:
+                if self.mode == "cprofile":
+                    profile.disable()
+                    self._cprofile.release()
+                else:
+                    profile.stop()
+                wall = time.perf_counter() - t0
+                keep = name in self.callbacks
+                if self.slowest is not None:
+                    keep = self._is_slow(name, wall) or keep
+                if keep:
+                    self.save(name, wall, profile)
+
+        return wrapper
+
+    def save(self, name: str, wall: float, profile) -> str:
+        """
+        Writes a profile and removes the oldest profiles beyond the size
+        cap.
+
+        Returns:
+            path (str): The profile file.
+        """
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S.%f")
+        path = os.path.join(
+            self.directory,
+            f"{stamp}-{name}-{wall * 1e3:.0f}ms{EXTENSIONS[self.mode]}")
+
+        if self.mode == "cprofile":
+            profile.dump_stats(path)
+        else:
+            with open(path, "w") as f:
+                f.writelines(f"{stack} {n}\n"
+                             for stack, n in profile.stacks.items())
+
+        self.rotate()
+        return path
+
+    def rotate(self) -> None:
+        """
+        Removes the oldest profiles until the directory is within its size
+        cap, always keeping the newest.
+        """
+        with self._lock:
+            profiles = list_profiles(self.directory)
+            total = sum(p["bytes"] for p in profiles)
+            for p in reversed(profiles[1:]):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, p["file"]))
+                except FileNotFoundError:
+                    pass
+                total -= p["bytes"]
+
+
+def list_profiles(directory: str) -> List[dict]:
+    """
+    Lists the profiles in a directory, newest first.
+
+    Args:
+        directory (str): The profile directory.
+
+    Returns:
+        profiles (list): The file, callback, milliseconds, size and
+            modification time of each profile.
+    """
+    profiles = []
+    for file in os.listdir(directory):
+        base, ext = os.path.splitext(file)
+        if ext not in EXTENSIONS.values():
+            continue
+        try:
+            stamp, rest = base.split("-", 1)
+            name, ms = rest.rsplit("-", 1)
+            st = os.stat(os.path.join(directory, file))
+        except (ValueError, FileNotFoundError):
+            continue
+        profiles.append({"file": file, "time": stamp, "callback": name,
+                         "ms": float(ms[:-2]), "bytes": st.st_size,
+                         "mtime": st.st_mtime})
+    return sorted(profiles, key=lambda p: p["file"], reverse=True)
+
+
+def profile_callbacks(app, profiler: Profiler) -> None:
+    """
+    Wraps the server-side callbacks of a Dash app chosen for profiling.
+    Call it after all the callbacks have been registered.
+
+    Args:
+        app (dash.Dash): The app.
+        profiler (Profiler): The profiler.
+    """
+    for entry in app.callback_map.values():
+        if "callback" in entry:
+            func = entry["callback"]
+            name = getattr(getattr(func, "__wrapped__", func), "__name__", None)
+            entry["callback"] = profiler.wrap(func, name)
+
+
+def add_profiles_route(app, profiler: Profiler, path: str = "/profiles",
+                       allow_remote: bool = False) -> None:
+    """
+    Serves the index of the captured profiles on the app's server, with
+    the profiles themselves (and the top functions of .prof files) below
+    it.
+
+    Args:
+        app (dash.Dash): The app.
+        profiler (Profiler): The profiler.
+        path (str): The route. Default is "/profiles".
+        allow_remote (bool): Serve requests from other hosts too. Default
+            is False (loopback only).
+    """
+    def check_remote():
+        if not allow_remote and flask.request.remote_addr not in (
+                "127.0.0.1", "::1"):
+            flask.abort(403)
+
+    def serve_index():
+        check_remote()
+        rows = "".join(
+            f"<tr><td>{p['time']}</td><td>{html.escape(p['callback'])}</td>"
+            f"<td>{p['ms']:.0f}</td><td>{p['bytes'] / 1024:.1f}</td>"
+            f"<td><a href='{path}/{p['file']}'>{p['file']}</a>"
+            + (f" (<a href='{path}/{p['file']}?top=30'>top</a>)"
+               if p["file"].endswith(".prof") else "")
+            + "</td></tr>"
+            for p in list_profiles(profiler.directory))
+        return (
+            "<html><head><title>SpecMod Dash profiles</title></head><body>"
+            f"<h3>Profiles ({profiler.mode})</h3>"
+            "<table><tr><th>time</th><th>callback</th><th>ms</th>"
+            f"<th>KB</th><th>file</th></tr>{rows}</table></body></html>")
+
+    def serve_profile(file: str):
+        check_remote()
+        top = flask.request.args.get("top", type=int)
+        if top and file.endswith(".prof"):
+            out = StringIO()
+            try:
+                stats = pstats.Stats(
+                    os.path.join(profiler.directory, file), stream=out)
+            except (OSError, ValueError):
+                flask.abort(404)
+            stats.sort_stats("cumulative").print_stats(top)
+            return flask.Response(out.getvalue(), mimetype="text/plain")
+        return flask.send_from_directory(
+            os.path.abspath(profiler.directory), file, as_attachment=True)
+
+    app.server.add_url_rule(path, "profiles", serve_index)
+    app.server.add_url_rule(f"{path}/<file>", "profile", serve_profile)
@@ -0,0 +1,453 @@
+"""
+session.py
+
+    The file with the server-side stores of the review decisions made
+    in each browser session. The browser only holds its session id and
+    the decision for the station on display.
+"""
+import copy
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+# seconds between the last-seen updates of a session made by its reads
+TOUCH_INTERVAL = 60
+
+
+def same_decision(a: dict, b: dict) -> bool:
+    """
+    Checks whether two review decisions would be saved to the same values.
+    The bandwidth is ignored for stations that cannot be modeled.
+
+    Args:
+        a, b (dict): Decisions with keys "snr", "min bf" and "max bf".
+
+    Returns:
+        True if the decisions are equivalent.
+    """
+    if bool(a["snr"]) != bool(b["snr"]):
+        return False
+    if not a["snr"]:
+        return True
+    return all(abs(a[k] - b[k]) <= 1e-9 for k in ("min bf", "max bf"))
+
+
+def new_session_id() -> str:
+    """
+    Returns:
+        sid (str): A new random session id.
+    """
+    return uuid.uuid4().hex
+
+
+class MemorySessionStore:
+    """
+    Keeps the review decisions of every session in server memory. The
+    decisions are stored as {session: {event: {station: decision}}} where
+    a decision is a dict with the keys "snr", "min bf" and "max bf".
+
+    The decision read from file when a station is first visited is kept
+    as its saved state, so that only the decisions that differ from what
+    is on disk need to be written. The station's state on file (see
+    src.specroutines.station_state) is kept as its base, so that saving
+    can detect stations changed on file by someone else in the meantime.
+
+    Every use of a session records when it was last seen, so sessions
+    whose browser is gone can be pruned once they have nothing unsaved.
+
+    This store only works with a single server process, see
+    SQLiteSessionStore for running several workers.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._saved = {}
+        self._base = {}
+        self._seen = {}
+        self._lock = threading.RLock()
+
+    def get(self, sid: str, ev: str, sta: str) -> Optional[dict]:
+        """
+        Gets the decision for a station in a session.
+
+        Args:
+            sid (str): The session id.
+            ev (str): The event name.
+            sta (str): The station id.
+
+        Returns:
+            decision (dict): The decision or None if the station has not
+                been visited in the session.
+        """
+        with self._lock:
+            self._seen[sid] = time.time()
+            decision = self._data.get(sid, {}).get(ev, {}).get(sta)
+            return dict(decision) if decision is not None else None
+
+    def entry(self, sid: str, ev: str, sta: str) -> Optional[dict]:
+        """
+        Gets the decision for a station in a session together with its
+        saved state and base.
+
+        Args:
+            sid (str): The session id.
+            ev (str): The event name.
+            sta (str): The station id.
+
+        Returns:
+            entry (dict): Copies of the "decision", "saved" and "base" of
+                the station (each None if not recorded), or None if the
+                station has not been visited in the session.
+        """
+        with self._lock:
+            self._seen[sid] = time.time()
+            decision = self._data.get(sid, {}).get(ev, {}).get(sta)
+            if decision is None:
+                return None
+            return copy.deepcopy({
+                "decision": decision,
+                "saved": self._saved.get(sid, {}).get(ev, {}).get(sta),
+                "base": self._base.get(sid, {}).get(ev, {}).get(sta),
+                })
+
+    def set(self, sid: str, ev: str, sta: str, decision: dict) -> None:
+        """
+        Sets the decision for a station in a session.
+
+        Args:
+            sid (str): The session id.
+            ev (str): The event name.
+            sta (str): The station id.
+            decision (dict): The decision to store.
+        """
+        with self._lock:
+            self._seen[sid] = time.time()
+            self._data.setdefault(sid, {}).setdefault(ev, {})[sta] = dict(
+                decision)
+
+    def seed(self, sid: str, ev: str, sta: str, decision: dict,
+             state: Optional[dict] = None) -> None:
+        """
+        Sets the decision for a station as read from file, which is also
+        recorded as its saved state.
+
+        Args:
+            sid (str): The session id.
+            ev (str): The event name.
+            sta (str): The station id.
+            decision (dict): The decision read from file.
+            state (dict): The station's state on file. Default is None.
+        """
+        with self._lock:
+            self.set(sid, ev, sta, decision)
+            self._saved.setdefault(sid, {}).setdefault(ev, {})[sta] = dict(
+                decision)
+            if state is not None:
+                self.rebase(sid, {ev: {sta: state}})
+
+    def dirty(self, sid: str) -> dict:
+        """
+        Gets the decisions of a session that differ from their saved state.
+
+        Args:
+            sid (str): The session id.
+
+        Returns:
+            data (dict): A copy of the changed decisions as 
+                {event: {station: decision}}.
+        """
+        with self._lock:
+            saved = self._saved.get(sid, {})
+            data = {}
+            for ev, stas in self._data.get(sid, {}).items():
+                for sta, decision in stas.items():
+                    old = saved.get(ev, {}).get(sta)
+                    if old is None or not same_decision(decision, old):
+                        data.setdefault(ev, {})[sta] = dict(decision)
+            return data
+
+    def mark_saved(self, sid: str, data: dict) -> None:
+        """
+        Records decisions as saved to file.
+
+        Args:
+            sid (str): The session id.
+            data (dict): The saved decisions as {event: {station: decision}}.
+        """
+        with self._lock:
+            self._seen[sid] = time.time()
+            saved = self._saved.setdefault(sid, {})
+            for ev, stas in data.items():
+                for sta, decision in stas.items():
+                    saved.setdefault(ev, {})[sta] = dict(decision)
+
+    def bases(self, sid: str) -> dict:
+        """
+        Gets the states on file the decisions of a session were based on.
+
+        Args:
+            sid (str): The session id.
+
+        Returns:
+            states (dict): A copy of the states as {event: {station: state}}.
+        """
+        with self._lock:
+            return copy.deepcopy(self._base.get(sid, {}))
+
+    def rebase(self, sid: str, states: dict) -> None:
+        """
+        Records the states on file the decisions of a session are based on,
+        e.g., after saving or after accepting a conflicting change.
+
+        Args:
+            sid (str): The session id.
+            states (dict): The states as {event: {station: state}}.
+        """
+        with self._lock:
+            self._seen[sid] = time.time()
+            base = self._base.setdefault(sid, {})
+            for ev, stas in states.items():
+                for sta, state in stas.items():
+                    base.setdefault(ev, {})[sta] = copy.deepcopy(state)
+
+    def decisions(self, sid: str) -> dict:
+        """
+        Gets every decision made in a session.
+
+        Args:
+            sid (str): The session id.
+
+        Returns:
+            data (dict): A copy of the decisions as {event: {station: ...}}.
+        """
+        with self._lock:
+            return copy.deepcopy(self._data.get(sid, {}))
+
+    def clear(self, sid: str) -> None:
+        """
+        Forgets every decision made in a session.
+
+        Args:
+            sid (str): The session id.
+        """
+        with self._lock:
+            self._data.pop(sid, None)
+            self._saved.pop(sid, None)
+            self._base.pop(sid, None)
+            self._seen.pop(sid, None)
+
+    def prune(self, max_idle: float) -> List[str]:
+        """
+        Forgets the sessions not seen for max_idle seconds that have no
+        unsaved decisions (those are kept until saved or cleared).
+
+        Args:
+            max_idle (float): The seconds a session may go unseen.
+
+        Returns:
+            sids (list): The ids of the forgotten sessions.
+        """
+        cutoff = time.time() - max_idle
+        with self._lock:
+            sids = [sid for sid in set(self._data) | set(self._seen)
+                    | set(self._saved) | set(self._base)
+                    if self._seen.get(sid, 0) < cutoff and not self.dirty(sid)]
+            for sid in sids:
+                self.clear(sid)
+            return sids
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS decisions (
+    sid TEXT,
+    ev TEXT,
+    sta TEXT,
+    decision TEXT,
+    saved TEXT,
+    base TEXT,
+    PRIMARY KEY (sid, ev, sta)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    sid TEXT PRIMARY KEY,
+    seen REAL
+);
+"""
+
+
+class SQLiteSessionStore:
+    """
+    Keeps the review decisions of every session in a SQLite file, so that
+    they are shared by every worker process and thread of the app. It has
+    the same interface as MemorySessionStore. The decision, saved state and
+    base of a station are stored as JSON, and the last-seen time of each
+    session in a table of its own (updated at most every TOUCH_INTERVAL
+    seconds by reads).
+
+    Args:
+        path (str): The session database file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._touched = {}
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        con = sqlite3.connect(self.path, timeout=30)
+        con.row_factory = sqlite3.Row
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def _rows(self, sid: str):
+        with self._connect() as con:
+            return con.execute(
+                "SELECT * FROM decisions WHERE sid = ?", (sid,)).fetchall()
+
+    def _touch(self, con: sqlite3.Connection, sid: str,
+               force: bool = True) -> None:
+        now = time.time()
+        if not force and now - self._touched.get(sid, 0) < TOUCH_INTERVAL:
+            return
+        if len(self._touched) > 4096:
+            self._touched = {k: t for k, t in self._touched.items()
+                             if now - t < TOUCH_INTERVAL}
+        self._touched[sid] = now
+        con.execute(
+            "INSERT INTO sessions VALUES (?, ?) ON CONFLICT (sid) "
+            "DO UPDATE SET seen = excluded.seen", (sid, now))
+
+    def get(self, sid: str, ev: str, sta: str) -> Optional[dict]:
+        with self._connect() as con:
+            self._touch(con, sid, force=False)
+            row = con.execute(
+                "SELECT decision FROM decisions "
+                "WHERE sid = ? AND ev = ? AND sta = ?", (sid, ev, sta)
+                ).fetchone()
+        if row is None or row["decision"] is None:
+            return None
+        return json.loads(row["decision"])
+
+    def entry(self, sid: str, ev: str, sta: str) -> Optional[dict]:
+        with self._connect() as con:
+            self._touch(con, sid, force=False)
+            row = con.execute(
+                "SELECT decision, saved, base FROM decisions "
+                "WHERE sid = ? AND ev = ? AND sta = ?", (sid, ev, sta)
+                ).fetchone()
+        if row is None or row["decision"] is None:
+            return None
+        return {k: json.loads(row[k]) if row[k] is not None else None
+                for k in ("decision", "saved", "base")}
+
+    def set(self, sid: str, ev: str, sta: str, decision: dict) -> None:
+        with self._connect() as con:
+            self._touch(con, sid)
+            con.execute(
+                "INSERT INTO decisions (sid, ev, sta, decision) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (sid, ev, sta) "
+                "DO UPDATE SET decision = excluded.decision",
+                (sid, ev, sta, json.dumps(decision)))
+
+    def seed(self, sid: str, ev: str, sta: str, decision: dict,
+             state: Optional[dict] = None) -> None:
+        js = json.dumps(decision)
+        with self._connect() as con:
+            self._touch(con, sid)
+            con.execute(
+                "INSERT INTO decisions VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (sid, ev, sta) DO UPDATE SET "
+                "decision = excluded.decision, saved = excluded.saved, "
+                "base = COALESCE(excluded.base, base)",
+                (sid, ev, sta, js, js,
+                 json.dumps(state) if state is not None else None))
+
+    def dirty(self, sid: str) -> dict:
+        return self._dirty(self._rows(sid))
+
+    @staticmethod
+    def _dirty(rows) -> dict:
+        data = {}
+        for r in rows:
+            if r["decision"] is None:
+                continue
+            decision = json.loads(r["decision"])
+            old = json.loads(r["saved"]) if r["saved"] else None
+            if old is None or not same_decision(decision, old):
+                data.setdefault(r["ev"], {})[r["sta"]] = decision
+        return data
+
+    def mark_saved(self, sid: str, data: dict) -> None:
+        with self._connect() as con:
+            self._touch(con, sid)
+            con.executemany(
+                "INSERT INTO decisions (sid, ev, sta, saved) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (sid, ev, sta) "
+                "DO UPDATE SET saved = excluded.saved",
+                [(sid, ev, sta, json.dumps(decision))
+                 for ev, stas in data.items()
+                 for sta, decision in stas.items()])
+
+    def bases(self, sid: str) -> dict:
+        states = {}
+        for r in self._rows(sid):
+            if r["base"] is not None:
+                states.setdefault(r["ev"], {})[r["sta"]] = json.loads(
+                    r["base"])
+        return states
+
+    def rebase(self, sid: str, states: dict) -> None:
+        with self._connect() as con:
+            self._touch(con, sid)
+            con.executemany(
+                "INSERT INTO decisions (sid, ev, sta, base) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (sid, ev, sta) "
+                "DO UPDATE SET base = excluded.base",
+                [(sid, ev, sta, json.dumps(state))
+                 for ev, stas in states.items()
+                 for sta, state in stas.items()])
+
+    def decisions(self, sid: str) -> dict:
+        data = {}
+        for r in self._rows(sid):
+            if r["decision"] is not None:
+                data.setdefault(r["ev"], {})[r["sta"]] = json.loads(
+                    r["decision"])
+        return data
+
+    def clear(self, sid: str) -> None:
+        with self._connect() as con:
+            con.execute("DELETE FROM decisions WHERE sid = ?", (sid,))
+            con.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+        self._touched.pop(sid, None)
+
+    def prune(self, max_idle: float) -> List[str]:
+        # sessions written before last-seen times were kept count as idle
+        cutoff = time.time() - max_idle
+        sids = []
+        with self._connect() as con:
+            # holds the write lock, so no decision is staged meanwhile
+            con.execute("BEGIN IMMEDIATE")
+            for (sid,) in con.execute(
+                    "SELECT sid FROM decisions UNION SELECT sid FROM sessions "
+                    "EXCEPT SELECT sid FROM sessions WHERE seen >= ?",
+                    (cutoff,)).fetchall():
+                rows = con.execute(
+                    "SELECT * FROM decisions WHERE sid = ?", (sid,)).fetchall()
+                if self._dirty(rows):
+                    continue
+                con.execute("DELETE FROM decisions WHERE sid = ?", (sid,))
+                con.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+                sids.append(sid)
+        for sid in sids:
+            self._touched.pop(sid, None)
+        return sids
@@ -5,19 +5,26 @@ specplot.py
 
 	The file with functions to style the spectral plots.
 """
+from __future__ import annotations
 
 import numpy as np
 import plotly.graph_objects as go
-from SpecMod.specmod.Spectral import Spectra, SNP
-from typing import Tuple
+from typing import TYPE_CHECKING, Tuple
+from src.numerics import decimate_log, decimate_log_many
+
+if TYPE_CHECKING:
+	from SpecMod.specmod.Spectral import SNP
 
 def get_min_max_freqs(snp: SNP) -> Tuple[np.ndarray, np.ndarray]:
 	"""
 	Gets minimum and maximum frequencies from 
 
 	"""
-	mn, mx = np.log10([np.round(snp.signal.freq[1], 1), 
-	       np.round(snp.signal.freq[-1], 1)])
+	# skips the 0 Hz bin, and fine bins that would round to 0 Hz
+	freq = np.asarray(snp.signal.freq)
+	freq = freq[freq > 0]
+	mn, mx = np.log10([np.round(freq[0], 1) or freq[0], 
+	       np.round(freq[-1], 1)])
 	return mn, mx
 
 
@@ -44,77 +51,332 @@ def get_band_vals(snp):
 
 
 
-def make_fig(sfreq, samp, nfreq, namp, pass_snr, vals):
+def make_base_fig(sfreq, samp, nfreq, namp, max_points=None):
+	"""
+	Makes the static part of a station's figure: the signal and noise 
+	spectra and the axes. It depends only on the spectra, so it can be
+	cached and the review decision drawn over it with make_overlays.
+
+	Args:
+		sfreq, samp (np.ndarray): The signal frequencies and amplitudes.
+		nfreq, namp (np.ndarray): The noise frequencies and amplitudes.
+		max_points (int): If given, each spectrum is decimated onto log-spaced
+			frequencies to about this many points for display. The axis
+			ranges are computed from the full resolution spectra.
+
+	Returns:
+		fig (dict): The figure as a plain dict.
+	"""
 
 	fac=1.25
 
-	fig = go.Figure()
+	nf, na = decimate_log(nfreq, namp, max_points)
+	sf, sa = decimate_log(sfreq, samp, max_points)
+
+	data = [
+		{"type": "scatter", "x": nf, "y": na, "mode": "lines", "name": "noise"},
+		{"type": "scatter", "x": sf, "y": sa, "mode": "lines", "name": "signal"},
+		]
 
-	fig.add_trace(
-		go.Scatter(
-			x=nfreq, 
-			y=namp, 
-			mode='lines', 
-			name='noise'
-			)
-		)
+	layout = {
+		"font": {"family": "Times New Roman"},
+		"xaxis": {
+			"title": {"text": "Frequency (Hz)"},
+			"type": "log",
+			"range": [
+				# the 0 Hz bin has no place on a log axis
+				float(np.min([np.log10(sfreq[sfreq > 0].min()/fac), 
+					np.log10(nfreq[nfreq > 0].min()/fac)])), 
+				float(np.max([np.log10(sfreq.max()*fac), 
+					np.log10(nfreq.max()*fac)]))
+				],
+			},
+		"yaxis": {
+			"title": {"text": "Spec. Vel. ([m/s] s)"},
+			"type": "log",
+			"range": [
+				float(np.min([np.log10(samp.min()/fac), 
+					np.log10(namp.min()/fac)])), 
+				float(np.max([np.log10(samp.max()*fac), 
+					np.log10(namp.max()*fac)]))
+				],
+			},
+		"legend": {
+			"yanchor": "bottom",
+			"y": 1.02,
+			"xanchor": "right",
+			"x": 1,
+			"orientation": "h",
+			},
+		}
 
-	fig.add_trace(
-		go.Scatter(
-			x=sfreq, 
-			y=samp, 
-			mode='lines', 
-			name='signal'
-			)
-		)
+	return {"data": data, "layout": layout}
 
-	print(vals)
+
+def make_overlays(base, pass_snr, vals, suggested=None):
+	"""
+	Makes the review decision drawn over a base figure: the bandwidth lines
+	and the suggested band. These are a few small traces and shapes, cheap
+	to rebuild whenever the decision changes.
+
+	Args:
+		base (dict): The figure made by make_base_fig (its arrays may be
+			packed, only the axis ranges are used).
+		pass_snr (bool): True if the spectrum can be modeled.
+		vals (tuple): The log10 bandwidth limits or None.
+		suggested (dict): A suggested decision (see 
+			src.specroutines.suggest_decisions) to draw as a shaded band.
+			Default is None.
+
+	Returns:
+		overlays (dict): The "data", "shapes" and "annotations" to add.
+	"""
+
+	data, shapes, annotations = [], [], []
+
+	y = [10**r for r in base["layout"]["yaxis"]["range"]]
 
 	if vals is not None and pass_snr:
 		for val, sv in zip(vals, [True, False]):
-			fig.add_trace(
-				go.Scatter(
-					x=[10**val, 10**val], 
-					y=[np.min([samp.min()/fac, 
-					   namp.min()/fac]), 
-				       np.max([samp.max()*fac, 
-					   namp.max()*fac])
-					   ], 
-					mode='lines',
-					line_width=2,
-					line_color='black', 
-					name="bandwidth", 
-					legendgroup="bd",
-                    showlegend=sv
-					),
-				)
-
-	fig.update_layout(
-		font_family="Times New Roman",
-		xaxis_title="Frequency (Hz)",
-		yaxis_title="Spec. Vel. ([m/s] s)",
-		xaxis_type="log", 
-		yaxis_type="log", 
-		yaxis_range=[
-			np.min([np.log10(samp.min()/fac), 
-				np.log10(namp.min()/fac)]), 
-			np.max([np.log10(samp.max()*fac), 
-				np.log10(namp.max()*fac)])
-			],
-		xaxis_range=[
-			np.min([np.log10(sfreq.min()/fac), 
-				np.log10(nfreq.min()/fac)]), 
-			np.max([np.log10(sfreq.max()*fac), 
-				np.log10(nfreq.max()*fac)])
-			],
-		
-        legend=dict(
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1,
-                orientation='h'
-            )
-	   )
-
-	return fig
\ No newline at end of file
+			data.append({
+				"type": "scatter",
+				"x": [10**val, 10**val], 
+				"y": y, 
+				"mode": "lines",
+				"line": {"width": 2, "color": "black"}, 
+				"name": "bandwidth", 
+				"legendgroup": "bd",
+				"showlegend": sv,
+			})
+
+	if suggested is not None:
+		# a shape rather than traces, so the bandwidth lines are unaffected
+		if suggested["snr"]:
+			lo, hi = suggested["min bf"], suggested["max bf"]
+			shapes.append({
+				"type": "rect", "xref": "x", "yref": "paper",
+				"x0": 10**lo, "x1": 10**hi, "y0": 0, "y1": 1,
+				"fillcolor": "orange", "opacity": 0.15, 
+				"line": {"width": 0}, "layer": "below",
+			})
+			text, x, xref = "suggested", (lo + hi) / 2, "x"
+		else:
+			text, x, xref = "suggested: unsuitable", 0, "paper"
+		annotations.append({
+			"text": text, "x": x, "xref": xref, "y": 1, "yref": "paper", 
+			"yanchor": "bottom", "showarrow": False, 
+			"font": {"color": "darkorange"},
+		})
+
+	return {"data": data, "shapes": shapes, "annotations": annotations}
+
+
+def layer_fig(base, overlays):
+	"""
+	Draws the overlays over a base figure without copying its arrays.
+
+	Args:
+		base (dict): The figure made by make_base_fig.
+		overlays (dict): The overlays made by make_overlays.
+
+	Returns:
+		fig (dict): A shallow copy of base with the overlays.
+	"""
+	layout = dict(base["layout"])
+	for key in ("shapes", "annotations"):
+		if overlays[key]:
+			layout[key] = list(layout.get(key, [])) + overlays[key]
+
+	return dict(base, data=list(base["data"]) + overlays["data"], 
+	            layout=layout)
+
+
+def make_fig(sfreq, samp, nfreq, namp, pass_snr, vals, max_points=None,
+	         suggested=None):
+	"""
+	Makes the figure of the signal and noise spectra with the bandwidth
+	limits (see make_base_fig and make_overlays).
+
+	Args:
+		sfreq, samp (np.ndarray): The signal frequencies and amplitudes.
+		nfreq, namp (np.ndarray): The noise frequencies and amplitudes.
+		pass_snr (bool): True if the spectrum can be modeled.
+		vals (tuple): The log10 bandwidth limits or None.
+		max_points (int): If given, each spectrum is decimated onto log-spaced
+			frequencies to about this many points for display.
+		suggested (dict): A suggested decision to draw as a shaded band.
+			Default is None.
+
+	Returns:
+		fig (plotly.graph_objects.Figure): The figure.
+	"""
+	base = make_base_fig(sfreq, samp, nfreq, namp, max_points)
+
+	return go.Figure(layer_fig(base, make_overlays(
+		base, pass_snr, vals, suggested)))
+
+
+def make_overview(ids, signals, noises, passed, max_points=60, ncols=6):
+	"""
+	Makes a grid of small signal and noise plots, one panel per station,
+	drawn with WebGL. The figure is built as a plain dict, which is much
+	faster than validating hundreds of plotly traces. The traces are 
+	ordered noise then signal for each station, so the station of a 
+	clicked trace is ids[curveNumber // 2].
+
+	Args:
+		ids (list): The station ids in panel order.
+		signals, noises (list): The (freq, amp) spectra of each station.
+		passed (list): True for the stations that can be modeled.
+		max_points (int): The points per decimated spectrum. Default is 60.
+		ncols (int): The number of panels per row. Default is 6.
+
+	Returns:
+		fig (dict): The figure.
+	"""
+
+	nsta = len(ids)
+	nrows = max(-(-nsta // ncols), 1)
+	height = 160 * nrows
+	# the gaps between panels, the vertical one leaves room for the titles
+	gap, ygap = 0.02, 18 / height
+
+	spectra = decimate_log_many(list(signals) + list(noises), max_points)
+	signals, noises = spectra[:nsta], spectra[nsta:]
+
+	data, annotations = [], []
+	layout = {
+		"font": {"family": "Times New Roman", "size": 9},
+		"showlegend": False,
+		"hovermode": "closest",
+		"height": height,
+		"margin": {"l": 10, "r": 10, "t": 20, "b": 10},
+	}
+
+	for i, (sta, (sf, sa), (nf, na), ok) in enumerate(
+			zip(ids, signals, noises, passed)):
+
+		row, col = divmod(i, ncols)
+		ax = "" if i == 0 else str(i + 1)
+
+		x0 = col / ncols + gap / 2
+		y1 = 1 - row / nrows - ygap
+
+		for name, f, a, color in (
+				("noise", nf, na, "#999999"), 
+				("signal", sf, sa, "#1f77b4" if ok else "#d62728")):
+			data.append({
+				"type": "scattergl",
+				"x": f, 
+				"y": a, 
+				"mode": "lines",
+				"name": name,
+				"line": {"color": color, "width": 1},
+				"xaxis": f"x{ax}",
+				"yaxis": f"y{ax}",
+			})
+
+		layout[f"xaxis{ax}"] = {
+			"type": "log", 
+			"domain": [x0, x0 + 1 / ncols - gap], 
+			"anchor": f"y{ax}",
+			"showticklabels": False,
+		}
+		layout[f"yaxis{ax}"] = {
+			"type": "log", 
+			"domain": [y1 - 1 / nrows + 2 * ygap, y1], 
+			"anchor": f"x{ax}",
+			"showticklabels": False,
+		}
+		annotations.append({
+			"text": sta,
+			"showarrow": False,
+			"xref": "paper",
+			"yref": "paper",
+			"x": x0,
+			"y": y1,
+			"xanchor": "left",
+			"yanchor": "bottom",
+		})
+
+	layout["annotations"] = annotations
+
+	return {"data": data, "layout": layout}
+
+
+
+def make_station_events(evs, signals, noises, passed, mode="overlay", 
+	                    max_points=200, spacing=1.0):
+	"""
+	Makes the figure of one station's spectra across many events, drawn 
+	with WebGL as a plain dict (see make_overview). The traces are ordered
+	noise then signal for each event, so the event of a trace is 
+	evs[curveNumber // 2].
+
+	Args:
+		evs (list): The event names in drawing order.
+		signals, noises (list): The (freq, amp) spectra of each event.
+		passed (list): True for the events where the station can be 
+			modeled.
+		mode (str): "overlay" to draw every event on the same axes or 
+			"stack" to offset each event by spacing decades. Default is 
+			"overlay".
+		max_points (int): The points per decimated spectrum. Default is 200.
+		spacing (float): The decades between stacked events. Default is 1.
+
+	Returns:
+		fig (dict): The figure.
+	"""
+
+	nev = len(evs)
+	stack = mode == "stack"
+
+	spectra = decimate_log_many(list(signals) + list(noises), max_points)
+	signals, noises = spectra[:nev], spectra[nev:]
+
+	data, annotations = [], []
+	for i, (ev, (sf, sa), (nf, na), ok) in enumerate(
+			zip(evs, signals, noises, passed)):
+
+		# the later events are drawn further down the stack
+		shift = 10 ** (-i * spacing) if stack else 1.0
+
+		for name, f, a, color, opacity in (
+				("noise", nf, na, "#999999", 0.4), 
+				("signal", sf, sa, "#1f77b4" if ok else "#d62728", 0.7)):
+			data.append({
+				"type": "scattergl",
+				"x": f, 
+				"y": a * shift, 
+				"mode": "lines",
+				"name": name,
+				"line": {"color": color, "width": 1},
+				"opacity": opacity,
+				"hovertemplate": f"{ev}<br>%{{x:.2f}} Hz<extra>{name}</extra>",
+			})
+
+		if stack and len(sf):
+			annotations.append({
+				"text": ev,
+				"showarrow": False,
+				"x": 1,
+				"xref": "paper",
+				"y": float(np.log10(sa[-1] * shift)),
+				"yref": "y",
+				"xanchor": "left",
+				"font": {"size": 9},
+			})
+
+	layout = {
+		"font": {"family": "Times New Roman"},
+		"showlegend": False,
+		"hovermode": "closest",
+		"height": max(400, 40 * nev) if stack else 500,
+		"margin": {"l": 60, "r": 180 if stack else 20, "t": 20, "b": 50},
+		"xaxis": {"title": {"text": "Frequency (Hz)"}, "type": "log"},
+		"yaxis": {"type": "log", "showticklabels": not stack,
+		          "title": {"text": "" if stack else "Spec. Vel. ([m/s] s)"}},
+		"annotations": annotations,
+	}
+
+	return {"data": data, "layout": layout}
@@ -4,68 +4,589 @@ specroutines.py
     The file with functions to connect and manipulate SpecMod objects 
     for use with Dash.
 """
+from __future__ import annotations
+
+import os
+import time
+import logging
+import shutil
+import tempfile
+import contextlib
 import numpy as np
-from SpecMod.specmod.Spectral import Spectra
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List
+from src.cache import spectra_cache, suggestion_cache, file_version
+from src.columnar import (ColumnStore, format_columns_path, stamp_columns,
+    write_columns)
+from src.locks import event_lock
+from src.numerics import (group_by_freq, log_bin_rows, suggest_bands, 
+    smooth_rows)
+
+if TYPE_CHECKING:
+    # SpecMod (and obspy with it) is only imported when spectra are read
+    from SpecMod.specmod.Spectral import Spectra
+
+logger = logging.getLogger("specmod")
+
+# the stale columnar stores already reported, as (path, source version)
+_stale_reported = set()
+
+
+class ConflictError(Exception):
+    """
+    Raised when stations were changed on file since a reviewer loaded them.
+    """
 
 def format_spectra_path(pdir, ev):
     return f"{pdir}/{ev}/Spectra/{ev}.spec"
 
 
-def get_event_spectra(pdir: str, ev: str) -> Spectra:
+def read_spectra(path: str) -> Spectra:
+    """
+    Reads a specmod spectra pickle file from disk.
+
+    Args:
+        path (str): The path to the specmod spectra pickle file
+
+    Returns:
+        sp (specmod.Spectra): A SpecMod spectral instance
+    """
+    from SpecMod.specmod.Spectral import Spectra
+
+    return Spectra.read_spectra(path, skip_warning=True, method='pickle')
+
+
+def use_columns(pdir: str, ev: str, backend: str = "pickle") -> bool:
+    """
+    Checks whether an event is read from the columnar store. A store is
+    skipped (i.e., the pickle is read) once the pickle has been rewritten
+    since the event was converted, e.g. by a new SpecMod run, until the
+    event is converted again.
+
+    Args:
+        pdir (str): The parent directory of the specmod spectra pickle file
+        ev (str): The event datetime (e.g., "2012-10-08T12:12:12.760000Z")
+        backend (str): The storage backend, "pickle" or "columnar".
+
+    Returns:
+        True if the backend is "columnar" and the event has been converted
+        from the current pickle.
+    """
+    if backend != "columnar":
+        return False
+    path = format_columns_path(pdir, ev)
+    if not ColumnStore.exists(path):
+        return False
+    try:
+        version = ColumnStore.read_source_version(path)
+        if version == file_version(format_spectra_path(pdir, ev)):
+            return True
+    except FileNotFoundError:
+        # a store without its pickle is all there is to read
+        return True
+
+    if (path, version) not in _stale_reported:
+        _stale_reported.add((path, version))
+        logger.warning(
+            "the pickle of %s was rewritten after it was converted, reading "
+            "the pickle: review decisions saved to the columnar store are "
+            "not shown until folded (see python convert.py --help)", ev)
+    return False
+
+
+def source_path(pdir: str, ev: str, backend: str = "pickle") -> str:
+    """
+    Gets the file that is rewritten whenever the stored spectra or review
+    decisions of an event change. Its mtime is used to version the event.
+
+    Args:
+        pdir (str): The parent directory of the specmod spectra pickle file
+        ev (str): The event datetime (e.g., "2012-10-08T12:12:12.760000Z")
+        backend (str): The storage backend, "pickle" or "columnar".
+
+    Returns:
+        path (str): The pickle file or the columnar decisions file.
+    """
+    if use_columns(pdir, ev, backend):
+        return os.path.join(format_columns_path(pdir, ev), "decisions.json")
+    return format_spectra_path(pdir, ev)
+
+
+def _open_columns(path: str) -> ColumnStore:
+    return ColumnStore(os.path.dirname(path))
+
+
+def get_event_spectra(pdir: str, ev: str, cached: bool = True, 
+                      backend: str = "pickle") -> Spectra:
     """
     Loads in the spectra for a given local specmod event spectra group
     for a given event (datetime string).
 
+    By default the spectra are served from the process-wide LRU cache,
+    which reloads the file when its mtime or size changes. The cached
+    instance is shared, so callers that modify it should pass cached=False.
+
+    With the "columnar" backend, events that have been converted (see 
+    convert.py) are opened as a memory-mapped ColumnStore, which offers
+    the same group/get_spectra interface; other events fall back to the 
+    pickle file.
+
     Args:
         pdir (str): The parent directory of the specmod spectra pickle file
         ev (str): The event datetime (e.g., "2012-10-08T12:12:12.760000Z")
+        cached (bool): Use the spectra cache. Default is True.
+        backend (str): The storage backend, "pickle" or "columnar". 
+            Default is "pickle".
 
     Returns:
-        tr (specmod.Spectra): A SpecMod spectral instance
+        tr (specmod.Spectra): A SpecMod spectral instance (or ColumnStore)
     """
-    sp = Spectra.read_spectra(
-        format_spectra_path(
-            pdir, ev), 
-        skip_warning=True, method='pickle')
-    return sp
+    path = source_path(pdir, ev, backend)
+    loader = _open_columns if use_columns(pdir, ev, backend) else read_spectra
+    if cached:
+        return spectra_cache.load(path, loader)
+    return loader(path)
 
 
-def write_specs(pdir: str, data: dict) -> None:
+def get_station_spectra(pdir: str, ev: str, sta: str, 
+                        backend: str = "pickle", cached: bool = True):
     """
-    Writes the spectra for a given local specmod event spectra group
-    for a given event.
+    Loads in the spectra of a single station. With the "columnar" backend
+    the arrays are views onto the memory-mapped columns, so only the pages
+    of that station are read.
 
     Args:
         pdir (str): The parent directory of the specmod spectra pickle file
         ev (str): The event datetime (e.g., "2012-10-08T12:12:12.760000Z")
-        data (dict): A dict containing the metadata from specmod dash.
+        sta (str): The station id.
+        backend (str): The storage backend, "pickle" or "columnar".
+        cached (bool): Use the spectra cache. Default is True. Pass False
+            to read many events once without evicting the cached ones.
 
     Returns:
-        None
+        snp (specmod.SNP): The signal and noise spectra of the station 
+            (or a ColumnSNP).
     """
+    return get_event_spectra(
+        pdir, ev, cached=cached, backend=backend).get_spectra(sta)
 
-    # iterate over the values in data which are the ones that have been ...
-    # inspected and possibly changed. 
-    for ev, stas in data.items():
 
-        sp = get_event_spectra(pdir, ev)
-        
-        for sta, meta in stas.items():
+def convert_event(pdir: str, ev: str) -> int:
+    """
+    Converts the spectra pickle of an event to the columnar layout. An
+    existing columnar store is replaced along with its decisions, see
+    unfolded_stations for those not yet in the pickle.
 
-            snp = sp.get_spectra(sta)
-            
-            # print(sta, meta['snr'], snp.signal.get_pass_snr())
+    Args:
+        pdir (str): The parent directory of the specmod spectra pickle file
+        ev (str): The event datetime (e.g., "2012-10-08T12:12:12.760000Z")
+
+    Returns:
+        nbytes (int): The size of the columnar store in bytes.
+    """
+    path = format_spectra_path(pdir, ev)
+    with event_lock(pdir, ev):
+        version = file_version(path)
+        nbytes = write_columns(read_spectra(path), 
+                               format_columns_path(pdir, ev), version)
+    spectra_cache.invalidate(source_path(pdir, ev, "columnar"))
+    return nbytes
+
+
+def unfolded_stations(pdir: str, ev: str) -> List[str]:
+    """
+    Gets the stations whose review decision in the columnar store of an
+    event differs from the one in its pickle, i.e., the decisions that
+    converting the event again would lose.
+
+    Args:
+        pdir (str): The parent directory of the specmod spectra pickle file
+        ev (str): The event datetime (e.g., "2012-10-08T12:12:12.760000Z")
+
+    Returns:
+        stas (list): The station ids.
+    """
+    cols = ColumnStore(format_columns_path(pdir, ev))
+    sp = read_spectra(format_spectra_path(pdir, ev))
+
+    stas = []
+    for sta in cols.stations():
+        if sta not in sp.group:
+            continue
+        snp, col = sp.get_spectra(sta), cols.get_spectra(sta)
+        a = np.asarray(snp.ubfreqs, dtype=float).ravel()
+        b = np.asarray(col.ubfreqs, dtype=float).ravel()
+        if (bool(snp.signal.get_pass_snr()) != col.signal.get_pass_snr()
+                or a.shape != b.shape or not np.allclose(a, b)):
+            stas.append(sta)
+    return stas
+
+
+def fold_columns(pdir: str, ev: str) -> int:
+    """
+    Writes the review decisions held in the columnar store of an event
+    back into its spectra pickle.
+
+    Args:
+        pdir (str): The parent directory of the specmod spectra pickle file
+        ev (str): The event datetime (e.g., "2012-10-08T12:12:12.760000Z")
+
+    Returns:
+        nbytes (int): The size of the written pickle file in bytes.
+    """
+    path = format_spectra_path(pdir, ev)
+
+    with event_lock(pdir, ev):
+        cols = ColumnStore(format_columns_path(pdir, ev))
+        sp = read_spectra(path)
+
+        for sta in cols.stations():
+            snp, col = sp.get_spectra(sta), cols.get_spectra(sta)
+            snp.signal.set_pass_snr(col.signal.get_pass_snr())
+            snp.ubfreqs = np.array(col.ubfreqs)
+
+        nbytes = write_spectra_atomic(sp, path)
+        # the pickle now holds the decisions of the store, so keep using it
+        stamp_columns(cols.path, file_version(path))
+    spectra_cache.invalidate(path)
+    return nbytes
+
+
+def station_changed(snp, meta: dict) -> bool:
+    """
+    Checks whether applying a review decision would change a station.
+
+    Args:
+        snp (specmod.SNP): The station's signal and noise spectra.
+        meta (dict): The decision with keys "snr", "min bf" and "max bf".
+
+    Returns:
+        True if the pass flag or the usable bandwidth would change.
+    """
+    if bool(meta["snr"]) != bool(snp.signal.get_pass_snr()):
+        return True
+
+    if meta["snr"]:
+        new = np.power(10, [meta["min bf"], meta["max bf"]])
+        old = np.asarray(snp.ubfreqs, dtype=float)
+        return old.shape != new.shape or not np.allclose(old, new)
+
+    return len(snp.ubfreqs) > 0
+
+
+def station_state(snp) -> dict:
+    """
+    Gets the review state held by a station.
+
+    Args:
+        snp (specmod.SNP): The station's signal and noise spectra.
+
+    Returns:
+        state (dict): The pass flag ("snr") and "ubfreqs" (linear, Hz).
+    """
+    return {
+        "snr": 1 if snp.signal.get_pass_snr() else 0,
+        "ubfreqs": [float(f) for f in np.asarray(snp.ubfreqs).ravel()],
+    }
 
-            snp.signal.set_pass_snr(meta["snr"])
 
-            # print(sta, meta['snr'], snp.signal.get_pass_snr())
-            # if it can be modeled it should also have a bandwidth to set
-            if meta["snr"]:
-                snp.ubfreqs = np.array([10**meta["min bf"], 10**meta["max bf"]])
-            # if it can't be modeled then I set ubfreqs to an empty array in SpecMod
-            if not meta["snr"]:
-                snp.ubfreqs = np.array([])
+def suggest_decisions(sp: Spectra, threshold: float = 3.0, nbins: int = 100,
+                      min_decades: float = 0.3, smoothing: str = None,
+                      smoothing_b: float = 40.0,
+                      smoothing_decades: float = 0.1) -> dict:
+    """
+    Suggests a review decision for every station of an event at once. The
+    signal and noise of all stations are resampled onto a common log 
+    frequency grid, stacking the stations that share frequencies, and the
+    usable bandwidth is the widest band where the signal to noise ratio 
+    stays above the threshold (see src.numerics.suggest_bands). The 
+    spectra can be smoothed on log frequency first, each group of stations
+    sharing frequencies in one product (see src.numerics.smooth_rows).
+
+    Args:
+        sp (specmod.Spectra): The event spectra.
+        threshold (float): The minimum signal to noise ratio. Default is 3.
+        nbins (int): The number of bins of the grid. Default is 100.
+        min_decades (float): The narrowest band (in decades of frequency)
+            for a station to pass. Default is 0.3.
+        smoothing (str): "konno-ohmachi", "log-boxcar" or None (no
+            smoothing). Default is None.
+        smoothing_b (float): The Konno-Ohmachi bandwidth coefficient.
+            Default is 40.
+        smoothing_decades (float): The width of the log boxcar. Default is
+            0.1.
+
+    Returns:
+        decisions (dict): The suggested decision of each station as 
+            {station: decision}, with the bandwidth limits (log10 Hz) 
+            rounded to the slider step (None if the station fails).
+    """
+    stas = list(sp.group)
+    snps = [sp.get_spectra(sta) for sta in stas]
+    if not snps:
+        return {}
+
+    fmin = min(np.min(s.signal.freq[s.signal.freq > 0]) for s in snps)
+    fmax = max(np.max(s.signal.freq) for s in snps)
+    edges = np.geomspace(fmin, fmax, nbins + 1)
+
+    def binned(spectra):
+        out = np.full((len(spectra), nbins), np.nan)
+        for rows in group_by_freq([spec.freq for spec in spectra]):
+            freq = spectra[rows[0]].freq
+            amps = smooth_rows(freq, np.vstack([spectra[i].amp for i in rows]),
+                               smoothing, smoothing_b, smoothing_decades)
+            out[rows] = log_bin_rows(freq, amps, edges)
+        return out
+
+    passed, lo, hi = suggest_bands(
+        edges, binned([s.signal for s in snps]), 
+        binned([s.noise for s in snps]), threshold, min_decades)
+
+    return {
+        sta: {
+            "snr": int(ok),
+            "min bf": round(float(a), 2) if ok else None,
+            "max bf": round(float(b), 2) if ok else None,
+        } for sta, ok, a, b in zip(stas, passed, lo, hi)
+    }
+
+
+def get_event_suggestions(pdir: str, ev: str, backend: str = "pickle",
+                          **kwargs) -> dict:
+    """
+    Gets the suggested review decisions of an event (see 
+    suggest_decisions), cached until the event's file changes.
+
+    Args:
+        pdir (str): The parent directory of the specmod spectra pickle file
+        ev (str): The event datetime (e.g., "2012-10-08T12:12:12.760000Z")
+        backend (str): The storage backend, "pickle" or "columnar".
+        **kwargs: Passed on to suggest_decisions.
+
+    Returns:
+        decisions (dict): The suggested decision of each station.
+    """
+    path = os.path.abspath(source_path(pdir, ev, backend))
+    key = (path, tuple(sorted(kwargs.items())))
+    version = file_version(path)
+
+    decisions = suggestion_cache.get(key, version)
+    if decisions is None:
+        decisions = suggest_decisions(
+            get_event_spectra(pdir, ev, backend=backend), **kwargs)
+        suggestion_cache.put(key, decisions, version, 
+                             nbytes=200 * len(decisions))
+
+    return decisions
+
+
+def same_state(a: dict, b: dict) -> bool:
+    """
+    Checks whether two station states (see station_state) are the same.
+    """
+    return (bool(a["snr"]) == bool(b["snr"]) 
+            and len(a["ubfreqs"]) == len(b["ubfreqs"])
+            and np.allclose(a["ubfreqs"], b["ubfreqs"]))
+
+
+def find_conflicts(sp: Spectra, base: dict) -> dict:
+    """
+    Finds the stations whose state on file is no longer the one a set of
+    decisions was based on.
+
+    Args:
+        sp (specmod.Spectra): The event spectra as on file now.
+        base (dict): The states the decisions were based on as
+            {station: state}.
+
+    Returns:
+        conflicts (dict): The current state of the changed stations as
+            {station: state}.
+    """
+    conflicts = {}
+    for sta, state in base.items():
+        now = station_state(sp.get_spectra(sta))
+        if not same_state(now, state):
+            conflicts[sta] = now
+    return conflicts
+
+
+def apply_decisions(sp: Spectra, stas: dict) -> list:
+    """
+    Applies review decisions to the stations of an event, skipping any
+    station whose decision matches what it already holds.
+
+    Args:
+        sp (specmod.Spectra): The event spectra (modified in place).
+        stas (dict): The decisions as {station: decision}.
+
+    Returns:
+        changes (list): One dict per changed station with the station id
+            and its "old" and "new" state (see station_state).
+    """
+    changes = []
+
+    for sta, meta in stas.items():
+
+        snp = sp.get_spectra(sta)
+
+        if not station_changed(snp, meta):
+            continue
+
+        old = station_state(snp)
+
+        snp.signal.set_pass_snr(meta["snr"])
+
+        # if it can be modeled it should also have a bandwidth to set
+        if meta["snr"]:
+            snp.ubfreqs = np.array([10**meta["min bf"], 10**meta["max bf"]])
+        # if it can't be modeled then I set ubfreqs to an empty array in SpecMod
+        if not meta["snr"]:
+            snp.ubfreqs = np.array([])
+
+        changes.append({"station": sta, "old": old, "new": station_state(snp)})
+
+    return changes
+
+
+def write_spectra_atomic(sp: Spectra, path: str) -> int:
+    """
+    Writes a specmod spectra pickle file via a temporary file in the same
+    directory which is then renamed over the original, so a crash never
+    leaves a truncated file behind.
+
+    Args:
+        sp (specmod.Spectra): The spectra to write.
+        path (str): The path of the specmod spectra pickle file.
+
+    Returns:
+        nbytes (int): The size of the written file in bytes.
+    """
+    fd, tmp = tempfile.mkstemp(
+        prefix=f".{os.path.basename(path)}.", suffix=".tmp",
+        dir=os.path.dirname(path) or ".")
+    os.close(fd)
+
+    try:
+        sp.write_spectra(tmp, sp, method='pickle')
+        with open(tmp, 'rb+') as f:
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    return os.path.getsize(path)
+
+
+def write_event_specs(pdir: str, ev: str, stas: dict, 
+                      backend: str = "pickle", dry_run: bool = False,
+                      base: dict = None, lock_timeout: float = 30.0) -> dict:
+    """
+    Applies review decisions to a single event and writes it back to file
+    if any station changed. Events read from the columnar store only have
+    their decisions file rewritten.
+
+    The event is locked (see src.locks.event_lock) while it is read, 
+    changed and written, so concurrent writers of the same event are 
+    serialised. If the states the decisions were based on are given, the
+    event is not written when any of those stations changed on file in
+    the meantime (e.g., saved by another reviewer).
+
+    Args:
+        pdir (str): The parent directory of the specmod spectra pickle file
+        ev (str): The event datetime (e.g., "2012-10-08T12:12:12.760000Z")
+        stas (dict): The decisions as {station: decision}.
+        backend (str): The storage backend, "pickle" or "columnar".
+        dry_run (bool): Work out the changes without writing them.
+        base (dict): The states the decisions were based on as 
+            {station: state} (see station_state). Default is None (no 
+            conflict detection).
+        lock_timeout (float): The seconds to wait for the event lock.
+
+    Returns:
+        report (dict): The number of stations changed, the changes (see
+            apply_decisions), the state of the stations after saving, the 
+            current state of any conflicting stations, seconds taken, bytes
+            written and the error message (None on success).
+    """
+    t0 = time.perf_counter()
+    path = source_path(pdir, ev, backend)
+    report = {"path": path, "stations": 0, "changes": [], "bytes": 0, 
+              "states": {}, "conflicts": {}, "error": None}
+
+    lock = (contextlib.nullcontext() if dry_run 
+            else event_lock(pdir, ev, lock_timeout))
+
+    try:
+        with lock:
+            # load a private copy as the stations are modified below
+            sp = get_event_spectra(pdir, ev, cached=False, backend=backend)
+
+            if base:
+                report["conflicts"] = find_conflicts(
+                    sp, {sta: base[sta] for sta in stas if sta in base})
+                if report["conflicts"]:
+                    raise ConflictError(
+                        f"{sorted(report['conflicts'])} changed on file "
+                        "since loaded, save again to overwrite")
+
+            report["changes"] = apply_decisions(sp, stas)
+            report["stations"] = len(report["changes"])
+
+            if report["stations"] and not dry_run:
+                if isinstance(sp, ColumnStore):
+                    report["bytes"] = sp.save_decisions()
+                else:
+                    report["bytes"] = write_spectra_atomic(sp, path)
+                spectra_cache.invalidate(path)
+
+            report["states"] = {
+                sta: station_state(sp.get_spectra(sta)) for sta in stas}
+
+    except Exception as e:
+        report["error"] = f"{type(e).__name__}: {e}"
+
+    report["seconds"] = time.perf_counter() - t0
+
+    return report
+
+
+def write_specs(pdir: str, data: dict, max_workers: int = None,
+                backend: str = "pickle", bases: dict = None) -> dict:
+    """
+    Writes the spectra for the events that have changed stations. The
+    events are written in parallel by a pool of worker threads and events
+    with no changed stations are not rewritten.
+
+    Args:
+        pdir (str): The parent directory of the specmod spectra pickle file
+        data (dict): A dict containing the decisions from specmod dash as
+            {event: {station: decision}}, ideally only the changed ones.
+        max_workers (int): The size of the worker pool. Default is None
+            (one worker per event up to the number of CPUs).
+        backend (str): The storage backend, "pickle" or "columnar".
+        bases (dict): The states the decisions were based on as
+            {event: {station: state}}, for conflict detection. Default is
+            None.
+
+    Returns:
+        report (dict): The report of write_event_specs for each event.
+    """
+    if not data:
+        return {}
+
+    max_workers = min(len(data), max_workers or os.cpu_count() or 1)
 
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            ev: pool.submit(write_event_specs, pdir, ev, stas, backend,
+                            base=(bases or {}).get(ev))
+            for ev, stas in data.items()
+            }
 
-        sp.write_spectra(format_spectra_path(pdir, ev), sp, method='pickle')
-        print(f"wrote {ev} to file at {format_spectra_path(pdir, ev)}")
+    return {ev: f.result() for ev, f in futures.items()}
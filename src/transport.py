@@ -0,0 +1,83 @@
+"""
+transport.py
+
+    The file with the compact transport of spectral arrays to the browser.
+    The arrays of a figure are sent as base64 encoded float32 typed array
+    specs ({"dtype": "f4", "bdata": ...}, as used by newer plotly.js) and
+    decoded in the browser by specmod.unpack_figure in assets/clientside.js
+    before they reach plotly.js.
+"""
+import base64
+import numpy as np
+
+# the trace keys holding the arrays to pack
+ARRAY_KEYS = ("x", "y")
+
+
+def pack_array(a, dtype: str = "f4") -> dict:
+    """
+    Packs a numeric array as a typed array spec.
+
+    Args:
+        a (array_like): The array.
+        dtype (str): The little-endian type to send. Default is "f4"
+            (float32).
+
+    Returns:
+        spec (dict): The spec with the keys "dtype" and "bdata" (base64).
+    """
+    data = np.ascontiguousarray(a, dtype=np.dtype(dtype).newbyteorder("<"))
+    return {"dtype": dtype, "bdata": base64.b64encode(data).decode("ascii")}
+
+
+def unpack_array(spec: dict) -> np.ndarray:
+    """
+    Unpacks a typed array spec made by pack_array.
+    """
+    return np.frombuffer(base64.b64decode(spec["bdata"]),
+                         dtype=np.dtype(spec["dtype"]).newbyteorder("<"))
+
+
+def is_packed(value) -> bool:
+    return isinstance(value, dict) and "bdata" in value and "dtype" in value
+
+
+def pack_figure(fig, min_size: int = 16) -> dict:
+    """
+    Packs the x and y arrays of every trace of a figure.
+
+    Args:
+        fig (dict or plotly.graph_objects.Figure): The figure.
+        min_size (int): Arrays shorter than this are left as lists (e.g.,
+            the two points of a bandwidth line). Default is 16.
+
+    Returns:
+        fig (dict): A copy of the figure with packed arrays.
+    """
+    if hasattr(fig, "to_plotly_json"):
+        fig = fig.to_plotly_json()
+
+    data = []
+    for trace in fig.get("data", []):
+        trace = dict(trace)
+        for key in ARRAY_KEYS:
+            value = trace.get(key)
+            if value is None or is_packed(value):
+                continue
+            arr = np.asarray(value)
+            if arr.ndim == 1 and arr.size >= min_size and arr.dtype.kind in "fiu":
+                trace[key] = pack_array(arr)
+        data.append(trace)
+
+    return dict(fig, data=data)
+
+
+def unpack_figure(fig: dict) -> dict:
+    """
+    Unpacks the arrays of a figure made by pack_figure.
+    """
+    data = [
+        {k: unpack_array(v) if is_packed(v) else v for k, v in trace.items()}
+        for trace in fig.get("data", [])
+        ]
+    return dict(fig, data=data)
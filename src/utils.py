@@ -2,6 +2,9 @@
 A module that contains utility functions for specmod-dash.
 """
 
+import csv
+import json
+import math
 import yaml 
 import plotly.graph_objects as go
 
@@ -45,8 +48,9 @@ def trace_in_fig(fig: go.Figure, name: str) -> bool:
 
 def is_auto_bandwidth(fig: go.Figure, pos: float) -> bool:
     """
-    Looks at the figure object and tries to find an x value with exactly
-    the same value as pos. This would be the automatic bandwidth value.
+    Looks at the figure object and tries to find an x value with the same
+    value as 10**pos (to within rounding). This would be the automatic 
+    bandwidth value.
     
     Args:
         fig (plotly.graph_ojects.Figure): A figure object to be checked.
@@ -56,15 +60,188 @@ def is_auto_bandwidth(fig: go.Figure, pos: float) -> bool:
         True if the trace is in figure, False otherwise.        
     """
 
+    val = 10**pos
     for trace in fig['data']:
-        if 10**pos == trace['x'][0]:
+        if abs(trace['x'][0] - val) <= 1e-12 * abs(val):
                 return True
 
     return False 
 
+def parse_decision(row: dict, units: str = "log10") -> dict:
+    """
+    Parses a review decision from a row of a decisions file. A row has the
+    keys "snr" (1/0, true/false or yes/no), "min_bf" and "max_bf" (only
+    needed when snr is 1) and optionally "units" ("log10" or "linear" Hz),
+    which overrides the default units.
+
+    Args:
+        row (dict): The row.
+        units (str): The units of the bandwidth. Default is "log10".
+
+    Returns:
+        decision (dict): The decision with the bandwidth in log10 Hz.
+    """
+    flags = {"1": 1, "true": 1, "yes": 1, "0": 0, "false": 0, "no": 0}
+    snr = flags.get(str(row["snr"]).strip().lower())
+    if snr is None:
+        raise ValueError(f"snr must be one of {list(flags)}, not {row['snr']}")
+
+    decision = {"snr": snr, "min bf": None, "max bf": None}
+
+    if snr:
+        units = (row.get("units") or units).strip().lower()
+        if units not in ("log10", "linear"):
+            raise ValueError(f"units must be log10 or linear, not {units}")
+        for k in ("min bf", "max bf"):
+            val = float(row[k.replace(" ", "_")])
+            decision[k] = math.log10(val) if units == "linear" else val
+        if decision["min bf"] >= decision["max bf"]:
+            raise ValueError("min_bf must be below max_bf")
+
+    return decision
+
+
+def read_decisions(path: str, units: str = "log10") -> dict:
+    """
+    Reads review decisions from a CSV file (with a header row) or a JSONL
+    file (one JSON object per line). Each record has the keys "event" and
+    "station" plus the keys described in parse_decision.
+
+    Args:
+        path (str): The decisions file, ".jsonl" files are read as JSONL
+            and any other file as CSV.
+        units (str): The default units of the bandwidth. Default is "log10".
+
+    Returns:
+        data (dict): The decisions as {event: {station: decision}}.
+    """
+    with open(path, "r", newline="") as f:
+        if path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    data = {}
+    for i, row in enumerate(rows, 1):
+        try:
+            decision = parse_decision(row, units)
+            data.setdefault(str(row["event"]), {})[str(row["station"])] = decision
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"{path} record {i}: {e}") from e
+
+    return data
+
+
+def save_message(report: dict) -> str:
+    """
+    Summarises the report returned by write_specs for the user.
+
+    Args:
+        report (dict): The per event report from write_specs.
+
+    Returns:
+        msg (str): The message to show.
+    """
+    saved = [ev for ev, r in report.items() if r["error"] is None]
+    failed = [f"{ev} ({r['error']})" for ev, r in report.items() 
+              if r["error"] is not None]
+
+    msg = ""
+
+    if saved:
+        nbytes = sum(r["bytes"] for r in report.values())
+        secs = max(r["seconds"] for r in report.values())
+        msg += (f"Saved spectra for {saved} "
+                f"({nbytes / 2**20:.1f} MB in {secs:.2f} s). ")
+    if failed:
+        msg += f"Failed to save {failed}."
+
+    return msg.strip()
+
+
+def save_progress(status: dict) -> str:
+    """
+    Summarises the progress of a background save (see src.jobs.JobQueue)
+    for the user.
+
+    Args:
+        status (dict): The status of the save job.
+
+    Returns:
+        msg (str): The message to show.
+    """
+    events = status["events"]
+    states = [e["state"] for e in events.values()]
+    count = {s: states.count(s) for s in set(states)}
+    done = len(states) - count.get("queued", 0) - count.get("running", 0)
+
+    if not status["done"]:
+        return (f"Saving spectra: {done} of {len(states)} event(s) done "
+                f"({count.get('saved', 0)} saved, "
+                f"{count.get('failed', 0)} failed).")
+
+    msg = save_message({ev: e["report"] if e["report"] is not None
+                        else {"error": e["error"], "bytes": 0, "seconds": 0}
+                        for ev, e in events.items()
+                        if e["state"] in ("saved", "failed")})
+
+    cancelled = [ev for ev, e in events.items() if e["state"] == "cancelled"]
+    if cancelled:
+        msg += f" Cancelled {cancelled}."
+    if count.get("failed") or cancelled:
+        msg += " Click retry to save them again."
+
+    return msg.strip()
+
+
 def any_none(*args) -> bool:
     """
     bool
         True if any of the arguments is type None.
     """
-    return [x for x in args if x is None]
\ No newline at end of file
+    return [x for x in args if x is None]
+
+def update_bandwidth_lines(fig: dict, npos: list, snr: int) -> dict:
+    """
+    Draws (or moves) the "new bandwidth start/end" lines of a figure to the
+    slider positions. Positions matching the automatic bandwidth are not
+    drawn. This is the server-side version of the clientside callback
+    specmod.update_bandwidth_lines in assets/clientside.js and the two must
+    be kept in step.
+
+    Args:
+        fig (dict): The figure as a dict (e.g., the dcc.Graph figure).
+        npos (list): The log10 (start, end) slider positions.
+        snr (int): 1 if the spectrum can be modeled, else 0.
+
+    Returns:
+        fig (dict): A shallow copy of fig with the new bandwidth lines.
+    """
+    data = list(fig['data'])
+
+    if snr:
+        for pos, nm in zip(npos, ['start', 'end']):
+
+            name = f"new bandwidth {nm}"
+            x = [10**pos, 10**pos]
+
+            if is_auto_bandwidth({'data': data}, pos):
+                continue
+
+            for i, trace in enumerate(data):
+                if trace.get('name') == name:
+                    data[i] = dict(trace, x=x)
+                    break
+            else:
+                data.append(
+                    {
+                     'type': 'scatter',
+                     'x': x,
+                     'y': [10**r for r in fig['layout']['yaxis']['range']],
+                     'mode': 'lines',
+                     'line': {'width': 3, 'dash': 'dash', 'color': 'green'},
+                     'name': name,
+                    }
+                )
+
+    return dict(fig, data=data)
@@ -0,0 +1,35 @@
+import os
+import sys
+import pytest
+import numpy as np
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+from benchmarks.synthetic import (SyntheticSNP, SyntheticSpectra, 
+                                  SyntheticSpectrum)
+
+
+@pytest.fixture
+def make_spectra():
+    """
+    Makes small stand ins for a SpecMod Spectra (see benchmarks.synthetic)
+    with stations "S0", "S1", ... at the given hypocentral distances. The
+    spectra of each station are one bin longer than the last.
+    """
+    def make(rhyps, ubfreqs=(1.0, 10.0)):
+        group = {}
+        for i, r in enumerate(rhyps):
+            freq = np.linspace(0.1, 10, 50 + i)
+            meta = {"rhyp": r, "repi": r / 2}
+            group[f"S{i}"] = SyntheticSNP(
+                f"S{i}",
+                SyntheticSpectrum(freq, freq * (i + 1), meta),
+                SyntheticSpectrum(freq, freq / 10, dict(meta)),
+                np.array(ubfreqs),
+                )
+        return SyntheticSpectra(group)
+    return make
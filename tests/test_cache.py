@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import threading
+import pytest
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+from src.cache import LRUCache, FileCache
+
+
+def test_lru_eviction():
+    """
+    pytest for the LRUCache. The least recently used entry is
+    expected to be evicted once the memory budget is exceeded.
+    """
+    cache = LRUCache(max_bytes=10)
+    cache.put("a", 1, nbytes=4)
+    cache.put("b", 2, nbytes=4)
+    # touch a so that b is the least recently used
+    assert cache.get("a") == 1
+    cache.put("c", 3, nbytes=4)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 8
+
+
+def test_lru_version_mismatch():
+    """
+    pytest for the LRUCache. An entry looked up with a different
+    version is expected to be a miss and to be dropped.
+    """
+    cache = LRUCache()
+    cache.put("a", 1, version=1)
+
+    assert cache.get("a", version=2) is None
+    assert "a" not in cache
+    assert cache.stats()["misses"] == 1
+
+
+def test_file_cache_reloads_on_rewrite(tmp_path):
+    """
+    pytest for the FileCache. The loader is expected to be called
+    once per file version, so rewriting the file forces a reload.
+    """
+    path = tmp_path / "ev.spec"
+    path.write_text("one")
+    calls = []
+
+    def loader(p):
+        calls.append(p)
+        return open(p).read()
+
+    cache = FileCache()
+    assert cache.load(str(path), loader) == "one"
+    assert cache.load(str(path), loader) == "one"
+    assert len(calls) == 1
+
+    path.write_text("two!")
+    assert cache.load(str(path), loader) == "two!"
+    assert len(calls) == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_file_cache_concurrent_misses(tmp_path):
+    """
+    pytest for concurrent misses on a FileCache. The file is expected to
+    be loaded once, the other lookups to count as hits, and no loading
+    lock to be left behind.
+    """
+    path = tmp_path / "ev.spec"
+    path.write_text("one")
+    calls = []
+
+    def loader(p):
+        calls.append(p)
+        time.sleep(0.05)
+        return open(p).read()
+
+    cache = FileCache()
+    threads = [threading.Thread(target=cache.load, args=(str(path), loader))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 7 and cache.stats()["misses"] == 1
+    assert cache._loading == {}
@@ -0,0 +1,108 @@
+import os
+import sys
+import pytest
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+from src.catalog import EventCatalog
+
+
+def test_catalog_refresh(tmp_path, make_spectra):
+    """
+    pytest for the EventCatalog. Stations are expected to be sorted by
+    distance and an event is expected to be reloaded only when its file
+    changes.
+    """
+    for ev in ("ev1", "ev2"):
+        (tmp_path / ev).mkdir()
+        (tmp_path / ev / "spec").write_text(ev)
+
+    calls = []
+
+    def loader(pdir, ev):
+        calls.append(ev)
+        return make_spectra([30.0, 10.0, 20.0])
+
+    cat = EventCatalog(str(tmp_path), loader=loader, 
+                       spectra_path=lambda pdir, ev: f"{pdir}/{ev}/spec")
+
+    assert cat.refresh() == 2
+    assert [s["id"] for s in cat.stations("ev1")] == ["S1", "S2", "S0"]
+    assert cat.station("ev1", "S2")["repi"] == 10.0
+    assert cat.refresh() == 0
+
+    (tmp_path / "ev1" / "spec").write_text("changed")
+    cat.stations("ev1")
+    assert calls == ["ev1", "ev2", "ev1"]
+
+
+def test_catalog_search(tmp_path, make_spectra):
+    """
+    pytest for EventCatalog.search. Events are expected to be filtered by
+    name, origin date, review status and station count, and paged, and
+    new event directories are expected to show up without a restart.
+    """
+    sizes = {"2012-10-08T12:12:12.760000Z.abc": 3,
+             "2013-01-01T00:00:00.000000Z.abc": 5,
+             "2013-06-01T00:00:00.000000Z.xyz": 1}
+    for ev in sizes:
+        (tmp_path / ev).mkdir()
+        (tmp_path / ev / "spec").write_text(ev)
+
+    cat = EventCatalog(str(tmp_path), rescan_interval=0,
+                       loader=lambda pdir, ev: make_spectra(
+                           [1.0] * sizes[ev]),
+                       spectra_path=lambda pdir, ev: f"{pdir}/{ev}/spec")
+    cat.refresh()
+    names = lambda res: [e["ev"][:4] for e in res[0]]
+
+    assert names(cat.search(start="2013-01-01")) == ["2013", "2013"]
+    assert names(cat.search(end="2013-01-01")) == ["2012", "2013"]
+    assert names(cat.search(query="XYZ")) == ["2013"]
+    # LIKE wildcards in the query are matched literally
+    assert cat.search(query="_")[1] == cat.search(query="%")[1] == 0
+    assert names(cat.search(min_stations=2, max_stations=4)) == ["2012"]
+
+    cat.mark_reviewed(["2012-10-08T12:12:12.760000Z.abc"])
+    assert names(cat.search(status="reviewed")) == ["2012"]
+    assert len(cat.search(status="unreviewed")[0]) == 2
+
+    page, total = cat.search(offset=2, limit=2)
+    assert total == 3 and len(page) == 1
+
+    # new events are listed but have no station count until summarised
+    (tmp_path / "2014-01-01T00:00:00.000000Z.abc").mkdir()
+    page, total = cat.search(query="2014")
+    assert total == 1 and page[0]["nsta"] is None
+
+
+def test_station_index(tmp_path, make_spectra):
+    """
+    pytest for EventCatalog.station_events. A station is expected to be
+    found in every event that recorded it, without loading any spectra
+    once the catalog is built.
+    """
+    for ev in ("ev1", "ev2", "ev3"):
+        (tmp_path / ev).mkdir()
+        (tmp_path / ev / "spec").write_text(ev)
+
+    def loader(pdir, ev):
+        sp = make_spectra([10.0, 20.0, 30.0][:int(ev[-1])])
+        if ev == "ev2":
+            sp.group["S0"].signal.set_pass_snr(False)
+        return sp
+
+    cat = EventCatalog(str(tmp_path), loader=loader,
+                       spectra_path=lambda pdir, ev: f"{pdir}/{ev}/spec")
+    assert cat.refresh() == 3
+
+    cat.loader = None
+    assert cat.station_ids() == [("S0", 3), ("S1", 2), ("S2", 1)]
+    assert [e["ev"] for e in cat.station_events("S1")] == ["ev2", "ev3"]
+    assert [e["ev"] for e in cat.station_events("S0", passed=True)] == [
+        "ev1", "ev3"]
+    assert cat.station_events("S0", limit=1)[0]["rhyp"] == 10.0
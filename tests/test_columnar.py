@@ -0,0 +1,119 @@
+import os
+import sys
+import pytest
+import numpy as np
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+from src.columnar import ColumnStore, write_columns
+
+
+def test_columns_round_trip(tmp_path, make_spectra):
+    """
+    pytest for the columnar store. Each station is expected to read back
+    as memory-mapped views of its own arrays, and saving decisions is
+    expected to leave the array files untouched.
+    """
+    sp = make_spectra([0.0, 1.0, 2.0])
+    path = str(tmp_path / "ev.cols")
+    write_columns(sp, path)
+
+    cols = ColumnStore(path)
+    assert cols.stations() == ["S0", "S1", "S2"]
+
+    snp = cols.get_spectra("S2")
+    assert np.array_equal(snp.signal.amp, sp.group["S2"].signal.amp)
+    assert np.array_equal(snp.noise.freq, sp.group["S2"].noise.freq)
+    assert isinstance(snp.signal.amp.base, np.memmap)
+    assert snp.signal.meta == {"rhyp": 2.0, "repi": 1.0}
+
+    stamp = os.stat(os.path.join(path, "signal_amp.npy")).st_mtime_ns
+    snp.signal.set_pass_snr(False)
+    snp.ubfreqs = np.array([])
+    cols.save_decisions()
+
+    snp = ColumnStore(path).get_spectra("S2")
+    assert not snp.signal.get_pass_snr() and snp.ubfreqs.size == 0
+    assert os.stat(os.path.join(path, "signal_amp.npy")).st_mtime_ns == stamp
+
+
+def test_stale_columns(tmp_path, make_spectra):
+    """
+    pytest for the version check of the columnar store. A store is
+    expected to be skipped once its pickle is rewritten, until it is
+    stamped with the new version, and rewriting it is expected to leave
+    no old directories behind.
+    """
+    from src.cache import file_version
+    from src.columnar import stamp_columns
+    from src.specroutines import (format_columns_path, format_spectra_path,
+                                  use_columns)
+
+    ev = "2012-10-08T12:12:12.760000Z"
+    os.makedirs(tmp_path / ev / "Spectra")
+    pickle_path = format_spectra_path(str(tmp_path), ev)
+    path = format_columns_path(str(tmp_path), ev)
+    with open(pickle_path, "wb") as f:
+        f.write(b"v1")
+
+    write_columns(make_spectra([0.0, 1.0]), path, file_version(pickle_path))
+    assert use_columns(str(tmp_path), ev, "columnar")
+    assert not use_columns(str(tmp_path), ev, "pickle")
+
+    with open(pickle_path, "wb") as f:
+        f.write(b"v2, rewritten")
+    assert not use_columns(str(tmp_path), ev, "columnar")
+
+    stamp_columns(path, file_version(pickle_path))
+    assert use_columns(str(tmp_path), ev, "columnar")
+
+    write_columns(make_spectra([0.0, 1.0, 2.0]), path,
+                  file_version(pickle_path))
+    assert ColumnStore(path).stations() == ["S0", "S1", "S2"]
+    assert sorted(os.listdir(tmp_path / ev / "Spectra")) == sorted(
+        [os.path.basename(path), os.path.basename(pickle_path)])
+
+
+def test_convert_keeps_unfolded_decisions(tmp_path, monkeypatch, capsys,
+                                          make_spectra):
+    """
+    pytest for converting an event again. Decisions saved to the columnar
+    store that are not in the pickle are expected to stop the conversion,
+    even with --force, unless they are discarded.
+    """
+    import convert
+    import src.specroutines
+    from src.cache import file_version
+    from src.specroutines import (format_columns_path, format_spectra_path,
+                                  unfolded_stations)
+
+    ev = "2012-10-08T12:12:12.760000Z"
+    os.makedirs(tmp_path / ev / "Spectra")
+    pdir, sp = str(tmp_path), make_spectra([0.0, 1.0])
+    pickle_path = format_spectra_path(pdir, ev)
+    path = format_columns_path(pdir, ev)
+    with open(pickle_path, "wb") as f:
+        f.write(b"v1")
+    monkeypatch.setattr(src.specroutines, "read_spectra", lambda p: sp)
+
+    write_columns(sp, path, file_version(pickle_path))
+    cols = ColumnStore(path)
+    cols.get_spectra("S1").signal.set_pass_snr(False)
+    cols.save_decisions()
+    assert unfolded_stations(pdir, ev) == ["S1"]
+
+    # e.g., a new SpecMod run
+    with open(pickle_path, "wb") as f:
+        f.write(b"v2, rewritten")
+    for flags in ([], ["--force"]):
+        convert.main([ev, "--pdir", pdir] + flags)
+        assert "1 station(s)" in capsys.readouterr().out
+        assert not ColumnStore(path).get_spectra("S1").signal.get_pass_snr()
+
+    convert.main([ev, "--pdir", pdir, "--discard"])
+    assert ColumnStore(path).get_spectra("S1").signal.get_pass_snr()
+    assert unfolded_stations(pdir, ev) == []
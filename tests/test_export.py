@@ -0,0 +1,90 @@
+import os
+import sys
+import pytest
+import numpy as np
+from types import SimpleNamespace
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+import src.export
+from src.export import export, changed_events, read_state
+from src.utils import read_decisions
+
+
+@pytest.fixture
+def events(tmp_path, monkeypatch, make_spectra):
+    for ev in ("ev1", "ev2"):
+        (tmp_path / ev).mkdir()
+        (tmp_path / ev / "spec").write_text(ev)
+    monkeypatch.setattr(src.export, "get_event_spectra",
+        lambda pdir, ev, cached=True, backend="pickle": 
+            make_spectra([20.0, 10.0]))
+    monkeypatch.setattr(src.export, "source_path",
+        lambda pdir, ev, backend="pickle": f"{pdir}/{ev}/spec")
+    return tmp_path
+
+
+def test_export_csv(events):
+    """
+    pytest for export to CSV. The decisions are expected to be read back
+    by batch_review.py and only changed events to be exported again.
+    """
+    pdir, out = str(events), str(events / "out.csv")
+    state = str(events / "state.json")
+
+    report = export(pdir, out, ["ev1", "ev2"], state=state)
+    assert report["rows"] == 4 and not report["failed"]
+
+    data = read_decisions(out)
+    assert list(data["ev1"]) == ["S1", "S0"]
+    assert data["ev2"]["S0"]["snr"] == 1
+    assert data["ev2"]["S0"]["max bf"] == pytest.approx(1.0)
+
+    assert changed_events(pdir, ["ev1", "ev2"], read_state(state)) == []
+    (events / "ev2" / "spec").write_text("changed")
+    assert changed_events(pdir, ["ev1", "ev2"], read_state(state)) == ["ev2"]
+
+
+def test_export_parquet(events):
+    """
+    pytest for export to Parquet, one row group per event with the
+    spectra as float32 lists.
+    """
+    pq = pytest.importorskip("pyarrow.parquet")
+    out = str(events / "out.parquet")
+
+    export(str(events), out, ["ev1", "ev2"], spectra=True)
+
+    f = pq.ParquetFile(out)
+    assert f.metadata.num_row_groups == 2
+    table = f.read()
+    assert table.column("station").to_pylist() == ["S1", "S0"] * 2
+    # the first row is S1, whose spectra have 51 bins
+    assert np.allclose(table.column("noise_amp").to_pylist()[0],
+                       np.linspace(0.1, 10, 51) / 10)
+
+
+def test_export_route_without_pyarrow(events, monkeypatch):
+    """
+    pytest for the export route. A Parquet export without pyarrow is
+    expected to fail the request rather than start a download.
+    """
+    import flask
+    from src.export import add_export_route
+
+    def missing(sink, spectra=False):
+        raise ImportError("exporting to Parquet needs pyarrow")
+
+    monkeypatch.setattr(src.export, "ParquetWriter", missing)
+    app = SimpleNamespace(server=flask.Flask(__name__))
+    add_export_route(app, str(events), lambda: ["ev1", "ev2"])
+    client = app.server.test_client()
+
+    assert client.get("/export/decisions.parquet").status_code == 404
+    response = client.get("/export/decisions.csv")
+    assert response.status_code == 200
+    assert response.data.decode().count("\n") == 5
@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import threading
+import pytest
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+from src.jobs import JobQueue
+from src.utils import save_progress
+
+
+def wait(jobs, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not jobs.status(job_id)["done"]:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return jobs.status(job_id)
+
+
+def test_job_cancel_and_retry():
+    """
+    pytest for the JobQueue. Queued events are expected to be cancelled
+    while the running one finishes, and failed and cancelled events to be
+    saved when retried.
+    """
+    release = threading.Event()
+    attempts = {"ev2": 0}
+
+    def blocked():
+        release.wait(5)
+        return {"error": None, "bytes": 10, "seconds": 0.1}
+
+    def flaky():
+        attempts["ev2"] += 1
+        if attempts["ev2"] == 1:
+            raise OSError("disk full")
+        return {"error": None, "bytes": 10, "seconds": 0.1}
+
+    ok = lambda: {"error": None, "bytes": 10, "seconds": 0.1}
+
+    jobs = JobQueue(max_workers=1)
+    job_id = jobs.submit({"ev1": blocked, "ev2": flaky, "ev3": ok})
+    while jobs.status(job_id)["events"]["ev1"]["state"] != "running":
+        time.sleep(0.01)
+    assert "0 of 3" in save_progress(jobs.status(job_id))
+
+    assert jobs.cancel(job_id) == 2
+    release.set()
+    status = wait(jobs, job_id)
+    assert [e["state"] for e in status["events"].values()] == [
+        "saved", "cancelled", "cancelled"]
+    assert "retry" in save_progress(status)
+
+    # the first retry of ev2 fails, the second saves it
+    for expected in ("failed", "saved"):
+        assert jobs.retry(job_id) >= 1
+        status = wait(jobs, job_id)
+        assert status["events"]["ev2"]["state"] == expected
+    assert status["events"]["ev3"]["state"] == "saved"
+    assert jobs.retry(job_id) == 0
+    jobs.shutdown()
+
+
+def test_job_shared_between_processes(tmp_path):
+    """
+    pytest for a JobQueue with a database. A job is expected to be
+    followed from a second queue on the same file (as in a second worker
+    process), and its queued events to be cancelled from there.
+    """
+    path = str(tmp_path / "sessions.sqlite")
+    a, b = JobQueue(max_workers=1, path=path), JobQueue(path=path)
+    release = threading.Event()
+
+    def blocked():
+        release.wait(5)
+        return {"error": None, "bytes": 10, "seconds": 0.1}
+
+    ok = lambda: {"error": None, "bytes": 10, "seconds": 0.1}
+
+    job_id = a.submit({"ev1": blocked, "ev2": ok})
+    while b.status(job_id)["events"]["ev1"]["state"] != "running":
+        time.sleep(0.01)
+    assert b.status(job_id)["events"]["ev2"]["state"] == "queued"
+
+    assert b.cancel(job_id) == 1
+    release.set()
+    status = wait(b, job_id)
+    assert status["events"]["ev1"]["report"]["bytes"] == 10
+    assert status["events"]["ev2"]["state"] == "cancelled"
+    assert wait(a, job_id)["events"]["ev2"]["state"] == "cancelled"
+    assert b.status("unknown") is None
+    a.shutdown()
@@ -0,0 +1,51 @@
+import os
+import sys
+import pytest
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+from src.journal import ReviewJournal, format_journal_path, set_record
+from src.session import MemorySessionStore
+
+
+def test_journal_replay_and_compact(tmp_path):
+    """
+    pytest for the ReviewJournal. Replaying a journal (with a record torn
+    by a crash) is expected to restore the staged decisions, and compacting
+    it to drop only the saved session's records read before saving.
+    """
+    (tmp_path / "ev1").mkdir()
+    journal = ReviewJournal(str(tmp_path))
+    on_file = {"snr": 1, "min bf": 0.0, "max bf": 1.0}
+    staged = {"snr": 0, "min bf": 0.0, "max bf": 1.0}
+
+    journal.set("s", "ev1", "A", staged, on_file, 
+                {"snr": 1, "ubfreqs": [1, 10]})
+    journal.set("s", "ev1", "B", on_file, on_file)
+    journal.append("ev1", [set_record("t", "B", staged, on_file)])
+    with open(format_journal_path(str(tmp_path), "ev1"), "a") as f:
+        f.write('{"op": "set", "sid": "s", "st')
+
+    store = MemorySessionStore()
+    assert journal.events() == ["ev1"]
+    assert journal.replay(store) == 3
+    # the stations are seeded with what was read from file first
+    assert store.dirty("s") == {"ev1": {"A": staged}}
+    assert store.bases("s")["ev1"]["A"]["ubfreqs"] == [1, 10]
+    assert store.dirty("t") == {"ev1": {"B": staged}}
+    # replaying again changes nothing
+    journal.replay(store)
+    assert store.dirty("s") == {"ev1": {"A": staged}}
+
+    upto = len(journal.read("ev1"))
+    journal.set("s", "ev1", "B", staged)
+    journal.compact("ev1", ["s"], upto)
+    assert [(r["sid"], r["sta"]) for r in journal.read("ev1")] == [
+        ("t", "B"), ("s", "B")]
+
+    journal.compact("ev1", ["s", "t"])
+    assert journal.events() == []
@@ -0,0 +1,41 @@
+import os
+import sys
+import pytest
+import threading
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+from src.locks import file_lock, LockTimeout, fcntl
+
+
+@pytest.mark.skipif(fcntl is None, reason="flock is not available")
+def test_file_lock_excludes(tmp_path):
+    """
+    pytest for file_lock. A second holder (here another thread) is
+    expected to time out while the lock is held and to get it after.
+    """
+    path = str(tmp_path / "ev.lock")
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with file_lock(path):
+            held.set()
+            release.wait()
+
+    t = threading.Thread(target=hold)
+    t.start()
+    held.wait()
+
+    with pytest.raises(LockTimeout):
+        with file_lock(path, timeout=0.1):
+            pass
+
+    release.set()
+    t.join()
+
+    with file_lock(path, timeout=0.1):
+        pass
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import json
+import pytest
+import flask
+from dash.exceptions import PreventUpdate
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+from src.metrics import Metrics, add_metrics_route
+
+
+def test_wrap_callback_records_phases_and_sizes():
+    """
+    pytest for Metrics.wrap_callback. The wall time, the time of the
+    phases and the response size are expected in the Prometheus output,
+    and prevented updates are counted separately.
+    """
+    metrics = Metrics()
+    load = metrics.timed("io", lambda: time.sleep(0.01))
+
+    def callback(x):
+        if x is None:
+            raise PreventUpdate
+        load()
+        return json.dumps({"response": x})
+
+    wrapped = metrics.wrap_callback(callback)
+
+    assert wrapped(1) == '{"response": 1}'
+    with pytest.raises(PreventUpdate):
+        wrapped(None)
+
+    # outside a callback a timed function records nothing
+    load()
+
+    text = metrics.render()
+
+    assert 'specmod_callback_seconds_count{callback="callback"} 2' in text
+    assert ('specmod_callback_phase_seconds_count'
+            '{callback="callback",phase="io"} 1') in text
+    assert ('specmod_callback_response_bytes_sum{callback="callback"} 15.0'
+            in text)
+    assert 'specmod_callback_total{callback="callback",status="ok"} 1' in text
+    assert ('specmod_callback_total{callback="callback",status="prevented"} 1'
+            in text)
+
+
+def test_metrics_route_is_local():
+    """
+    pytest for add_metrics_route. Remote requests are expected to be
+    refused unless allowed.
+    """
+    app = type("App", (), {"server": flask.Flask(__name__)})()
+    metrics = Metrics()
+    metrics.add_gauges("cache", lambda: {"hits": 3, "hit rate": 0.5})
+    add_metrics_route(app, metrics)
+
+    client = app.server.test_client()
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert "specmod_cache_hit_rate 0.5" in resp.get_data(as_text=True)
+
+    resp = client.get("/metrics", environ_base={"REMOTE_ADDR": "10.0.0.2"})
+    assert resp.status_code == 403
@@ -0,0 +1,126 @@
+import os
+import sys
+import pytest
+import numpy as np
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+from src.numerics import (decimate_log, decimate_log_rows, log_bin_rows,
+    suggest_bands, widest_runs, smoothing_matrix, smooth_rows)
+
+
+def test_decimate_log():
+    """
+    pytest for the decimate_log function. The decimated spectrum is
+    expected to be at most the target size (plus the end points), to stay
+    in frequency order and to keep the extremes of the spectrum.
+    """
+    freq = np.linspace(0, 50, 10001)
+    amp = np.exp(np.random.default_rng(0).normal(size=freq.size))
+
+    f, a = decimate_log(freq, amp, 200)
+
+    assert f.size <= 202
+    assert np.all(np.diff(f) > 0)
+    assert f[0] == freq[1] and f[-1] == freq[-1]
+    assert a.max() == amp[1:].max() and a.min() == amp[1:].min()
+
+
+def test_decimate_log_short():
+    """
+    pytest for the decimate_log function. Spectra shorter than the
+    target are expected to be returned unchanged.
+    """
+    freq, amp = np.arange(1, 11.), np.ones(10)
+
+    f, a = decimate_log(freq, amp, 100)
+
+    assert np.array_equal(f, freq) and np.array_equal(a, amp)
+
+
+def test_decimate_log_rows():
+    """
+    pytest for the decimate_log_rows function. Every row is expected to
+    keep the same points as decimating it on its own with decimate_log.
+    """
+    freq = np.linspace(0, 50, 5001)
+    amps = np.exp(np.random.default_rng(1).normal(size=(4, freq.size)))
+
+    fs, a = decimate_log_rows(freq, amps, 100)
+
+    for row in range(amps.shape[0]):
+        f1, a1 = decimate_log(freq, amps[row], 100)
+        assert np.array_equal(np.unique(fs[row]), f1)
+        assert np.all(np.diff(fs[row]) >= 0)
+        assert set(a[row]) == set(a1)
+
+
+def test_widest_runs():
+    """
+    pytest for the widest_runs function. The widest run of each row is
+    expected, and -1 for rows with no True value.
+    """
+    mask = np.array([[0, 1, 1, 0, 1, 1, 1, 0],
+                     [1, 1, 0, 0, 0, 0, 1, 1],
+                     [0, 0, 0, 0, 0, 0, 0, 0]], dtype=bool)
+
+    start, stop = widest_runs(mask)
+
+    assert start.tolist() == [4, 0, -1]
+    assert stop.tolist() == [7, 2, -1]
+
+
+def test_suggest_bands():
+    """
+    pytest for the suggest_bands function on log-binned spectra. A signal
+    above the noise between 1 and 10 Hz is expected to pass with that
+    band, and a signal buried in the noise to fail.
+    """
+    freq = np.linspace(0, 100, 20001)
+    edges = np.geomspace(0.1, 100, 31)
+    noise = np.full(freq.size, 1.0)
+    good = np.where((freq >= 1) & (freq <= 10), 10.0, 1.0)
+
+    signal = log_bin_rows(freq, np.vstack([good, noise]), edges)
+    passed, lo, hi = suggest_bands(
+        edges, signal, log_bin_rows(freq, np.vstack([noise, noise]), edges))
+
+    assert passed.tolist() == [True, False]
+    assert lo[0] == pytest.approx(0, abs=0.1)
+    assert hi[0] == pytest.approx(1, abs=0.1)
+    assert np.isnan(lo[1])
+
+
+def test_smooth_rows():
+    """
+    pytest for the smooth_rows function. Each smoothed value is expected
+    to be the window weighted mean of its neighbours on log frequency,
+    rows to be smoothed as single spectra are and the matrix of a grid to
+    be cached.
+    """
+    pytest.importorskip("scipy")
+    freq = np.linspace(0, 50, 2001)
+    amps = np.random.default_rng(0).lognormal(size=(3, freq.size))
+
+    smoothed = smooth_rows(freq, amps, "konno-ohmachi", b=40)
+    assert np.allclose(smoothed[1], smooth_rows(freq, amps[1], b=40))
+    # zero frequency is left as it is
+    assert smoothed[0, 0] == amps[0, 0]
+
+    i = 1000
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = np.log10(freq / freq[i])
+        w = np.where(np.abs(x) < np.pi / 40, 
+                     np.sinc(40 * x / np.pi) ** 4, 0)
+    assert smoothed[0, i] == pytest.approx((w * amps[0]).sum() / w.sum())
+
+    box = smooth_rows(freq, amps, "log-boxcar", decades=0.2)
+    near = np.abs(x) <= 0.1
+    assert box[2, i] == pytest.approx(amps[2, near].mean())
+
+    assert smoothing_matrix(freq) is smoothing_matrix(freq.copy())
+    assert smooth_rows(freq, amps, None) is amps
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import pytest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+from src.prefetch import Prefetcher
+
+
+def test_prefetch_hits_and_cancels():
+    """
+    pytest for the Prefetcher. Scheduled tasks are expected to be served
+    from the cache, and queued tasks that are no longer wanted are
+    expected to be cancelled.
+    """
+    gate = threading.Event()
+    pf = Prefetcher(max_workers=1)
+
+    def task(k):
+        def run():
+            gate.wait(5)
+            return [(k, k.upper(), 1)]
+        return run
+
+    pf.schedule({k: task(k) for k in "abc"})
+    while not pf._pending["a"].running():
+        time.sleep(0.001)
+    # a is running, b and c are queued, jumping to x cancels them
+    pf.schedule({"x": task("x")})
+    gate.set()
+
+    assert pf.get("x", "x") in ("X", None)
+    pf._pool.shutdown(wait=True)
+
+    assert pf.get("x") == "X"
+    assert pf.get("b") is None
+    stats = pf.stats()
+    assert stats["cancelled"] == 2
+    assert stats["hits"] >= 1 and stats["requests"] == 3
+
+
+def test_prefetch_markers_follow_other_cache():
+    """
+    pytest for prefetch markers. A marker is expected to be a hit only
+    while what its task built is still in the other cache, and its task
+    is expected to be scheduled again once that is evicted.
+    """
+    built = set()
+    pf = Prefetcher(max_workers=1, alive=lambda key: key in built)
+
+    def task():
+        built.add("fig")
+        return [("t", "fig", 0)]
+
+    pf.schedule({"t": task})
+    pf._pool.shutdown(wait=True)
+    assert pf.get("t") == "fig"
+
+    built.clear()
+    assert pf.get("t") is None
+    assert pf.stats()["hits"] == 1
+
+    pf._pool = ThreadPoolExecutor(max_workers=1)
+    pf.schedule({"t": task})
+    pf._pool.shutdown(wait=True)
+    assert pf.get("t") == "fig" and pf.stats()["scheduled"] == 2
+
+
+def test_prefetch_failure_logged(caplog):
+    """
+    pytest for failing prefetch tasks. The error is expected to be logged
+    and counted.
+    """
+    pf = Prefetcher(max_workers=1)
+
+    def broken():
+        raise OSError("cannot read spectra")
+
+    pf.schedule({"t": broken})
+    pf._pool.shutdown(wait=True)
+
+    assert pf.stats()["failed"] == 1
+    assert "cannot read spectra" in caplog.text
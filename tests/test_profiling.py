@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+import pstats
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+from src.profiling import Profiler, list_profiles
+
+
+def test_profiler_callbacks(tmp_path):
+    """
+    pytest for Profiler with chosen callbacks. Every call of a chosen
+    callback is expected to be saved as a .prof file and other callbacks
+    to be left unwrapped.
+    """
+    profiler = Profiler(str(tmp_path), callbacks=["chosen"], mode="cprofile")
+
+    def chosen(x):
+        return sum(range(x))
+
+    def other():
+        pass
+
+    assert profiler.wrap(other) is other
+    assert profiler.wrap(chosen)(1000) == sum(range(1000))
+
+    profiles = list_profiles(str(tmp_path))
+    assert [p["callback"] for p in profiles] == ["chosen"]
+    stats = pstats.Stats(str(tmp_path / profiles[0]["file"]))
+    assert any(f[2] == "chosen" for f in stats.stats)
+
+
+def test_profiler_slowest(tmp_path):
+    """
+    pytest for Profiler with slowest set. Only calls slower than the
+    recent calls are expected to be kept, as collapsed stacks, and the
+    oldest profiles to be removed above the size cap.
+    """
+    profiler = Profiler(str(tmp_path), slowest=5, min_calls=20,
+                        interval=0.001, max_mb=1e-9)
+    wait = profiler.wrap(time.sleep, "wait")
+
+    for _ in range(20):
+        wait(0)
+    assert list_profiles(str(tmp_path)) == []
+
+    wait(0.05)
+    profiles = list_profiles(str(tmp_path))
+    assert len(profiles) == 1 and profiles[0]["ms"] >= 50
+    with open(tmp_path / profiles[0]["file"]) as f:
+        lines = f.read().splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+    wait(0.05)
+    assert len(list_profiles(str(tmp_path))) == 1
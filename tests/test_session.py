@@ -0,0 +1,94 @@
+import os
+import sys
+import pytest
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+from src.session import MemorySessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore()
+    return SQLiteSessionStore(str(tmp_path / "sessions.sqlite"))
+
+
+def test_dirty_decisions(store):
+    """
+    pytest for the dirty tracking of the session stores. Only decisions
+    that differ from what was read from file (or last saved) are expected
+    to be returned by dirty.
+    """
+    on_file = {"snr": 1, "min bf": 0.0, "max bf": 1.0}
+
+    store.seed("s", "ev1", "A", on_file)
+    store.seed("s", "ev1", "B", on_file)
+    store.seed("s", "ev2", "C", {"snr": 0, "min bf": 0.0, "max bf": 1.0})
+    assert store.dirty("s") == {}
+
+    store.set("s", "ev1", "A", {"snr": 0, "min bf": 0.0, "max bf": 1.0})
+    # the bandwidth of a station that cannot be modeled is not saved
+    store.set("s", "ev2", "C", {"snr": 0, "min bf": 0.5, "max bf": 1.0})
+    assert store.dirty("s") == {
+        "ev1": {"A": {"snr": 0, "min bf": 0.0, "max bf": 1.0}}}
+    # sessions are kept apart
+    assert store.dirty("t") == {}
+
+    store.mark_saved("s", store.dirty("s"))
+    assert store.dirty("s") == {}
+
+
+def test_bases_shared_between_stores(tmp_path):
+    """
+    pytest for the SQLiteSessionStore. Two stores on the same file (as in
+    two worker processes) are expected to see the same decisions and
+    bases.
+    """
+    path = str(tmp_path / "sessions.sqlite")
+    a, b = SQLiteSessionStore(path), SQLiteSessionStore(path)
+    state = {"snr": 1, "ubfreqs": [1.0, 10.0]}
+
+    a.seed("s", "ev1", "A", {"snr": 1, "min bf": 0.0, "max bf": 1.0}, state)
+    b.set("s", "ev1", "A", {"snr": 0, "min bf": 0.0, "max bf": 1.0})
+
+    assert a.dirty("s") == {
+        "ev1": {"A": {"snr": 0, "min bf": 0.0, "max bf": 1.0}}}
+    assert b.bases("s") == {"ev1": {"A": state}}
+
+    b.rebase("s", {"ev1": {"A": {"snr": 0, "ubfreqs": []}}})
+    assert a.bases("s")["ev1"]["A"]["snr"] == 0
+
+    a.clear("s")
+    assert b.decisions("s") == {}
+
+
+def test_prune_idle_sessions(store, monkeypatch):
+    """
+    pytest for the pruning of idle sessions. Sessions unseen for longer
+    than the idle time are expected to be forgotten unless they have
+    unsaved decisions, and sessions seen since are expected to be kept.
+    """
+    import src.session
+
+    on_file = {"snr": 1, "min bf": 0.0, "max bf": 1.0}
+    now = [1000.0]
+    monkeypatch.setattr(src.session.time, "time", lambda: now[0])
+
+    store.seed("idle", "ev1", "A", on_file)
+    store.seed("unsaved", "ev1", "A", on_file)
+    store.set("unsaved", "ev1", "A", dict(on_file, snr=0))
+    store.seed("active", "ev1", "A", on_file)
+
+    now[0] += 7200
+    store.set("active", "ev1", "A", on_file)
+    assert sorted(store.prune(3600)) == ["idle"]
+
+    assert store.decisions("idle") == {}
+    assert store.dirty("unsaved") == {"ev1": {"A": dict(on_file, snr=0)}}
+    assert store.get("active", "ev1", "A") == on_file
+    assert store.prune(3600) == []
@@ -0,0 +1,65 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+from src.specplot import make_base_fig, make_overlays, layer_fig, make_fig
+from src.cache import content_key
+
+
+def test_layered_figure():
+    """
+    pytest for make_base_fig, make_overlays and layer_fig. Layering the
+    decision over a base figure is expected to leave the base (which is
+    shared through the figure cache) untouched and to match make_fig.
+    """
+    freq = np.logspace(-1, 2, 200)
+    samp, namp = 1 / freq, 0.1 / freq
+
+    base = make_base_fig(freq, samp, freq, namp, max_points=50)
+    ntraces = len(base["data"])
+
+    fig = layer_fig(base, make_overlays(
+        base, 1, (0.0, 1.0), {"snr": 1, "min bf": 0.2, "max bf": 0.8}))
+    assert len(base["data"]) == ntraces and "shapes" not in base["layout"]
+    assert [t["name"] for t in fig["data"]] == [
+        "noise", "signal", "bandwidth", "bandwidth"]
+    assert fig["data"][0]["x"] is base["data"][0]["x"]
+    assert len(fig["layout"]["shapes"]) == 1
+
+    # a station that cannot be modeled has no bandwidth lines
+    fig = layer_fig(base, make_overlays(base, 0, (0.0, 1.0)))
+    assert len(fig["data"]) == ntraces
+
+    ref = make_fig(freq, samp, freq, namp, 1, (0.0, 1.0), max_points=50)
+    assert np.allclose(ref.data[2].y, 10 ** np.array(
+        base["layout"]["yaxis"]["range"]))
+    assert ref.layout.xaxis.type == "log"
+
+    assert content_key("ev", "A", (1, 2, 3)) == content_key("ev", "A", (1, 2, 3))
+    assert content_key("ev", "A", (1, 2, 3)) != content_key("ev", "A", (1, 2, 4))
+
+
+def test_zero_hz_bin():
+    """
+    pytest for spectra on linear FFT bins from 0 Hz. The axis range and
+    the slider limits are expected to be finite.
+    """
+    from types import SimpleNamespace
+    from src.specplot import get_min_max_freqs
+
+    freq = np.linspace(0, 50, 2048)
+    samp, namp = 1 / (1 + freq), 0.1 / (1 + freq)
+
+    with np.errstate(all="raise"):
+        fig = make_base_fig(freq, samp, freq, namp, max_points=50)
+        mn, mx = get_min_max_freqs(
+            SimpleNamespace(signal=SimpleNamespace(freq=freq)))
+    assert np.isfinite(fig["layout"]["xaxis"]["range"]).all()
+    assert np.isfinite([mn, mx]).all() and mn < mx
@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+import shutil
+import pytest
+import subprocess
+import numpy as np
+
+# make src visible to pytest
+module_path = os.path.abspath(os.path.join('../src'))
+if module_path not in sys.path:
+    sys.path.insert(1, module_path)
+
+
+from src.transport import pack_figure, unpack_figure
+
+
+def _fig():
+    freq = np.geomspace(0.1, 50, 500)
+    return {
+        "data": [
+            {"type": "scatter", "name": "signal", "x": freq, "y": 1 / freq},
+            {"type": "scatter", "name": "bandwidth", "x": [1, 1], "y": [0, 1]},
+        ],
+        "layout": {"xaxis": {"type": "log"}},
+    }
+
+
+def test_pack_figure_round_trip():
+    """
+    pytest for pack_figure and unpack_figure. Long arrays are expected to
+    be packed as float32 and short ones left alone, and the packed figure
+    to be much smaller as JSON.
+    """
+    fig = _fig()
+    packed = pack_figure(fig)
+
+    assert packed["data"][0]["x"]["dtype"] == "f4"
+    assert packed["data"][1]["x"] == [1, 1]
+    assert packed["layout"] == fig["layout"]
+
+    text = json.dumps({"data": [dict(t, x=list(t["x"]), y=list(t["y"])) 
+                                for t in fig["data"]]})
+    assert len(json.dumps(packed)) < len(text) / 2
+
+    out = unpack_figure(json.loads(json.dumps(packed)))
+    assert np.allclose(out["data"][0]["x"], fig["data"][0]["x"], rtol=1e-6)
+    assert np.allclose(out["data"][0]["y"], fig["data"][0]["y"], rtol=1e-6)
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_clientside_unpack_figure():
+    """
+    pytest for the clientside unpack_figure in assets/clientside.js. It is
+    expected to decode the arrays packed by pack_figure.
+    """
+    js = os.path.join(os.path.dirname(__file__), "..", "assets", "clientside.js")
+    runner = (
+        "global.window = {dash_clientside: {no_update: null}};"
+        f"require({json.dumps(os.path.abspath(js))});"
+        "const f = window.dash_clientside.specmod.unpack_figure;"
+        "const fig = f(JSON.parse(process.argv[1]));"
+        "console.log(JSON.stringify(fig.data.map("
+        "t => ({x: Array.from(t.x), y: Array.from(t.y)}))));"
+    )
+    fig = _fig()
+    out = subprocess.run(
+        ["node", "-e", runner, json.dumps(pack_figure(fig))],
+        capture_output=True, text=True, check=True).stdout
+
+    for js_trace, trace in zip(json.loads(out), fig["data"]):
+        assert js_trace["x"] == pytest.approx(list(trace["x"]), rel=1e-6)
+        assert js_trace["y"] == pytest.approx(list(trace["y"]), rel=1e-6)
@@ -1,6 +1,9 @@
 import os
 import sys
+import json
+import shutil
 import pytest
+import subprocess
 
 # make src visible to pytest
 module_path = os.path.abspath(os.path.join('../src'))
@@ -21,4 +24,108 @@ def test_any_none():
     args = None, "a", 1, 1.1, [], {}, True 
 
     assert len(any_none(*args)) > 0 
-    assert len(any_none(*args[1:])) == 0
\ No newline at end of file
+    assert len(any_none(*args[1:])) == 0
+
+def _bandwidth_fig():
+    """
+    A figure dict with an automatic bandwidth line at 10 ** 0.5 Hz.
+    """
+    return {
+        'data': [
+            {'name': 'signal', 'x': [0.1, 1.0, 10.0], 'y': [1, 2, 3]},
+            {'name': 'bandwidth', 'x': [10**0.5, 10**0.5], 'y': [1, 3]},
+            ],
+        'layout': {'yaxis': {'range': [0, 1]}},
+    }
+
+
+def test_update_bandwidth_lines():
+    """
+    pytest for the update_bandwidth_lines function. Moving the slider
+    is expected to add the new bandwidth lines once and then move them,
+    except at the automatic bandwidth position or when the spectrum
+    cannot be modeled.
+    """
+    fig = _bandwidth_fig()
+
+    new = update_bandwidth_lines(fig, [0.5, 1.0], 1)
+    names = [t['name'] for t in new['data']]
+    assert names == ['signal', 'bandwidth', 'new bandwidth end']
+    assert new['data'][-1]['x'] == [10.0, 10.0]
+    assert new['data'][-1]['y'] == [1, 10]
+    # the input figure is left untouched
+    assert len(fig['data']) == 2
+
+    new = update_bandwidth_lines(new, [0.0, 1.5], 1)
+    assert len(new['data']) == 4
+    assert new['data'][2]['x'] == [10**1.5, 10**1.5]
+
+    assert update_bandwidth_lines(fig, [0.0, 1.0], 0)['data'] == fig['data']
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_clientside_bandwidth_lines():
+    """
+    pytest for the clientside port of update_bandwidth_lines in
+    assets/clientside.js. Both are expected to give the same figure.
+    """
+    js = os.path.join(os.path.dirname(__file__), "..", "assets", "clientside.js")
+    runner = (
+        "global.window = {dash_clientside: {no_update: null}};"
+        f"require({json.dumps(os.path.abspath(js))});"
+        "const a = JSON.parse(process.argv[1]);"
+        "const f = window.dash_clientside.specmod.update_bandwidth_lines;"
+        "let fig = a.fig;"
+        "for (const p of a.steps) { fig = f(p, fig, {snr: 1}); }"
+        "console.log(JSON.stringify(fig));"
+    )
+    steps = [[0.5, 1.0], [0.25, 1.5], [0.5, 0.75]]
+    args = json.dumps({'fig': _bandwidth_fig(), 'steps': steps})
+
+    out = subprocess.run(["node", "-e", runner, args], 
+        capture_output=True, text=True, check=True).stdout
+
+    fig = _bandwidth_fig()
+    for step in steps:
+        fig = update_bandwidth_lines(fig, step, 1)
+
+    js_fig = json.loads(out)
+    assert [t['name'] for t in js_fig['data']] == [t['name'] for t in fig['data']]
+    for js_trace, trace in zip(js_fig['data'], fig['data']):
+        assert js_trace['x'] == pytest.approx(trace['x'])
+        assert js_trace['y'] == pytest.approx(trace['y'])
+
+
+def test_read_decisions(tmp_path):
+    """
+    pytest for the read_decisions function. CSV and JSONL files are
+    expected to give the same decisions, with linear bandwidths
+    converted to log10.
+    """
+    csv_path = tmp_path / "dec.csv"
+    csv_path.write_text(
+        "event,station,snr,min_bf,max_bf,units\n"
+        "ev1,A,1,0,1,\n"
+        "ev1,B,no,,,\n"
+        "ev2,C,yes,1,100,linear\n"
+        )
+    jsonl_path = tmp_path / "dec.jsonl"
+    jsonl_path.write_text(
+        '{"event": "ev1", "station": "A", "snr": 1, "min_bf": 0, "max_bf": 1}\n'
+        '{"event": "ev1", "station": "B", "snr": false}\n'
+        '{"event": "ev2", "station": "C", "snr": true, "min_bf": 1, '
+        '"max_bf": 100, "units": "linear"}\n'
+        )
+
+    expected = {
+        "ev1": {"A": {"snr": 1, "min bf": 0.0, "max bf": 1.0},
+                "B": {"snr": 0, "min bf": None, "max bf": None}},
+        "ev2": {"C": {"snr": 1, "min bf": 0.0, "max bf": 2.0}},
+        }
+
+    assert read_decisions(str(csv_path)) == expected
+    assert read_decisions(str(jsonl_path)) == expected
+
+    csv_path.write_text("event,station,snr,min_bf,max_bf\nev1,A,1,2,1\n")
+    with pytest.raises(ValueError):
+        read_decisions(str(csv_path))